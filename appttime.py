@@ -0,0 +1,19 @@
+# appttime.py — inicio de un turno guardado en los stores (db.py, sharedstore.py)
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+def parse_start(appt: Dict[str, Any]) -> Optional[datetime]:
+    """start_at del turno como datetime con huso (UTC si no trae); None si falta o no parsea."""
+    value = appt.get("start_at")
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    else:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
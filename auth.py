@@ -5,16 +5,119 @@ router = APIRouter()
 @router.post("/login")
 def login():
     return {"status": "ok", "message": "login test"}
-# auth.py — login mínimo
+# auth.py — login con bcrypt (pool de procesos) y tokens JWT
 
+import os
+import secrets
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+import jwt
 from fastapi import APIRouter, HTTPException
-from models import LoginIn
+from fastapi.concurrency import run_in_threadpool
+
+from db import read_session
+from models import LoginIn, User
+from passwords import PoolBusy, hash_password, pool as password_pool  # noqa: F401 (manage_seed)
+
+JWT_SECRET = os.getenv("JWT_SECRET", "")
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+JWT_TTL_MIN = int(os.getenv("JWT_TTL_MIN", "720"))
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
+if not JWT_SECRET:
+    # Sin secreto fijo los tokens no sobreviven un reinicio ni sirven entre workers
+    print("ATENCIÓN: JWT_SECRET no está configurado; se usa uno aleatorio.")
+    JWT_SECRET = secrets.token_urlsafe(32)
 
 router = APIRouter()
+router.add_event_handler("startup", password_pool.start)
+router.add_event_handler("shutdown", password_pool.shutdown)
+
+
+class InvalidToken(ValueError):
+    """JWT mal formado, con firma inválida o vencido."""
+
+
+def issue_token(sub: str, **claims: Any) -> str:
+    now = int(time.time())
+    payload = {"sub": sub, "iat": now, "exp": now + JWT_TTL_MIN * 60, **claims}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+# Tokens ya verificados -> claims. Evita repetir el HMAC y el parseo en cada request del panel.
+_decoded: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_decoded_lock = Lock()
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Claims del token; lanza InvalidToken. Cachea los válidos hasta su `exp`."""
+    with _decoded_lock:
+        claims = _decoded.get(token)
+        if claims is not None:
+            if claims["exp"] > time.time():
+                _decoded.move_to_end(token)
+                return claims
+            del _decoded[token]
+    try:
+        claims = jwt.decode(
+            token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "sub"]}
+        )
+    except jwt.InvalidTokenError as e:
+        raise InvalidToken(str(e))
+    with _decoded_lock:
+        _decoded[token] = claims
+        while len(_decoded) > JWT_CACHE_SIZE:
+            _decoded.popitem(last=False)
+    return claims
+
+
+def _find_user(email: str) -> Optional[Dict[str, Any]]:
+    with read_session() as session:
+        u = session.query(User).filter(User.email == email).first()
+        if u is None:
+            return None
+        return {"id": u.id, "email": u.email, "name": u.name, "role": u.role.value,
+                "password_hash": u.password_hash}
+
+
+async def authenticate(email: str, password: str) -> Optional[Dict[str, Any]]:
+    """Usuario si la contraseña es correcta, None si no. Lanza PoolBusy si hay cola."""
+    try:
+        user = await run_in_threadpool(_find_user, email)
+    except Exception as e:
+        print("ERROR al buscar usuario:", e)
+        user = None
+    # Aunque el usuario no exista verificamos igual: mismo tiempo de respuesta
+    ok = await password_pool.verify(password, user["password_hash"] if user else None)
+    return user if user is not None and ok else None
+
+
+async def password_login(email: str, password: str) -> Dict[str, Any]:
+    """
+    Login contra la tabla users: el usuario y su JWT en "access_token".
+    429 si el pool de bcrypt tiene cola, 401 si las credenciales no valen.
+    Lo usan este router y /auth/login de main.py.
+    """
+    try:
+        user = await authenticate(email, password)
+    except PoolBusy as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados intentos de login. Probá de nuevo en unos segundos.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    if user is None:
+        raise HTTPException(status_code=401, detail="Credenciales inválidas.")
+    token = issue_token(str(user["id"]), email=user["email"], role=user["role"])
+    public = {k: v for k, v in user.items() if k != "password_hash"}
+    return {**public, "access_token": token}
+
 
 @router.post("/login")
-def login(payload: LoginIn):
-    # Demo: cualquier usuario + password "123456" entra
-    if payload.password != "123456":
-        raise HTTPException(status_code=401, detail="Credenciales inválidas")
-    return {"ok": True, "email": payload.email}
+async def login(payload: LoginIn):
+    user = await password_login(payload.email, payload.password)
+    return {"ok": True, "email": user["email"], "access_token": user["access_token"],
+            "token_type": "bearer"}
@@ -0,0 +1,167 @@
+# availability.py — disponibilidad de turnos por médico (índice de intervalos)
+
+import bisect
+import os
+from datetime import datetime, time, timedelta, timezone
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Horario de atención (hora local) y días hábiles (0 = lunes)
+AVAIL_HOURS = os.getenv("AVAIL_HOURS", "09:00-18:00")
+AVAIL_WEEKDAYS = os.getenv("AVAIL_WEEKDAYS", "0,1,2,3,4")
+AVAIL_UTC_OFFSET = float(os.getenv("AVAIL_UTC_OFFSET", "-3"))  # Argentina
+AVAIL_MAX_DAYS = int(os.getenv("AVAIL_MAX_DAYS", "62"))
+DEFAULT_DURATION_MIN = int(os.getenv("DEFAULT_DURATION_MIN", "30"))
+
+
+def to_utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def parse_iso(value: str) -> datetime:
+    return to_utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+def iso_utc(dt: datetime) -> str:
+    """Forma canónica de when_at: UTC, milisegundos y "Z" (como texto ordena igual que la fecha)."""
+    return to_utc(dt).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class DoctorSchedule:
+    """
+    Intervalos ocupados de un médico, disjuntos y ordenados por inicio.
+    Como nunca se solapan, alcanza con mirar el vecino anterior y el
+    siguiente para detectar un conflicto: O(log n) con bisect.
+    """
+
+    def __init__(self):
+        self._starts: List[datetime] = []
+        self._items: List[Tuple[datetime, datetime, str]] = []  # (inicio, fin, appt_id)
+        self._pos: Dict[str, datetime] = {}  # appt_id -> inicio
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def conflicts(self, start: datetime, end: datetime) -> bool:
+        i = bisect.bisect_left(self._starts, start)
+        if i > 0 and self._items[i - 1][1] > start:
+            return True
+        return i < len(self._items) and self._items[i][0] < end
+
+    def add(self, appt_id: str, start: datetime, end: datetime) -> bool:
+        if appt_id in self._pos or self.conflicts(start, end):
+            return False
+        i = bisect.bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._items.insert(i, (start, end, appt_id))
+        self._pos[appt_id] = start
+        return True
+
+    def remove(self, appt_id: str) -> bool:
+        start = self._pos.pop(appt_id, None)
+        if start is None:
+            return False
+        i = bisect.bisect_left(self._starts, start)
+        while i < len(self._items) and self._items[i][2] != appt_id:
+            i += 1
+        del self._starts[i]
+        del self._items[i]
+        return True
+
+    def busy(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        """Intervalos ocupados que se cruzan con [start, end)."""
+        i = bisect.bisect_left(self._starts, start)
+        if i > 0 and self._items[i - 1][1] > start:
+            i -= 1
+        j = bisect.bisect_left(self._starts, end)
+        return [(s, e) for s, e, _ in self._items[i:j]]
+
+
+class AvailabilityEngine:
+    """
+    Agenda de todos los médicos. `reserve` verifica y ocupa el horario de forma
+    atómica; `release` lo libera (cancelación o reserva fallida).
+    """
+
+    def __init__(self, hours: str = AVAIL_HOURS, weekdays: str = AVAIL_WEEKDAYS,
+                 utc_offset: float = AVAIL_UTC_OFFSET):
+        opens, closes = hours.split("-")
+        self.opens = time.fromisoformat(opens)
+        self.closes = time.fromisoformat(closes)
+        self.weekdays = {int(d) for d in weekdays.split(",") if d.strip()}
+        self.tz = timezone(timedelta(hours=utc_offset))
+        self.durations: Dict[str, int] = {}  # doctor_id -> duración del servicio (min)
+        self._doctors: Dict[str, DoctorSchedule] = {}
+        self._appt_doctor: Dict[str, str] = {}
+        self._lock = Lock()
+
+    def duration_for(self, doctor_id: str) -> int:
+        return self.durations.get(doctor_id, DEFAULT_DURATION_MIN)
+
+    def load(self, rows: Iterable[Tuple[str, str, datetime, Optional[int]]]) -> int:
+        """Carga (doctor_id, appt_id, inicio, duración_min) existentes. Devuelve cuántos."""
+        n = 0
+        for doctor_id, appt_id, start, duration in rows:
+            end = start + timedelta(minutes=duration or self.duration_for(doctor_id))
+            if self.reserve(doctor_id, appt_id, start, end):
+                n += 1
+        return n
+
+    def reserve(self, doctor_id: str, appt_id: str, start: datetime, end: datetime) -> bool:
+        start, end = to_utc(start), to_utc(end)
+        with self._lock:
+            sched = self._doctors.setdefault(doctor_id, DoctorSchedule())
+            if not sched.add(appt_id, start, end):
+                return False
+            self._appt_doctor[appt_id] = doctor_id
+            return True
+
+    def release(self, appt_id: str) -> bool:
+        with self._lock:
+            doctor_id = self._appt_doctor.pop(appt_id, None)
+            if doctor_id is None:
+                return False
+            return self._doctors[doctor_id].remove(appt_id)
+
+    def is_free(self, doctor_id: str, start: datetime, end: datetime) -> bool:
+        with self._lock:
+            sched = self._doctors.get(doctor_id)
+            return sched is None or not sched.conflicts(to_utc(start), to_utc(end))
+
+    def _windows(self, start: datetime, end: datetime) -> Iterator[Tuple[datetime, datetime]]:
+        """Franjas de atención (en UTC) dentro de [start, end)."""
+        day = start.astimezone(self.tz).date()
+        last = end.astimezone(self.tz).date()
+        while day <= last:
+            if day.weekday() in self.weekdays:
+                ws = datetime.combine(day, self.opens, self.tz).astimezone(timezone.utc)
+                we = datetime.combine(day, self.closes, self.tz).astimezone(timezone.utc)
+                ws, we = max(ws, start), min(we, end)
+                if ws < we:
+                    yield ws, we
+            day += timedelta(days=1)
+
+    def free_slots(self, doctor_id: str, start: datetime, end: datetime,
+                   duration_min: Optional[int] = None) -> List[Tuple[datetime, datetime]]:
+        """Turnos libres de `duration_min` dentro de [start, end), en horario de atención."""
+        start, end = to_utc(start), to_utc(end)
+        step = timedelta(minutes=duration_min or self.duration_for(doctor_id))
+        with self._lock:
+            sched = self._doctors.get(doctor_id)
+            busy = sched.busy(start, end) if sched is not None else []
+
+        slots: List[Tuple[datetime, datetime]] = []
+        k = 0
+        for ws, we in self._windows(start, end):
+            s = ws
+            while s + step <= we:
+                # Saltamos los ocupados que terminan antes de este turno
+                while k < len(busy) and busy[k][1] <= s:
+                    k += 1
+                if k < len(busy) and busy[k][0] < s + step:
+                    # Choca: el próximo candidato arranca al terminar el ocupado
+                    s = ws + step * -(-(busy[k][1] - ws) // step)
+                    continue
+                slots.append((s, s + step))
+                s += step
+        return slots
@@ -0,0 +1,57 @@
+# bench/mp_stub.py — imitación local de la API de Mercado Pago para benchmarks
+#
+# Se levanta con uvicorn y se apunta MP_API_URL hacia acá.
+# BENCH_MP_LATENCY_MS: latencia agregada por respuesta (media, ms)
+# BENCH_MP_JITTER_MS:  variación uniforme +/- sobre la latencia (ms)
+# BENCH_MP_ERROR_RATE: fracción de respuestas 500 (0..1)
+# BENCH_MP_SEED:       semilla para que las corridas sean reproducibles
+
+import asyncio
+import os
+import random
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("BENCH_MP_LATENCY_MS", "80"))
+JITTER_MS = float(os.getenv("BENCH_MP_JITTER_MS", "20"))
+ERROR_RATE = float(os.getenv("BENCH_MP_ERROR_RATE", "0"))
+_rng = random.Random(int(os.getenv("BENCH_MP_SEED", "42")))
+
+app = FastAPI(title="MP stub")
+
+# payment_id -> appointment_id, para que GET /v1/payments/{id} devuelva metadata
+_payments: dict[str, str] = {}
+
+
+async def _delay() -> bool:
+    """Espera la latencia simulada. Devuelve True si hay que fallar."""
+    ms = LATENCY_MS + _rng.uniform(-JITTER_MS, JITTER_MS)
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+    return _rng.random() < ERROR_RATE
+
+
+@app.post("/checkout/preferences")
+async def create_preference(request: Request):
+    pref = await request.json()
+    if await _delay():
+        return JSONResponse({"message": "stub error"}, status_code=500)
+    pref_id = str(uuid.uuid4())
+    appt_id = (pref.get("metadata") or {}).get("appointment_id")
+    if appt_id:
+        _payments[pref_id] = appt_id
+    return JSONResponse(
+        {"id": pref_id, "init_point": f"https://stub.mp/checkout/{pref_id}"},
+        status_code=201,
+    )
+
+
+@app.get("/v1/payments/{payment_id}")
+async def get_payment(payment_id: str):
+    if await _delay():
+        return JSONResponse({"message": "stub error"}, status_code=500)
+    # Los benchmarks usan el appointment_id como payment_id
+    appt_id = _payments.get(payment_id, payment_id)
+    return {"id": payment_id, "status": "approved", "metadata": {"appointment_id": appt_id}}
@@ -0,0 +1,15 @@
+# bench/router_app.py — app armada con los routers de video.py y payments.py
+
+from fastapi import FastAPI
+
+import payments
+import video
+
+app = FastAPI(title="Teleconsulta (routers)")
+app.include_router(video.router)
+app.include_router(payments.router, prefix="/payments")
+
+
+@app.get("/ping")
+def ping():
+    return {"ok": True}
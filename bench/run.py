@@ -0,0 +1,278 @@
+# bench/run.py — benchmark de carga reproducible contra un MP local
+#
+# Uso:
+#   python -m bench.run                          # main + routers, SQLite temporal
+#   python -m bench.run --target main --concurrency 1,16,64 --duration 15
+#   python -m bench.run --database-url postgresql+psycopg://localhost/bench
+#   python -m bench.run --save-baseline          # guarda bench/baseline.json
+#
+# Las variables de entorno del shell (APPT_WRITE_BEHIND, MP_MAX_CONCURRENCY, ...)
+# se pasan tal cual a la app, así se comparan configuraciones con la misma carga.
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+
+# target -> (módulo:app, ruta de readiness, escenarios)
+TARGETS = {
+    "main": ("main:app", "/ready", ["create", "webhook"]),
+    "router": ("bench.router_app:app", "/ping", ["create", "webhook", "join"]),
+}
+
+_SLOT_BASE = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+Request = Tuple[str, str, dict]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn(app: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url}: el proceso terminó con código {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _prepare_db(env: Dict[str, str]) -> None:
+    """Crea la tabla appointments de main.py (en Railway ya existe)."""
+    subprocess.run(
+        [sys.executable, "-c", "import main; main.metadata.create_all(main.get_engine())"],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+# ─────────────────────────────────────────────────────────
+# Escenarios
+# ─────────────────────────────────────────────────────────
+def _booking(i: int) -> dict:
+    # Cada reserva en un horario distinto para no chocar con la agenda
+    start = _SLOT_BASE + timedelta(minutes=30 * i)
+    return {
+        "patient_name": f"Paciente {i}",
+        "patient_email": f"paciente{i}@example.com",
+        "reason": "Benchmark",
+        "price": 40000,
+        "duration": 30,
+        "start_at": start.isoformat().replace("+00:00", "Z"),
+    }
+
+
+def _scenario(name: str, run_id: str, join_ids: List[str]) -> Callable[[int], Request]:
+    if name == "create":
+        return lambda i: ("POST", "/appointments", {"json": _booking(i)})
+    if name == "webhook":
+        # Ids únicos: medimos el camino completo, no el descarte de duplicados
+        return lambda i: ("POST", "/payments/webhook", {
+            "json": {"type": "payment", "action": "payment.updated",
+                     "data": {"id": f"{run_id}-{i}"}},
+        })
+    if name == "join":
+        return lambda i: ("GET", f"/appointments/{join_ids[i % len(join_ids)]}/join", {})
+    raise ValueError(name)
+
+
+async def _prepare_join(client: httpx.AsyncClient, n: int = 200) -> List[str]:
+    """Crea turnos y los marca pagados por webhook para poder medir /join."""
+    ids = []
+    for i in range(n):
+        r = await client.post("/appointments", json=_booking(1_000_000 + i))
+        r.raise_for_status()
+        ids.append(r.json()["id"])
+    for appt_id in ids:
+        await client.post("/payments/webhook", json={"data": {"id": appt_id}})
+    await asyncio.sleep(1)  # que el worker de webhooks aplique el lote
+    return ids
+
+
+# ─────────────────────────────────────────────────────────
+# Medición
+# ─────────────────────────────────────────────────────────
+def _percentile(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    # Rango más cercano: el menor valor con al menos p% de las muestras a su izquierda
+    k = max(0, min(len(sorted_ms) - 1, math.ceil(p / 100 * len(sorted_ms)) - 1))
+    return sorted_ms[k]
+
+
+async def _drive(client: httpx.AsyncClient, make: Callable[[int], Request], counter,
+                 concurrency: int, duration: float) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, url, kwargs = make(next(counter))
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if not ok:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "requests": n,
+        "errors": errors,
+        "rps": round(n / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+    }
+
+
+async def _bench_target(base_url: str, scenarios: List[str], levels: List[int],
+                        duration: float, warmup: float, run_id: str) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    counter = itertools.count()
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        join_ids = await _prepare_join(client) if "join" in scenarios else []
+        for name in scenarios:
+            make = _scenario(name, run_id, join_ids)
+            if warmup:
+                await _drive(client, make, counter, min(levels), warmup)
+            for c in levels:
+                res = await _drive(client, make, counter, c, duration)
+                results[f"{name}/c{c}"] = res
+                print(f"  {name:8} c={c:<4} {res['rps']:>9.1f} req/s  "
+                      f"p50={res['p50_ms']:>8.2f}  p95={res['p95_ms']:>8.2f}  "
+                      f"p99={res['p99_ms']:>8.2f} ms  errores={res['errors']}")
+    return results
+
+
+def _diff(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    print("\nDiferencia contra baseline (rps y p99; + es mejor en rps, - es mejor en p99):")
+    for key, res in results.items():
+        base = baseline.get(key)
+        if not base:
+            print(f"  {key:28} (sin baseline)")
+            continue
+        d_rps = (res["rps"] - base["rps"]) / base["rps"] * 100 if base["rps"] else 0.0
+        d_p99 = (res["p99_ms"] - base["p99_ms"]) / base["p99_ms"] * 100 if base["p99_ms"] else 0.0
+        print(f"  {key:28} rps {d_rps:+7.1f}%   p99 {d_p99:+7.1f}%")
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark de telehealth-backend")
+    ap.add_argument("--target", choices=["main", "router", "all"], default="all")
+    ap.add_argument("--concurrency", default="1,8,32", help="niveles separados por coma")
+    ap.add_argument("--duration", type=float, default=10, help="segundos por nivel")
+    ap.add_argument("--warmup", type=float, default=2, help="segundos de calentamiento")
+    ap.add_argument("--mp-latency-ms", type=float, default=80)
+    ap.add_argument("--mp-jitter-ms", type=float, default=20)
+    ap.add_argument("--mp-error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--database-url", default=None, help="por defecto SQLite temporal")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--out", default=None, help="guardar resultados en JSON")
+    args = ap.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    targets = list(TARGETS) if args.target == "all" else [args.target]
+
+    stub_port = _free_port()
+    stub_env = dict(os.environ,
+                    BENCH_MP_LATENCY_MS=str(args.mp_latency_ms),
+                    BENCH_MP_JITTER_MS=str(args.mp_jitter_ms),
+                    BENCH_MP_ERROR_RATE=str(args.mp_error_rate),
+                    BENCH_MP_SEED=str(args.seed))
+    stub = _spawn("bench.mp_stub:app", stub_port, stub_env)
+
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            _wait_ready(f"http://127.0.0.1:{stub_port}/docs", stub)
+            for target in targets:
+                app, ready_path, scenarios = TARGETS[target]
+                env = dict(os.environ,
+                           MP_ACCESS_TOKEN="bench-token",
+                           MP_API_URL=f"http://127.0.0.1:{stub_port}",
+                           DATABASE_URL=args.database_url or f"sqlite:///{tmp}/{target}.db")
+                if target == "main":
+                    _prepare_db(env)
+                port = _free_port()
+                proc = _spawn(app, port, env)
+                try:
+                    _wait_ready(f"http://127.0.0.1:{port}{ready_path}", proc)
+                    print(f"\n[{target}] {app}  (MP stub: {args.mp_latency_ms}ms, "
+                          f"error {args.mp_error_rate:.0%})")
+                    res = asyncio.run(_bench_target(
+                        f"http://127.0.0.1:{port}", scenarios, levels,
+                        args.duration, args.warmup, run_id=f"{target}-{int(time.time())}",
+                    ))
+                    results.update({f"{target}/{k}": v for k, v in res.items()})
+                finally:
+                    _stop(proc)
+        finally:
+            _stop(stub)
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            _diff(results, json.load(f))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nBaseline guardada en {args.baseline}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
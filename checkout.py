@@ -0,0 +1,166 @@
+# checkout.py — checkout diferido: el turno se guarda y la preferencia de MP se crea después
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from mp_client import MPError, MPRejected, MPUnavailable
+
+# off      -> si MP no está disponible, 503
+# fallback -> si MP no está disponible, se difiere (default)
+# always   -> nunca se llama a MP dentro del request
+MP_DEFERRED_CHECKOUT = os.getenv("MP_DEFERRED_CHECKOUT", "fallback").lower()
+CHECKOUT_RETRY_S = float(os.getenv("CHECKOUT_RETRY_S", "2"))
+CHECKOUT_MAX_AGE_S = float(os.getenv("CHECKOUT_MAX_AGE_S", "900"))  # después se libera el horario
+CHECKOUT_MAX_PENDING = int(os.getenv("CHECKOUT_MAX_PENDING", "1000"))
+CHECKOUT_PARALLEL = int(os.getenv("CHECKOUT_PARALLEL", "10"))
+
+# (appt_id, preferencia) -> (checkout_url, mp_preference_id)
+CreateFn = Callable[[str, Dict[str, Any]], Awaitable[Tuple[str, Optional[str]]]]
+ReadyFn = Callable[[str, str, Optional[str]], Awaitable[None]]
+FailedFn = Callable[[str], Awaitable[None]]
+
+
+class _Pending:
+    __slots__ = ("preference", "state", "checkout_url", "created", "next_try", "attempts")
+
+    def __init__(self, preference: Dict[str, Any]):
+        self.preference = preference
+        self.state = "pending"  # pending | ready | failed
+        self.checkout_url: Optional[str] = None
+        self.created = time.monotonic()
+        self.next_try = 0.0
+        self.attempts = 0
+
+
+class DeferredCheckout:
+    """
+    Preferencias de pago pendientes de crear. Un worker en segundo plano las
+    reintenta (con la misma Idempotency-Key de MP, así que no se duplican)
+    hasta que salen, vence `max_age` o MP la rechaza (MPRejected, 4xx).
+    El cliente consulta con `status()`; el estado vive en este proceso.
+    """
+
+    def __init__(
+        self,
+        create: CreateFn,
+        *,
+        on_ready: Optional[ReadyFn] = None,
+        on_failed: Optional[FailedFn] = None,
+        mode: str = MP_DEFERRED_CHECKOUT,
+        retry_every: float = CHECKOUT_RETRY_S,
+        max_age: float = CHECKOUT_MAX_AGE_S,
+        max_pending: int = CHECKOUT_MAX_PENDING,
+        parallel: int = CHECKOUT_PARALLEL,
+    ):
+        self._create = create
+        self._on_ready = on_ready
+        self._on_failed = on_failed
+        self.mode = mode
+        self.retry_every = retry_every
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.parallel = parallel
+        self._items: Dict[str, _Pending] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def always(self) -> bool:
+        return self.mode == "always" and self.running
+
+    def can_defer(self) -> bool:
+        return self.mode in ("fallback", "always") and self.running and self.pending() < self.max_pending
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def defer(self, appt_id: str, preference: Dict[str, Any]) -> None:
+        if not self.can_defer():
+            raise RuntimeError("Checkout diferido no disponible.")
+        self._items[appt_id] = _Pending(preference)
+        self._wake.set()
+
+    def pending(self) -> int:
+        return sum(1 for p in self._items.values() if p.state == "pending")
+
+    def status(self, appt_id: str) -> Optional[Dict[str, Any]]:
+        p = self._items.get(appt_id)
+        if p is None:
+            return None
+        return {"state": p.state, "checkout_url": p.checkout_url, "attempts": p.attempts}
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.retry_every)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._tick()
+            except Exception as e:
+                print("ERROR en checkout diferido:", e)
+
+    async def _fail(self, appt_id: str, p: _Pending) -> None:
+        p.state = "failed"
+        p.preference = {}
+        if self._on_failed is not None:
+            await self._on_failed(appt_id)
+
+    async def _tick(self) -> None:
+        now = time.monotonic()
+        due = []
+        for appt_id, p in list(self._items.items()):
+            if now - p.created > self.max_age:
+                if p.state == "pending":
+                    print(f"Checkout del turno {appt_id} vencido sin preferencia de MP.")
+                    await self._fail(appt_id, p)
+                elif now - p.created > 2 * self.max_age:
+                    del self._items[appt_id]  # ya nadie va a consultar
+                continue
+            if p.state == "pending" and p.next_try <= now:
+                due.append(appt_id)
+        for i in range(0, len(due), self.parallel):
+            await asyncio.gather(*(self._attempt(a) for a in due[i:i + self.parallel]))
+
+    async def _attempt(self, appt_id: str) -> None:
+        p = self._items[appt_id]
+        p.attempts += 1
+        try:
+            checkout_url, pref_id = await self._create(appt_id, p.preference)
+        except MPUnavailable as e:
+            p.next_try = time.monotonic() + max(self.retry_every, e.retry_after)
+            return
+        except MPRejected as e:
+            print(f"Mercado Pago rechazó la preferencia diferida del turno {appt_id}:", e)
+            await self._fail(appt_id, p)
+            return
+        except Exception as e:
+            # Backoff exponencial con tope en un minuto
+            p.next_try = time.monotonic() + min(60.0, self.retry_every * 2 ** p.attempts)
+            if not isinstance(e, MPError):
+                print(f"ERROR al crear preferencia diferida del turno {appt_id}:", e)
+            return
+        p.state = "ready"
+        p.checkout_url = checkout_url
+        p.preference = {}
+        if self._on_ready is not None:
+            await self._on_ready(appt_id, checkout_url, pref_id)
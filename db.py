@@ -1,28 +1,231 @@
 import os
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from dbrouting import ReadRouter, database_url, make_engine
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+DATABASE_URL = database_url("sqlite:///./data.db")
+engine = make_engine(DATABASE_URL)  # pool: DB_POOL_SIZE, DB_POOL_RECYCLE, DB_POOL_PRE_PING...
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+# Lecturas a DATABASE_READ_URL si está configurada (con vuelta al primario)
+read_router = ReadRouter(lambda: engine)
+
+def read_session(key=None):
+    """Session de solo lectura: réplica, salvo que `key` haya escrito hace poco."""
+    return SessionLocal(bind=read_router.engine_for_read(key))
 # db.py — almacenamiento simple en memoria
 
-from typing import Dict, Any
+import bisect
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 from threading import RLock
 
-_APPTS: Dict[str, Dict[str, Any]] = {}
-_LOCK = RLock()
+from appttime import parse_start
+
+APPT_SHARDS = int(os.getenv("APPT_SHARDS", "16"))
+APPT_TTL_SECONDS = int(os.getenv("APPT_TTL_SECONDS", str(7 * 24 * 3600)))  # tras el fin del turno
+APPT_MAX_ITEMS = int(os.getenv("APPT_MAX_ITEMS", "100000"))
+APPT_EVICT_EVERY = int(os.getenv("APPT_EVICT_EVERY", "256"))  # cada cuántos save_appt
+# memory = dict del proceso; sqlite = archivo compartido por todos los workers
+APPT_STORE = os.getenv("APPT_STORE", "memory")
+APPT_STORE_PATH = os.getenv("APPT_STORE_PATH", "./appts.db")
+
+class _Shard:
+    """Turnos de un shard y sus índices secundarios, todo bajo el mismo lock."""
+
+    __slots__ = ("lock", "items", "by_email", "by_start", "indexed")
+
+    def __init__(self):
+        self.lock = RLock()
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.by_email: Dict[str, Set[str]] = {}
+        self.by_start: List[Tuple[datetime, str]] = []
+        self.indexed: Dict[str, Tuple[Optional[str], Optional[datetime]]] = {}
+
+    # Llamar con self.lock tomado
+    def index(self, appt_id: str, email: Optional[str], start: Optional[datetime]) -> None:
+        self.unindex(appt_id)
+        if email:
+            self.by_email.setdefault(email, set()).add(appt_id)
+        if start is not None:
+            bisect.insort(self.by_start, (start, appt_id))
+        self.indexed[appt_id] = (email, start)
+
+    def unindex(self, appt_id: str) -> None:
+        prev = self.indexed.pop(appt_id, None)
+        if prev is None:
+            return
+        email, start = prev
+        if email:
+            ids = self.by_email.get(email)
+            if ids is not None:
+                ids.discard(appt_id)
+                if not ids:
+                    del self.by_email[email]
+        if start is not None:
+            i = bisect.bisect_left(self.by_start, (start, appt_id))
+            if i < len(self.by_start) and self.by_start[i] == (start, appt_id):
+                del self.by_start[i]
+
+class ApptStore:
+    """
+    Turnos en memoria repartidos en shards por id, cada uno con su lock.
+    Índices secundarios por shard: por patient_email (dict de sets) y por
+    start_at (lista ordenada, para consultas por rango con bisect). Guardar
+    toma solo el lock de su shard; las consultas recorren los shards y
+    mezclan los resultados.
+    Los turnos terminados hace más de `ttl` segundos se descartan, y si se
+    supera `max_items` se descartan los más viejos primero.
+    """
+
+    def __init__(self, shards: int = APPT_SHARDS, ttl: int = APPT_TTL_SECONDS,
+                 max_items: int = APPT_MAX_ITEMS, evict_every: int = APPT_EVICT_EVERY):
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self.ttl = ttl
+        self.max_items = max_items
+        self.evict_every = evict_every
+        self._saves = itertools.count(1)  # next() es atómico: sin lock compartido
+
+    def _shard(self, appt_id: str) -> _Shard:
+        return self._shards[hash(appt_id) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(sh.items) for sh in self._shards)
+
+    # ── primario ──────────────────────────────────────────
+    def save(self, appt: Dict[str, Any]) -> None:
+        appt_id = appt["id"]
+        sh = self._shard(appt_id)
+        email, start = appt.get("patient_email"), parse_start(appt)
+        with sh.lock:
+            sh.items[appt_id] = appt
+            sh.index(appt_id, email, start)
+
+        if self.evict_every and next(self._saves) % self.evict_every == 0:
+            self.evict()
+
+    def get(self, appt_id: str) -> Dict[str, Any] | None:
+        sh = self._shard(appt_id)
+        with sh.lock:
+            return sh.items.get(appt_id)
+
+    def update(self, appt_id: str, **fields: Any) -> bool:
+        sh = self._shard(appt_id)
+        with sh.lock:
+            appt = sh.items.get(appt_id)
+            if appt is None:
+                return False
+            appt.update(fields)
+            if "patient_email" in fields or "start_at" in fields:
+                sh.index(appt_id, appt.get("patient_email"), parse_start(appt))
+        return True
+
+    def mark_paid(self, appt_id: str) -> None:
+        sh = self._shard(appt_id)
+        with sh.lock:
+            if appt_id in sh.items:
+                sh.items[appt_id]["paid"] = True
+
+    def mark_paid_many(self, appt_ids: Iterable[str]) -> None:
+        # Agrupamos por shard: un lock por shard tocado, no uno por turno
+        groups: Dict[int, List[str]] = {}
+        for appt_id in appt_ids:
+            groups.setdefault(hash(appt_id) % len(self._shards), []).append(appt_id)
+        for n, ids in groups.items():
+            sh = self._shards[n]
+            with sh.lock:
+                for appt_id in ids:
+                    if appt_id in sh.items:
+                        sh.items[appt_id]["paid"] = True
+
+    def delete(self, appt_id: str) -> None:
+        sh = self._shard(appt_id)
+        with sh.lock:
+            sh.items.pop(appt_id, None)
+            sh.unindex(appt_id)
+
+    # ── consultas ─────────────────────────────────────────
+    def by_patient(self, email: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for sh in self._shards:
+            with sh.lock:
+                out.extend(sh.items[i] for i in sh.by_email.get(email, ()) if i in sh.items)
+        return out
+
+    def _starts(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                limit: Optional[int] = None) -> List[List[Tuple[datetime, str]]]:
+        """Tramo [start, end) del índice por inicio de cada shard (copias ordenadas,
+        a lo sumo `limit` por shard)."""
+        parts = []
+        for sh in self._shards:
+            with sh.lock:
+                lo = bisect.bisect_left(sh.by_start, (start, "")) if start is not None else 0
+                hi = bisect.bisect_left(sh.by_start, (end, "")) if end is not None else len(sh.by_start)
+                if limit is not None:
+                    hi = min(hi, lo + limit)
+                parts.append(sh.by_start[lo:hi])
+        return parts
+
+    def between(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """Turnos con start_at en [start, end), ordenados por inicio."""
+        ids = [appt_id for _, appt_id in heapq.merge(*self._starts(start, end))]
+        return [a for a in map(self.get, ids) if a is not None]
+
+    # ── descarte ──────────────────────────────────────────
+    def evict(self, now: Optional[datetime] = None) -> int:
+        """Descarta turnos vencidos y, si sobra, los más viejos. Devuelve cuántos."""
+        now = now or datetime.now(timezone.utc)
+        # Un turno dura como mucho 180 min: todo lo que empezó antes de
+        # `horizon` ya terminó hace más de `ttl`.
+        horizon = now - timedelta(seconds=self.ttl)
+        expired = self._starts(end=horizon - timedelta(minutes=180))
+        excess = sum(len(sh.indexed) for sh in self._shards) - self.max_items
+        # Los vencidos, y si aun así sobran, los más viejos: los primeros n en orden global
+        n = max(excess, sum(map(len, expired)))
+        if n <= 0:
+            return 0
+        victims = [appt_id for _, appt_id in itertools.islice(heapq.merge(*self._starts(limit=n)), n)]
+        for appt_id in victims:
+            self.delete(appt_id)
+        return len(victims)
+
+if APPT_STORE == "sqlite":
+    from sharedstore import SqliteApptStore
+    _STORE = SqliteApptStore(APPT_STORE_PATH, ttl=APPT_TTL_SECONDS, max_items=APPT_MAX_ITEMS,
+                             evict_every=APPT_EVICT_EVERY)
+else:
+    _STORE = ApptStore()
+
+def make_slots():
+    """Agenda que rechaza turnos solapados. Con el store compartido vive en el
+    mismo archivo, así la ven todos los workers."""
+    if APPT_STORE == "sqlite":
+        from sharedstore import SqliteSlots
+        return SqliteSlots(_STORE)
+    from availability import AvailabilityEngine
+    return AvailabilityEngine()
 
 def save_appt(appt: Dict[str, Any]) -> None:
-    with _LOCK:
-        _APPTS[appt["id"]] = appt
+    _STORE.save(appt)
 
 def get_appt(appt_id: str) -> Dict[str, Any] | None:
-    with _LOCK:
-        return _APPTS.get(appt_id)
+    return _STORE.get(appt_id)
+
+def update_appt(appt_id: str, **fields: Any) -> bool:
+    """Cambia campos de un turno guardado. No modificar el dict de get_appt():
+    con el store compartido es una copia."""
+    return _STORE.update(appt_id, **fields)
 
 def mark_paid(appt_id: str) -> None:
-    with _LOCK:
-        if appt_id in _APPTS:
-            _APPTS[appt_id]["paid"] = True
+    _STORE.mark_paid(appt_id)
+
+def mark_paid_many(appt_ids: Iterable[str]) -> None:
+    _STORE.mark_paid_many(appt_ids)
+
+def find_by_patient(email: str) -> List[Dict[str, Any]]:
+    return _STORE.by_patient(email)
+
+def find_between(start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    return _STORE.between(start, end)
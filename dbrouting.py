@@ -0,0 +1,180 @@
+# dbrouting.py — configuración del pool y ruteo de lecturas a una réplica
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Pool (se aplica al primario y a la réplica)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))      # espera por una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))      # segundos; -1 = nunca
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# 1 = altas de turnos y cambios de estado con SQLAlchemy asyncio, sin pasar por el
+# threadpool (Postgres: psycopg en modo async; SQLite: requiere `pip install aiosqlite`)
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+
+# Réplica de lectura (opcional)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+DB_READ_AFTER_WRITE_S = float(os.getenv("DB_READ_AFTER_WRITE_S", "5"))  # leer del primario tras escribir
+DB_REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "10"))   # más atraso -> primario
+DB_REPLICA_LAG_CHECK_S = float(os.getenv("DB_REPLICA_LAG_CHECK_S", "5"))
+
+
+def database_url(default: Optional[str] = None) -> Optional[str]:
+    """
+    URL de la DB principal, la misma para la app y el login: DATABASE_URL, o
+    las que entrega Railway (POSTGRES_URL, DATABASE_PUBLIC_URL). Normalizada.
+    """
+    url = (
+        os.getenv("DATABASE_URL")
+        or os.getenv("POSTGRES_URL")
+        or os.getenv("DATABASE_PUBLIC_URL")
+        or default
+    )
+    return normalize_url(url) if url else None
+
+
+def normalize_url(url: str) -> str:
+    """Usar psycopg v3 con SQLAlchemy (Railway entrega postgres://)."""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    if url.startswith("postgresql://") and "+psycopg" not in url:
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+def pool_options(url: str) -> Dict[str, Any]:
+    """kwargs de create_engine para el pool según las variables de entorno."""
+    opts: Dict[str, Any] = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if url.startswith("sqlite"):
+        opts["connect_args"] = {"check_same_thread": False}
+        if ":memory:" in url or url.rstrip("/") == "sqlite:":
+            return opts  # SingletonThreadPool: no acepta tamaño de pool
+    opts.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return opts
+
+
+def make_engine(url: str, **kwargs) -> Engine:
+    url = normalize_url(url)
+    return create_engine(url, **{**pool_options(url), **kwargs})
+
+
+def async_url(url: str) -> str:
+    """Misma DB con driver async: psycopg ya lo es; SQLite pasa a aiosqlite."""
+    url = normalize_url(url)
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+
+def make_async_engine(url: str, **kwargs) -> AsyncEngine:
+    url = async_url(url)
+    opts = pool_options(url)
+    if "pool_size" in opts and url.startswith("sqlite"):
+        # aiosqlite usa NullPool por defecto: una conexión nueva por request
+        opts["poolclass"] = AsyncAdaptedQueuePool
+    return create_async_engine(url, **{**opts, **kwargs})
+
+
+class ReadRouter:
+    """
+    Decide de qué engine leer. Va a la réplica salvo que:
+    - no haya réplica configurada o no responda,
+    - su atraso medido supere `max_lag`,
+    - quien lee haya escrito hace menos de `read_after_write` (+ atraso medido),
+      para que vea sus propios cambios.
+    """
+
+    def __init__(
+        self,
+        primary: Callable[[], Optional[Engine]],
+        replica_url: str = DATABASE_READ_URL,
+        *,
+        read_after_write: float = DB_READ_AFTER_WRITE_S,
+        max_lag: float = DB_REPLICA_MAX_LAG_S,
+        lag_check_every: float = DB_REPLICA_LAG_CHECK_S,
+        max_writers: int = 10000,
+    ):
+        self._primary = primary
+        self.replica_url = replica_url
+        self.read_after_write = read_after_write
+        self.max_lag = max_lag
+        self.lag_check_every = lag_check_every
+        self.max_writers = max_writers
+        self._replica: Optional[Engine] = None
+        self._lock = threading.Lock()
+        self._writes: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lag: Optional[float] = 0.0  # None = réplica no disponible
+        self._lag_checked = 0.0
+
+    @property
+    def replica(self) -> Optional[Engine]:
+        if self._replica is None and self.replica_url:
+            with self._lock:
+                if self._replica is None:
+                    self._replica = make_engine(self.replica_url)
+        return self._replica
+
+    def note_write(self, key: Hashable) -> None:
+        """Registrar que `key` (cliente, token, recurso) acaba de escribir."""
+        with self._lock:
+            self._writes[key] = time.monotonic()
+            self._writes.move_to_end(key)
+            while len(self._writes) > self.max_writers:
+                self._writes.popitem(last=False)
+
+    def replica_lag(self) -> Optional[float]:
+        """Atraso de la réplica en segundos (cacheado). None si no responde."""
+        now = time.monotonic()
+        if now - self._lag_checked < self.lag_check_every:
+            return self._lag
+        self._lag_checked = now
+        replica = self.replica
+        if replica is None:
+            self._lag = None
+            return None
+        try:
+            with replica.connect() as conn:
+                if replica.dialect.name == "postgresql":
+                    # Si ya reprodujo todo lo recibido no hay atraso, aunque el
+                    # último commit sea viejo (primario sin escrituras)
+                    lag = conn.execute(text(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                    )).scalar()
+                else:
+                    conn.execute(text("SELECT 1"))
+                    lag = 0.0
+            self._lag = max(0.0, float(lag or 0.0))
+        except Exception as e:
+            print("Réplica de lectura no disponible:", e)
+            self._lag = None
+        return self._lag
+
+    def engine_for_read(self, key: Optional[Hashable] = None) -> Optional[Engine]:
+        if not self.replica_url:
+            return self._primary()
+        lag = self.replica_lag()
+        if lag is None or lag > self.max_lag:
+            return self._primary()
+        if key is not None:
+            wrote_at = self._writes.get(key)
+            if wrote_at is not None and time.monotonic() - wrote_at < self.read_after_write + lag:
+                return self._primary()
+        return self.replica
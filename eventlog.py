@@ -0,0 +1,511 @@
+# eventlog.py — log de eventos append-only en segmentos (webhooks y cambios de estado)
+#
+# Uso:
+#   python eventlog.py history <appointment_id>   # todo lo que pasó con un turno
+#   python eventlog.py tail -n 50
+#   python eventlog.py compact --retention-days 365
+#
+# Cada proceso escribe en su propio stream (EVENTLOG_DIR/s0, s1, ...: uno por
+# worker de uvicorn), en archivos de hasta EVENTLOG_SEGMENT_MB. Un registro es
+#   [largo u32][crc32 u32][JSON]
+# con {"seq", "ts", "type", "appt", ...}. `seq` es creciente dentro del stream.
+
+import argparse
+import asyncio
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import EVENTLOG_APPENDS, EVENTLOG_FSYNC_LATENCY
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+EVENTLOG_DIR = os.getenv("EVENTLOG_DIR", "./eventlog")  # "" = sin log de eventos
+EVENTLOG_SEGMENT_MB = float(os.getenv("EVENTLOG_SEGMENT_MB", "64"))
+EVENTLOG_FSYNC_MS = float(os.getenv("EVENTLOG_FSYNC_MS", "20"))  # un fsync cada tanto, para todos
+EVENTLOG_RETENTION_DAYS = float(os.getenv("EVENTLOG_RETENTION_DAYS", "365"))
+# batch = durable() espera el fsync agrupado (hasta EVENTLOG_FSYNC_MS más por respuesta);
+# async = no espera: el fsync sale igual, pero un corte puede perder los últimos ms
+EVENTLOG_SYNC = os.getenv("EVENTLOG_SYNC", "batch")
+
+_HDR = struct.Struct("<II")
+_SUFFIX = ".log"
+# Estados después de los cuales un turno ya no cambia (compactables)
+TERMINAL = ("done", "no_show", "cancelled")
+
+Event = Dict[str, Any]
+
+
+def _encode(event: Event) -> bytes:
+    payload = json.dumps(event, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+    return _HDR.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _segments(stream_dir: str) -> List[str]:
+    """Segmentos del stream ordenados por primer seq (el nombre)."""
+    names = [n for n in os.listdir(stream_dir) if n.endswith(_SUFFIX)]
+    return [os.path.join(stream_dir, n) for n in sorted(names)]
+
+
+def _segment_name(stream_dir: str, first_seq: int) -> str:
+    return os.path.join(stream_dir, f"{first_seq:020d}{_SUFFIX}")
+
+
+def _streams(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, n) for n in sorted(os.listdir(directory))
+            if n.startswith("s") and os.path.isdir(os.path.join(directory, n))]
+
+
+def _scan(path: str) -> Iterator[Tuple[int, bytes]]:
+    """(fin del registro, payload) de cada registro válido; corta en el primero roto."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while pos + _HDR.size <= size:
+            length, crc = _HDR.unpack_from(mm, pos)
+            end = pos + _HDR.size + length
+            if end > size:
+                return  # cola cortada (el proceso murió a mitad de escritura)
+            payload = mm[pos + _HDR.size:end]
+            if zlib.crc32(payload) != crc:
+                return
+            yield end, payload
+            pos = end
+
+
+def read_segment(path: str, needle: Optional[bytes] = None) -> Iterator[Event]:
+    """Eventos de un segmento (vía mmap). Con `needle` solo decodifica los que lo contienen."""
+    for _, payload in _scan(path):
+        if needle is None or needle in payload:
+            yield json.loads(payload)
+
+
+def read_stream(stream_dir: str, needle: Optional[bytes] = None) -> Iterator[Event]:
+    last = 0
+    for path in _segments(stream_dir):
+        for event in read_segment(path, needle):
+            # Tras una compactación interrumpida puede haber registros repetidos
+            if event["seq"] > last:
+                last = event["seq"]
+                yield event
+
+
+def iter_events(directory: str = EVENTLOG_DIR, needle: Optional[bytes] = None) -> Iterator[Event]:
+    """Todos los eventos de todos los streams, intercalados por ts."""
+    streams = [read_stream(s, needle) for s in _streams(directory)]
+    return heapq.merge(*streams, key=lambda e: (e["ts"], e["seq"]))
+
+
+def history(appt_id: str, directory: str = EVENTLOG_DIR) -> List[Event]:
+    """Todo lo registrado sobre un turno, en orden (para reclamos de pago)."""
+    needle = json.dumps(appt_id, ensure_ascii=False).encode()
+    return [e for e in iter_events(directory, needle) if e.get("appt") == appt_id]
+
+
+def replay(apply: Callable[[Event], None], directory: str = EVENTLOG_DIR) -> int:
+    """Aplica `apply` a cada evento en orden. Devuelve cuántos aplicó."""
+    n = 0
+    for event in iter_events(directory):
+        apply(event)
+        n += 1
+    return n
+
+
+class _DirLock:
+    """Lock exclusivo (no bloqueante) sobre un archivo; se libera solo si el proceso muere."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)  # cerrar el fd suelta el lock
+            self._fd = None
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Windows no abre directorios
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class EventLog:
+    """
+    Escritor de un stream. `append()` hace un write() secuencial al segmento
+    abierto (sobrevive a que se caiga el proceso) y vuelve; el fsync lo hace
+    una tarea de fondo cada `fsync_every` segundos para todo lo acumulado.
+    `await wait_durable(seq)` espera a que ese evento esté en disco.
+    Cada worker toma el primer stream libre (s0, s1, ...) con un lock de archivo.
+    """
+
+    def __init__(self, directory: str = EVENTLOG_DIR, *,
+                 segment_bytes: int = int(EVENTLOG_SEGMENT_MB * 1024 * 1024),
+                 fsync_every: float = EVENTLOG_FSYNC_MS / 1000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.stream_dir: Optional[str] = None
+        self._lock = threading.Lock()
+        self._dir_lock: Optional[_DirLock] = None
+        self._fd: Optional[int] = None
+        self._size = 0
+        self._seq = 0       # último escrito
+        self._synced = 0    # último en disco
+        self._retired: List[int] = []  # segmentos rotados pendientes de fsync + close
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._fd is not None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ── apertura y recuperación ──────────────────────────
+    def open(self) -> None:
+        if self.is_open:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        i = 0
+        while True:
+            stream_dir = os.path.join(self.directory, f"s{i}")
+            os.makedirs(stream_dir, exist_ok=True)
+            lock = _DirLock(os.path.join(stream_dir, "LOCK"))
+            if lock.acquire():
+                break
+            i += 1
+        self.stream_dir, self._dir_lock = stream_dir, lock
+        segments = _segments(stream_dir)
+        if segments:
+            path = segments[-1]
+            end, last_seq = 0, None
+            for end, payload in _scan(path):
+                last_seq = json.loads(payload)["seq"]
+            if end < os.path.getsize(path):
+                print(f"Event log: descartando cola incompleta de {path}.")
+                os.truncate(path, end)
+            self._seq = last_seq if last_seq is not None else int(os.path.basename(path)[:-len(_SUFFIX)]) - 1
+        else:
+            path = _segment_name(stream_dir, 1)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._synced = self._seq
+
+    def close(self) -> None:
+        with self._lock:
+            fds, self._retired = self._retired + ([self._fd] if self._fd is not None else []), []
+            self._fd = None
+        for fd in fds:
+            os.fsync(fd)
+            os.close(fd)
+        self._synced = self._seq
+        if self._dir_lock is not None:
+            self._dir_lock.release()
+            self._dir_lock = None
+
+    # ── escritura ────────────────────────────────────────
+    def append(self, type: str, appt: Optional[str] = None, **data: Any) -> int:
+        """Registra un evento y devuelve su seq (todavía sin fsync)."""
+        return self.append_many([(type, appt, data)])
+
+    def append_many(self, events: Iterable[Tuple[str, Optional[str], Dict[str, Any]]]) -> int:
+        """Varios eventos con un solo write(). Devuelve el seq del último."""
+        ts = time.time()
+        with self._lock:
+            if self._fd is None:
+                raise RuntimeError("EventLog no está abierto.")
+            if self._size >= self.segment_bytes:
+                self._rotate()
+            seq = self._seq
+            chunks = []
+            for type, appt, data in events:
+                seq += 1
+                chunks.append(_encode({"seq": seq, "ts": ts, "type": type, "appt": appt, **data}))
+            buf = b"".join(chunks)
+            os.write(self._fd, buf)
+            self._size += len(buf)
+            n, self._seq = seq - self._seq, seq
+        EVENTLOG_APPENDS.inc(amount=n)
+        return seq
+
+    def _rotate(self) -> None:
+        # El fsync y el close del segmento viejo los hace el flusher, fuera del event loop
+        self._retired.append(self._fd)
+        self._fd = os.open(_segment_name(self.stream_dir, self._seq + 1),
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+        self._size = 0
+
+    def sync(self) -> int:
+        """fsync de todo lo escrito hasta ahora (bloqueante). Devuelve el seq en disco."""
+        with self._lock:
+            seq, fd, retired, self._retired = self._seq, self._fd, self._retired, []
+        t0 = time.perf_counter()
+        for old in retired:
+            os.fsync(old)
+            os.close(old)
+        if retired:
+            _fsync_dir(self.stream_dir)  # que el segmento nuevo figure en el directorio
+        if fd is not None:
+            os.fsync(fd)
+        EVENTLOG_FSYNC_LATENCY.observe(time.perf_counter() - t0)
+        self._synced = max(self._synced, seq)
+        return seq
+
+    async def wait_durable(self, seq: int) -> None:
+        if seq <= self._synced:
+            return
+        if not self.running:
+            await run_in_threadpool(self.sync)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((seq, fut))
+        await fut
+
+    # ── tarea de fondo ───────────────────────────────────
+    async def start(self) -> None:
+        if self.running:
+            return
+        await run_in_threadpool(self.open)
+        self._task = asyncio.create_task(self._run())
+        print(f"Event log: escribiendo en {self.stream_dir} (seq {self._seq}).")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_open:
+            await run_in_threadpool(self.close)
+        self._wake(self._synced)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.fsync_every)
+            if self._seq == self._synced and not self._retired:
+                continue
+            try:
+                synced = await run_in_threadpool(self.sync)
+            except OSError as e:
+                print("ERROR en fsync del event log:", e)
+                for _, fut in self._waiters:
+                    if not fut.done():
+                        fut.set_exception(e)
+                self._waiters = []
+                continue
+            self._wake(synced)
+
+    def _wake(self, synced: int) -> None:
+        waiting = []
+        for seq, fut in self._waiters:
+            if fut.done():
+                continue
+            if seq <= synced:
+                fut.set_result(None)
+            else:
+                waiting.append((seq, fut))
+        self._waiters = waiting
+
+
+# Un escritor por proceso, compartido por main.py y los routers
+log = EventLog()
+
+
+def record(type: str, appt: Optional[str] = None, **data: Any) -> Optional[int]:
+    """Registra un evento si el log está abierto; seq o None."""
+    if not EVENTLOG_DIR or not log.is_open:
+        return None
+    try:
+        return log.append(type, appt, **data)
+    except OSError as e:
+        print("ERROR al escribir en el event log:", e)
+        return None
+
+
+def record_transitions(status: str, appt_ids: Iterable[str], source: str) -> Optional[int]:
+    """Un evento por turno que pasa a `status`, con un solo write()."""
+    if not EVENTLOG_DIR or not log.is_open:
+        return None
+    try:
+        return log.append_many(
+            ("appointment.status", appt_id, {"status": status, "source": source})
+            for appt_id in appt_ids
+        )
+    except OSError as e:
+        print("ERROR al escribir en el event log:", e)
+        return None
+
+
+_users = 0
+
+
+async def start() -> None:
+    """Lo llaman la app y cada router que registra eventos; abre el log la primera vez."""
+    global _users
+    _users += 1
+    if EVENTLOG_DIR:
+        await log.start()
+
+
+async def stop() -> None:
+    """Cierra el log cuando lo suelta el último (después de que vació sus colas)."""
+    global _users
+    _users = max(0, _users - 1)
+    if _users == 0:
+        await log.stop()
+
+
+async def durable(seq: Optional[int]) -> None:
+    """Espera el fsync del evento `seq` (no hace nada si no se registró, ni con EVENTLOG_SYNC=async)."""
+    if seq is not None and EVENTLOG_SYNC != "async":
+        await log.wait_durable(seq)
+
+
+# ─────────────────────────────────────────────────────────
+# Compactación
+# ─────────────────────────────────────────────────────────
+def _last_state(directory: str) -> Dict[str, Tuple[float, Optional[str]]]:
+    """turno -> (ts del último evento, último estado conocido)."""
+    state: Dict[str, Tuple[float, Optional[str]]] = {}
+    for event in iter_events(directory):
+        appt = event.get("appt")
+        if appt:
+            prev = state.get(appt, (0.0, None))[1]
+            state[appt] = (event["ts"], event.get("status") or prev)
+    return state
+
+
+def compact(directory: str = EVENTLOG_DIR, retention_days: float = EVENTLOG_RETENTION_DAYS,
+            segment_bytes: int = int(EVENTLOG_SEGMENT_MB * 1024 * 1024)) -> Dict[str, int]:
+    """
+    Reescribe los segmentos cerrados (nunca el último de cada stream, que puede
+    estar en uso) sin los eventos de turnos cerrados (done / no_show / cancelled)
+    cuyo último evento tiene más de `retention_days`, ni los eventos sin turno
+    más viejos que eso. Junta segmentos chicos en uno.
+    Se puede correr con la app andando; una compactación por vez (lock).
+    """
+    stats = {"segments": 0, "kept": 0, "dropped": 0}
+    lock = _DirLock(os.path.join(directory, "COMPACT.LOCK"))
+    if not os.path.isdir(directory) or not lock.acquire():
+        return stats
+    try:
+        cutoff = time.time() - retention_days * 86400
+        state = _last_state(directory)
+
+        def drop(event: Event) -> bool:
+            appt = event.get("appt")
+            if not appt:
+                return event["ts"] < cutoff
+            last_ts, status = state.get(appt, (0.0, None))
+            return status in TERMINAL and last_ts < cutoff
+
+        for stream_dir in _streams(directory):
+            closed = _segments(stream_dir)[:-1]
+            if not closed:
+                continue
+            outputs: List[Tuple[str, str]] = []  # (tmp, final)
+            out_fd, out_size = None, 0
+            for path in closed:
+                for event in read_segment(path):
+                    if drop(event):
+                        stats["dropped"] += 1
+                        continue
+                    stats["kept"] += 1
+                    if out_fd is None or out_size >= segment_bytes:
+                        if out_fd is not None:
+                            os.fsync(out_fd)
+                            os.close(out_fd)
+                        final = _segment_name(stream_dir, event["seq"])
+                        outputs.append((final + ".tmp", final))
+                        out_fd = os.open(final + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                                         | getattr(os, "O_BINARY", 0), 0o644)
+                        out_size = 0
+                    rec = _encode(event)
+                    os.write(out_fd, rec)
+                    out_size += len(rec)
+            if out_fd is not None:
+                os.fsync(out_fd)
+                os.close(out_fd)
+            # Primero los nuevos (rename atómico), después se borran los viejos.
+            # Si se corta en el medio quedan registros repetidos, que read_stream saltea.
+            finals = set()
+            for tmp, final in outputs:
+                os.replace(tmp, final)
+                finals.add(final)
+            _fsync_dir(stream_dir)
+            for path in closed:
+                if path not in finals:
+                    os.remove(path)
+            _fsync_dir(stream_dir)
+            stats["segments"] += len(closed)
+    finally:
+        lock.release()
+    print("Event log compactado:", stats)
+    return stats
+
+
+def _cli() -> None:
+    parser = argparse.ArgumentParser(description="Log de eventos de pagos y turnos.")
+    parser.add_argument("--dir", default=EVENTLOG_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("history", help="eventos de un turno")
+    p.add_argument("appointment_id")
+    p = sub.add_parser("tail", help="últimos eventos")
+    p.add_argument("-n", type=int, default=20)
+    p = sub.add_parser("compact", help="descarta turnos cerrados viejos")
+    p.add_argument("--retention-days", type=float, default=EVENTLOG_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    if args.cmd == "history":
+        events = history(args.appointment_id, args.dir)
+    elif args.cmd == "tail":
+        events = deque(iter_events(args.dir), maxlen=args.n)
+    else:
+        compact(args.dir, args.retention_days)
+        return
+    for event in events:
+        print(json.dumps(event, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    _cli()
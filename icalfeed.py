@@ -0,0 +1,304 @@
+# icalfeed.py — agenda de cada médico como feed iCalendar (Google / Apple Calendar)
+#
+# Los clientes de calendario consultan la URL cada pocos minutos. El feed de
+# cada médico se arma una vez desde la DB y después se parchea evento por
+# evento cuando se crea un turno o cambia su estado; casi todos los polls
+# terminan en un 304 por ETag.
+
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+CALENDAR_SECRET = os.getenv("CALENDAR_SECRET", "")
+CAL_HISTORY_DAYS = int(os.getenv("CAL_HISTORY_DAYS", "90"))     # turnos pasados que entran al feed
+CAL_REBUILD_S = float(os.getenv("CAL_REBUILD_S", "900"))        # rearmado desde la DB (cambios de otros workers)
+CAL_MAX_FEEDS = int(os.getenv("CAL_MAX_FEEDS", "500"))          # médicos en memoria (LRU)
+CAL_POLL_MIN = int(os.getenv("CAL_POLL_MIN", "5"))              # intervalo sugerido a los clientes
+
+if not CALENDAR_SECRET:
+    # Las URLs de suscripción dejan de valer al reiniciar y no sirven entre workers
+    print("ATENCIÓN: CALENDAR_SECRET no está configurado; se usa uno aleatorio.")
+    CALENDAR_SECRET = secrets.token_urlsafe(32)
+
+CAL_STREAM_EVENTS = 500  # más eventos que esto: respuesta en trozos
+_CHUNK = 64 * 1024
+
+
+class CalEvent(NamedTuple):
+    appt_id: str
+    doctor_id: str
+    patient: Optional[str]
+    start: datetime
+    end: datetime
+    status: str
+
+
+def calendar_token(doctor_id: str) -> str:
+    """Token de la URL de suscripción (los clientes de calendario no mandan headers)."""
+    mac = hmac.new(CALENDAR_SECRET.encode(), f"cal:{doctor_id}".encode(), hashlib.sha256)
+    return mac.hexdigest()[:32]
+
+
+def check_token(doctor_id: str, token: str) -> bool:
+    return hmac.compare_digest(calendar_token(doctor_id), token or "")
+
+
+# ─────────────────────────────────────────────────────────
+# Render (RFC 5545)
+# ─────────────────────────────────────────────────────────
+# Estado del turno -> STATUS del evento
+_STATUS = {"paid": "CONFIRMED", "done": "CONFIRMED", "no_show": "CONFIRMED",
+           "cancelled": "CANCELLED"}
+
+
+def _escape(text: str) -> str:
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> bytes:
+    """Líneas de hasta 75 octetos; las siguientes empiezan con un espacio."""
+    raw = line.encode()
+    if len(raw) <= 75:
+        return raw + b"\r\n"
+    out, start, limit = [], 0, 75
+    while start < len(raw):
+        end = min(start + limit, len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:
+            end -= 1  # no cortar un carácter UTF-8 a la mitad
+        out.append((b" " if start else b"") + raw[start:end])
+        start, limit = end, 74
+    return b"\r\n".join(out) + b"\r\n"
+
+
+def _ts(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_event(ev: CalEvent) -> bytes:
+    # Sin marcas de "ahora": el mismo turno da los mismos bytes en cualquier worker,
+    # así el ETag coincide aunque el balanceador mande cada poll a otro proceso
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{ev.appt_id}@teleconsulta",
+        f"DTSTAMP:{_ts(ev.start)}",
+        f"DTSTART:{_ts(ev.start)}",
+        f"DTEND:{_ts(ev.end)}",
+        "SUMMARY:" + _escape(f"Teleconsulta: {ev.patient or 'paciente'}"),
+        "DESCRIPTION:" + _escape(f"Turno {ev.appt_id}\nEstado: {ev.status}"),
+        f"STATUS:{_STATUS.get(ev.status, 'TENTATIVE')}",
+        "END:VEVENT",
+    ]
+    return b"".join(_fold(line) for line in lines)
+
+
+def _header(doctor_id: str) -> bytes:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Teleconsulta Emilio//Agenda//ES",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:" + _escape(f"Turnos (médico {doctor_id})"),
+        f"REFRESH-INTERVAL;VALUE=DURATION:PT{CAL_POLL_MIN}M",
+        f"X-PUBLISHED-TTL:PT{CAL_POLL_MIN}M",
+    ]
+    return b"".join(_fold(line) for line in lines)
+
+
+_FOOTER = b"END:VCALENDAR\r\n"
+
+
+def _digest(body: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(body, digest_size=16).digest(), "big")
+
+
+# ─────────────────────────────────────────────────────────
+# Cache
+# ─────────────────────────────────────────────────────────
+class Feed:
+    """Eventos renderizados de un médico. El ETag es el XOR de los hashes de
+    cada evento: se actualiza en O(1) al parchear y no depende del orden."""
+
+    __slots__ = ("doctor_id", "events", "digest", "last_modified", "loaded_at")
+
+    def __init__(self, doctor_id: str):
+        self.doctor_id = doctor_id
+        self.events: Dict[str, Tuple[CalEvent, bytes, int]] = {}
+        self.digest = 0
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest:032x}-{len(self.events)}"'
+
+    def put(self, ev: CalEvent) -> bool:
+        body = render_event(ev)
+        old = self.events.get(ev.appt_id)
+        if old is not None:
+            if old[1] == body:
+                return False
+            self.digest ^= old[2]
+        h = _digest(body)
+        self.events[ev.appt_id] = (ev, body, h)
+        self.digest ^= h
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        return True
+
+
+class CalendarFeeds:
+    """
+    Feeds por médico, armados con `load(doctor_id)` (bloqueante: corre en el
+    threadpool) la primera vez que se piden y rearmados en segundo plano cada
+    `rebuild_every` segundos. Entre medio, `upsert()` y `set_status()` los
+    parchean; los médicos cuyo feed no está en memoria se ignoran. Los parches
+    que llegan mientras un feed se arma se guardan y se aplican al feed nuevo
+    (el SELECT puede no haberlos visto).
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Iterable[CalEvent]],
+        *,
+        rebuild_every: float = CAL_REBUILD_S,
+        max_feeds: int = CAL_MAX_FEEDS,
+    ):
+        self._load = load
+        self.rebuild_every = rebuild_every
+        self.max_feeds = max_feeds
+        self._feeds: "OrderedDict[str, Feed]" = OrderedDict()
+        self._where: Dict[str, str] = {}  # appt_id -> doctor_id (solo feeds cargados)
+        self._lock = threading.Lock()     # los parches llegan también desde el threadpool
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Parches recibidos durante el armado de cada feed: ("upsert", ev) o ("status", ids, estado)
+        self._building: Dict[str, List[tuple]] = {}
+
+    def __len__(self) -> int:
+        return len(self._feeds)
+
+    def _build(self, doctor_id: str) -> Feed:
+        feed = Feed(doctor_id)
+        for ev in self._load(doctor_id):
+            feed.put(ev)
+        return feed
+
+    def _install(self, feed: Feed) -> None:
+        with self._lock:
+            for patch in self._building.pop(feed.doctor_id, ()):
+                if patch[0] == "upsert":
+                    feed.put(patch[1])
+                else:
+                    self._put_status(feed, patch[1], patch[2])
+            old = self._feeds.pop(feed.doctor_id, None)
+            if old is not None:
+                for appt_id in old.events:
+                    self._where.pop(appt_id, None)
+                if old.digest == feed.digest:
+                    feed.last_modified = old.last_modified  # nada cambió: no invalidar If-Modified-Since
+            self._feeds[feed.doctor_id] = feed
+            for appt_id in feed.events:
+                self._where[appt_id] = feed.doctor_id
+            while len(self._feeds) > self.max_feeds:
+                _, evicted = self._feeds.popitem(last=False)
+                for appt_id in evicted.events:
+                    self._where.pop(appt_id, None)
+
+    async def _refresh(self, doctor_id: str) -> Feed:
+        """Un solo armado por médico a la vez; los demás pedidos esperan ese."""
+        fut = self._loading.get(doctor_id)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[doctor_id] = fut
+        with self._lock:
+            self._building[doctor_id] = []  # antes del SELECT
+        try:
+            feed = await run_in_threadpool(self._build, doctor_id)
+            self._install(feed)
+            fut.set_result(feed)
+            return feed
+        except Exception as e:
+            with self._lock:
+                self._building.pop(doctor_id, None)
+            fut.set_exception(e)
+            fut.exception()  # marcado como leído si nadie más esperaba
+            raise
+        finally:
+            del self._loading[doctor_id]
+
+    async def get(self, doctor_id: str) -> Feed:
+        with self._lock:
+            feed = self._feeds.get(doctor_id)
+            if feed is not None:
+                self._feeds.move_to_end(doctor_id)
+        if feed is None:
+            return await self._refresh(doctor_id)
+        if time.monotonic() - feed.loaded_at > self.rebuild_every and doctor_id not in self._loading:
+            # Se sirve el actual; el rearmado queda para el próximo poll
+            asyncio.create_task(self._refresh_quietly(doctor_id))
+        return feed
+
+    async def _refresh_quietly(self, doctor_id: str) -> None:
+        try:
+            await self._refresh(doctor_id)
+        except Exception as e:
+            print(f"ERROR al rearmar el calendario del médico {doctor_id}:", e)
+
+    # ── parches ──────────────────────────────────────────
+    def upsert(self, ev: CalEvent) -> None:
+        with self._lock:
+            pending = self._building.get(ev.doctor_id)
+            if pending is not None:
+                pending.append(("upsert", ev))
+            feed = self._feeds.get(ev.doctor_id)
+            if feed is not None and feed.put(ev):
+                self._where[ev.appt_id] = ev.doctor_id
+
+    def set_status(self, appt_ids: Iterable[str], status: str) -> None:
+        appt_ids = list(appt_ids)
+        with self._lock:
+            # No se sabe de qué médico son los que no están cargados: a todos los armados en curso
+            for pending in self._building.values():
+                pending.append(("status", appt_ids, status))
+            for appt_id in appt_ids:
+                doctor_id = self._where.get(appt_id)
+                feed = self._feeds.get(doctor_id) if doctor_id is not None else None
+                if feed is not None:
+                    self._put_status(feed, [appt_id], status)
+
+    @staticmethod
+    def _put_status(feed: Feed, appt_ids: Iterable[str], status: str) -> None:
+        for appt_id in appt_ids:
+            entry = feed.events.get(appt_id)
+            if entry is not None:
+                feed.put(entry[0]._replace(status=status))
+
+    # ── respuesta ────────────────────────────────────────
+    def snapshot(self, feed: Feed) -> List[bytes]:
+        with self._lock:
+            return [body for _, body, _ in feed.events.values()]
+
+    def stream(self, feed: Feed) -> Iterator[bytes]:
+        """El feed en trozos de ~64 KB, a partir de los eventos ya renderizados."""
+        bodies = self.snapshot(feed)
+        yield _header(feed.doctor_id)
+        buf: List[bytes] = []
+        size = 0
+        for body in bodies:
+            buf.append(body)
+            size += len(body)
+            if size >= _CHUNK:
+                yield b"".join(buf)
+                buf, size = [], 0
+        buf.append(_FOOTER)
+        yield b"".join(buf)
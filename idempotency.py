@@ -0,0 +1,86 @@
+# idempotency.py — claves Idempotency-Key con caché TTL y single-flight
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyConflict(ValueError):
+    """La misma clave llegó con un cuerpo distinto."""
+
+
+def fingerprint(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """
+    Guarda el resultado de cada clave por `ttl` segundos (LRU acotado a `max_size`).
+    Si llegan duplicados mientras el primero todavía se procesa, todos esperan
+    ese mismo cálculo (single-flight). Los errores no se guardan: un reintento
+    posterior vuelve a ejecutar.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._done: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, Any]]:
+        hit = self._done.get(key)
+        if hit is None:
+            return None
+        expires, fp, value = hit
+        if expires < time.monotonic():
+            del self._done[key]
+            return None
+        self._done.move_to_end(key)
+        return fp, value
+
+    def _store(self, key: str, fp: str, value: Any) -> None:
+        self._done[key] = (time.monotonic() + self.ttl, fp, value)
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_size:
+            self._done.popitem(last=False)
+
+    async def run(self, key: str, payload: Any, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Devuelve el resultado guardado para `key` o lo calcula una sola vez.
+        Lanza IdempotencyConflict si `payload` no coincide con el original.
+        """
+        fp = fingerprint(payload)
+
+        hit = self._lookup(key)
+        if hit is not None:
+            if hit[0] != fp:
+                raise IdempotencyConflict(key)
+            return hit[1]
+
+        running = self._inflight.get(key)
+        if running is not None:
+            if running[0] != fp:
+                raise IdempotencyConflict(key)
+            return await asyncio.shield(running[1])
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fp, fut)
+        try:
+            value = await compute()
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # marcada como leída aunque nadie más espere
+            raise
+        except BaseException:
+            fut.cancel()
+            raise
+        else:
+            self._store(key, fp, value)
+            fut.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,111 @@
+# jointoken.py — tokens firmados (HMAC) para entrar a la videollamada sin tocar el store
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, NamedTuple, Optional
+
+JOIN_TOKEN_SECRET = os.getenv("JOIN_TOKEN_SECRET", "")
+JOIN_EARLY_MIN = int(os.getenv("JOIN_EARLY_MIN", "15"))   # se puede entrar antes del inicio
+JOIN_GRACE_MIN = int(os.getenv("JOIN_GRACE_MIN", "30"))   # y después del fin
+
+if not JOIN_TOKEN_SECRET:
+    # Sin secreto fijo los tokens no sobreviven un reinicio ni sirven entre workers
+    print("ATENCIÓN: JOIN_TOKEN_SECRET no está configurado; se usa uno aleatorio.")
+    JOIN_TOKEN_SECRET = secrets.token_urlsafe(32)
+
+_KEY = JOIN_TOKEN_SECRET.encode()
+
+
+class InvalidJoinToken(ValueError):
+    """Token mal formado, con firma inválida, vencido o revocado."""
+
+
+class JoinClaims(NamedTuple):
+    appt_id: str
+    not_before: int
+    expires: int
+    paid: bool
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_KEY, body.encode(), hashlib.sha256).digest())
+
+
+def expires_at(start: datetime, duration_min: int) -> int:
+    """Hasta cuándo vale un token del turno (epoch): JOIN_GRACE_MIN después del fin."""
+    return int((start + timedelta(minutes=duration_min + JOIN_GRACE_MIN)).timestamp())
+
+
+def issue(appt_id: str, start: datetime, duration_min: int, paid: bool = True) -> str:
+    """Token válido desde JOIN_EARLY_MIN antes del inicio hasta JOIN_GRACE_MIN después del fin."""
+    nbf = int((start - timedelta(minutes=JOIN_EARLY_MIN)).timestamp())
+    exp = expires_at(start, duration_min)
+    body = _b64(f"{appt_id}|{nbf}|{exp}|{int(paid)}".encode())
+    return f"{body}.{_sign(body)}"
+
+
+def verify(token: str, appt_id: Optional[str] = None, now: Optional[float] = None) -> JoinClaims:
+    """Valida firma, ventana horaria, pago y denylist. Lanza InvalidJoinToken."""
+    try:
+        body, sig = token.split(".", 1)
+    except ValueError:
+        raise InvalidJoinToken("formato inválido")
+    if not hmac.compare_digest(sig, _sign(body)):
+        raise InvalidJoinToken("firma inválida")
+    try:
+        tok_appt, nbf, exp, paid = _unb64(body).decode().split("|")
+        claims = JoinClaims(tok_appt, int(nbf), int(exp), paid == "1")
+    except ValueError:
+        raise InvalidJoinToken("formato inválido")
+
+    now = time.time() if now is None else now
+    if appt_id is not None and claims.appt_id != appt_id:
+        raise InvalidJoinToken("el token es de otro turno")
+    if not claims.paid:
+        raise InvalidJoinToken("pago pendiente")
+    if now < claims.not_before:
+        raise InvalidJoinToken("todavía no empezó la ventana del turno")
+    if now > claims.expires:
+        raise InvalidJoinToken("token vencido")
+    if is_revoked(claims.appt_id, now):
+        raise InvalidJoinToken("token revocado")
+    return claims
+
+
+# ─────────────────────────────────────────────────────────
+# Denylist en memoria: turno -> hasta cuándo está revocado
+# ─────────────────────────────────────────────────────────
+_denylist: Dict[str, float] = {}
+_deny_lock = Lock()
+
+
+def revoke(appt_id: str, until: Optional[float] = None) -> None:
+    """Revoca los tokens del turno hasta `until` (epoch); sin `until`, para siempre."""
+    if until is None:
+        until = float("inf")
+    with _deny_lock:
+        _denylist[appt_id] = until
+        # Limpieza perezosa: solo si creció
+        if len(_denylist) > 1024:
+            now = time.time()
+            for k in [k for k, v in _denylist.items() if v < now]:
+                del _denylist[k]
+
+
+def is_revoked(appt_id: str, now: Optional[float] = None) -> bool:
+    until = _denylist.get(appt_id)  # lectura sin lock: dict.get es atómico
+    return until is not None and (time.time() if now is None else now) < until
@@ -0,0 +1,133 @@
+# listing.py — listado paginado (keyset) y exportación en streaming de turnos
+
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, DateTime, Table, and_, or_, select
+from sqlalchemy.engine import Engine
+
+EXPORT_YIELD_PER = 1000  # filas por fetch del cursor del servidor
+
+
+def encode_cursor(when_at: Any, appt_id: str) -> str:
+    raw = json.dumps([_plain(when_at), appt_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Lanza ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        when_at, appt_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError("cursor inválido") from e
+    return when_at, appt_id
+
+
+def _plain(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def row_out(row) -> Dict[str, Any]:
+    return {k: _plain(v) for k, v in row._mapping.items()}
+
+
+def filtered_select(
+    table: Table,
+    status: Optional[str] = None,
+    date_from: Optional[Any] = None,
+    date_to: Optional[Any] = None,
+    *,
+    doctor_id: Optional[str] = None,
+    when_col: str = "when_at",
+    columns: Optional[Sequence[Column]] = None,
+):
+    """SELECT ordenado por (`when_col`, id) con los filtros del panel.
+    `columns` limita las columnas (p. ej. si alguna todavía no existe en la DB)."""
+    c = table.c
+    when = c[when_col]
+    stmt = table.select() if columns is None else select(*columns)
+    if status:
+        stmt = stmt.where(c.status == status)
+    if doctor_id:
+        stmt = stmt.where(c.doctor_id == doctor_id)
+    if date_from is not None:
+        stmt = stmt.where(when >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(when < date_to)
+    return stmt.order_by(when, c.id)
+
+
+def fetch_page(
+    engine: Engine,
+    table: Table,
+    *,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[Any] = None,
+    date_to: Optional[Any] = None,
+    doctor_id: Optional[str] = None,
+    when_col: str = "when_at",
+    columns: Optional[Sequence[Column]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Una página de turnos a partir del cursor (el último (when, id) visto).
+    Devuelve (items, next_cursor); next_cursor es None en la última página.
+    """
+    c = table.c
+    when = c[when_col]
+    stmt = filtered_select(
+        table, status, date_from, date_to, doctor_id=doctor_id, when_col=when_col, columns=columns,
+    )
+    if cursor:
+        when_at, appt_id = decode_cursor(cursor)
+        if isinstance(when.type, DateTime) and isinstance(when_at, str):
+            try:
+                when_at = datetime.fromisoformat(when_at)
+            except ValueError as e:
+                raise ValueError("cursor inválido") from e
+        stmt = stmt.where(
+            or_(when > when_at, and_(when == when_at, c.id > appt_id))
+        )
+    with engine.connect() as conn:
+        rows = conn.execute(stmt.limit(limit + 1)).all()
+
+    items = [row_out(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last._mapping[when_col], last.id)
+    return items, next_cursor
+
+
+def stream_rows(engine: Engine, stmt) -> Iterator[Dict[str, Any]]:
+    """Itera el resultado con un cursor del lado del servidor, sin cargarlo entero."""
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=EXPORT_YIELD_PER
+        ).execute(stmt)
+        for row in result:
+            yield row_out(row)
+
+
+def iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False) + "\n").encode()
+
+
+def iter_csv(rows: Iterator[Dict[str, Any]], columns: List[str]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
@@ -1,9 +1,14 @@
+import asyncio
+import hmac
 import os
+import threading
 import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Optional
 
+import anyio.to_thread
 from sqlalchemy import (
-    create_engine,
     MetaData,
     Table,
     Column,
@@ -11,65 +16,146 @@ from sqlalchemy import (
     Integer,
     Text,
     DateTime,
+    Index,
+    case,
+    null,
+    or_,
     text,
 )
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, Field
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field, model_validator
+
+import eventlog
+import icalfeed
+import listing
+import migrate_when
+import tracing
+from dbrouting import DB_ASYNC, ReadRouter, database_url, make_async_engine, make_engine
+from reconcile import UNPAID_WITH_PREF_SQL, Reconciler
+import metrics
+from availability import AVAIL_MAX_DAYS, AvailabilityEngine, iso_utc, parse_iso, to_utc
+from idempotency import IdempotencyCache, IdempotencyConflict
 
 # ─────────────────────────────────────────────────────────
 # DB: URL desde Railway
 # ─────────────────────────────────────────────────────────
-DATABASE_URL = (
-    os.getenv("DATABASE_URL")
-    or os.getenv("POSTGRES_URL")
-    or os.getenv("DATABASE_PUBLIC_URL")
-)
+DATABASE_URL = database_url()
 
 engine = None
-metadata = None
+metadata = MetaData()
 appointments = None
 
+# 1 = los filtros por fecha usan when_ts (timestamptz) en vez del texto when_at.
+# Activarlo cuando `python migrate_when.py status` informe 0 pendientes.
+APPT_WHEN_TS_READS = os.getenv("APPT_WHEN_TS_READS", "0") == "1"
+
 if DATABASE_URL:
-    # Ajustar para usar psycopg v3 con SQLAlchemy
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace(
-            "postgres://", "postgresql+psycopg://", 1
-        )
-    elif DATABASE_URL.startswith("postgresql://") and "+psycopg" not in DATABASE_URL:
-        DATABASE_URL = DATABASE_URL.replace(
-            "postgresql://", "postgresql+psycopg://", 1
-        )
+    # Solo metadatos: el engine (driver + pool) se crea en el primer uso
+    appointments = Table(
+        "appointments",
+        metadata,
+        Column("id", String, primary_key=True),
+        Column("doctor_id", String, nullable=True),
+        Column("patient_id", String, nullable=True),
+        Column("service_id", String, nullable=True),
+        Column("when_at", String, nullable=False),
+        # Mismo instante, tipado (timestamptz en Postgres). Las filas previas las
+        # completa migrate_when.py; when_at se sigue escribiendo por compatibilidad.
+        Column("when_ts", DateTime(timezone=True), nullable=True),
+        Column("status", String, nullable=False),
+        # Duración reservada (min); las filas viejas no la tienen: se usa la del servicio
+        Column("duration_min", Integer, nullable=True),
+        Column("price", Integer, nullable=False),
+        Column("currency", String, nullable=False),
+        Column("mp_preference_id", String, nullable=True),
+        Column("video_url", Text, nullable=True),
+        Column("created_at", DateTime, server_default=text("CURRENT_TIMESTAMP")),
+    )
 
-    try:
-        engine = create_engine(DATABASE_URL, future=True)
-        metadata = MetaData()
-
-        appointments = Table(
-            "appointments",
-            metadata,
-            Column("id", String, primary_key=True),
-            Column("doctor_id", String, nullable=True),
-            Column("patient_id", String, nullable=True),
-            Column("service_id", String, nullable=True),
-            Column("when_at", String, nullable=False),
-            Column("status", String, nullable=False),
-            Column("price", Integer, nullable=False),
-            Column("currency", String, nullable=False),
-            Column("mp_preference_id", String, nullable=True),
-            Column("video_url", Text, nullable=True),
-            Column("created_at", DateTime, server_default=text("CURRENT_TIMESTAMP")),
-        )
+    # Índices para el listado del panel (keyset sobre (when_at, id))
+    Index("ix_appointments_when_at_id", appointments.c.when_at, appointments.c.id,
+          postgresql_concurrently=True)
+    Index("ix_appointments_status_when_at_id", appointments.c.status,
+          appointments.c.when_at, appointments.c.id, postgresql_concurrently=True)
+    # Agenda del día por médico y "pendientes desde X": rangos sobre when_ts
+    Index("ix_appointments_doctor_when_ts", appointments.c.doctor_id, appointments.c.when_ts,
+          postgresql_concurrently=True)
+    Index("ix_appointments_status_when_ts", appointments.c.status, appointments.c.when_ts,
+          postgresql_concurrently=True)
+    # Conciliación de pagos: solo los turnos sin pagar con preferencia (índice parcial)
+    _unpaid_with_pref = text(UNPAID_WITH_PREF_SQL)
+    Index("ix_appointments_unpaid_pref", appointments.c.when_at, appointments.c.id,
+          postgresql_concurrently=True, postgresql_where=_unpaid_with_pref,
+          sqlite_where=_unpaid_with_pref)
 
-        # NO hacemos metadata.create_all(): la tabla ya existe en Railway
-        print("DB OK: conexión inicializada correctamente.")
-    except Exception as e:
-        print("ERROR al inicializar DB:", e)
-        engine = None
-        appointments = None
+    # NO hacemos metadata.create_all(): la tabla ya existe en Railway
 else:
     print("ATENCIÓN: DATABASE_URL no está configurada. No se guardarán turnos en DB.")
 
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Devuelve el engine, creándolo en el primer uso (importa el driver y arma
+    el pool). None si no hay DB configurada o si falló la inicialización.
+    """
+    global engine, appointments
+    if engine is not None or appointments is None:
+        return engine
+    with _engine_lock:
+        if engine is None and appointments is not None:
+            try:
+                # Pool según DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+                engine = make_engine(DATABASE_URL, future=True)
+                print("DB OK: conexión inicializada correctamente.")
+            except Exception as e:
+                print("ERROR al inicializar DB:", e)
+                engine = None
+                appointments = None
+    return engine
+
+
+# Lecturas a DATABASE_READ_URL si está configurada (con vuelta al primario)
+read_router = ReadRouter(get_engine)
+
+# DB_ASYNC=1: segundo engine (asyncio) para las escrituras de booking y webhooks.
+# Listados, export, scheduler y conciliación siguen con el engine sync.
+async_engine = None
+_async_engine_failed = False
+
+
+def get_async_engine():
+    """Engine asyncio, creado en el primer uso. None si DB_ASYNC=0, sin DB o si falló."""
+    global async_engine, _async_engine_failed
+    if async_engine is not None or not DB_ASYNC or appointments is None or _async_engine_failed:
+        return async_engine
+    try:
+        async_engine = make_async_engine(DATABASE_URL)
+        print("DB OK: engine async inicializado.")
+    except Exception as e:
+        # Sin driver async (p. ej. falta aiosqlite): se sigue con el threadpool
+        print("ERROR al inicializar DB async, se usa el engine sync:", e)
+        _async_engine_failed = True
+    return async_engine
+
+
+async def _db_write(sync_fn, async_fn, *args):
+    """Escritura en la DB: en el event loop si hay engine async, si no en el threadpool."""
+    if get_async_engine() is not None:
+        return await async_fn(*args)
+    return await run_in_threadpool(sync_fn, *args)
+
+
+def _caller_key(request: Request) -> str:
+    """Identifica a quien llama para leer sus propias escrituras del primario."""
+    return request.headers.get("authorization") or (
+        request.client.host if request.client else "anon"
+    )
+
 
 # ─────────────────────────────────────────────────────────
 # Variables de entorno generales
@@ -77,26 +163,57 @@ else:
 BASE_URL = os.getenv("BASE_URL", "").rstrip("/")          # ej: https://telehealth-backend-production-0021.up.railway.app
 FRONTEND_URL = os.getenv("FRONTEND_URL", "").rstrip("/")  # ej: https://teleconsulta-emilio.vercel.app
 MP_ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN", "")
+DEFAULT_DOCTOR_ID = os.getenv("DEFAULT_DOCTOR_ID", "1")  # el médico del seed
+PANEL_TOKEN = os.getenv("PANEL_TOKEN", "")                 # token fijo del panel (sin default)
+PANEL_DEMO_LOGIN = os.getenv("PANEL_DEMO_LOGIN", "0") == "1"  # 1 = token fijo para cualquiera (solo demo)
+DB_ENSURE_INDEXES = os.getenv("DB_ENSURE_INDEXES", "1") == "1"
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "5"))  # conexiones a pre-abrir
 
-# SDK de Mercado Pago
-try:
-    import mercadopago  # type: ignore
-except Exception:
-    mercadopago = None
+if PANEL_DEMO_LOGIN:
+    print("ATENCIÓN: PANEL_DEMO_LOGIN=1: /auth/login entrega el token del panel sin validar credenciales.")
 
+# Write-behind de turnos: INSERTs agrupados por lote en segundo plano
+APPT_WRITE_BEHIND = os.getenv("APPT_WRITE_BEHIND", "0") == "1"
+APPT_WB_BATCH = int(os.getenv("APPT_WB_BATCH", "100"))
+APPT_WB_DELAY_MS = int(os.getenv("APPT_WB_DELAY_MS", "50"))
+APPT_WB_QUEUE = int(os.getenv("APPT_WB_QUEUE", "10000"))
+APPT_WB_DURABLE = os.getenv("APPT_WB_DURABLE", "0") == "1"  # esperar el COMMIT del lote
 
-def get_mp_client():
-    """
-    Crea el cliente de Mercado Pago con el token de entorno.
-    Lanza error claro si falta el token o el SDK.
-    """
-    if mercadopago is None:
-        raise RuntimeError("SDK de Mercado Pago no está instalado (mercadopago).")
+# Ingesta de webhooks: ventana de deduplicación y tamaño de lote
+WEBHOOK_SEEN_TTL = float(os.getenv("WEBHOOK_SEEN_TTL", "600"))
+WEBHOOK_BATCH = int(os.getenv("WEBHOOK_BATCH", "500"))
+
+# Idempotency-Key en POST /appointments
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
 
-    if not MP_ACCESS_TOKEN:
-        raise RuntimeError("MP_ACCESS_TOKEN no está configurado en las variables de entorno.")
+# Cliente compartido de Mercado Pago (keep-alive + timeouts + bulkhead + circuit breaker)
+import mp_client
+from auth import InvalidToken, decode_token, password_login, password_pool
+from checkout import DeferredCheckout
+from scheduler import AppointmentScheduler, Timed, log_reminders
+from webhooks import WebhookIngestor, extract_event
+from warmup import WarmUp
+from writebehind import WriteBehindQueue
 
-    return mercadopago.SDK(MP_ACCESS_TOKEN)
+appt_writer: Optional[WriteBehindQueue] = None
+if APPT_WRITE_BEHIND and appointments is not None:
+    appt_writer = WriteBehindQueue(
+        None,  # se asigna al arrancar, cuando existe el engine
+        appointments,
+        max_batch=APPT_WB_BATCH,
+        max_delay=APPT_WB_DELAY_MS / 1000,
+        max_queue=APPT_WB_QUEUE,
+        on_failed=lambda rows: _on_insert_failed(rows),  # definida más abajo
+    )
+
+
+def get_mp_client() -> mp_client.MPClient:
+    """
+    Devuelve el cliente compartido de Mercado Pago.
+    Lanza error claro si falta el token.
+    """
+    return mp_client.get_mp_client()
 
 
 def get_webhook_url() -> Optional[str]:
@@ -116,6 +233,287 @@ app = FastAPI(
 )
 
 
+# Agenda en memoria para detectar solapamientos y listar turnos libres
+slots = AvailabilityEngine()
+# Duración de cada servicio (service_id -> minutos), para los turnos que lo tienen
+service_minutes = {}
+
+
+def _load_availability() -> None:
+    """Carga duraciones de servicios y turnos vigentes desde la DB."""
+    engine = get_engine()
+    if engine is None:
+        return
+    try:
+        with engine.connect() as conn:
+            for service_id, doctor_id, duration_min in conn.execute(
+                text("SELECT id, doctor_id, duration_min FROM services")
+            ):
+                if duration_min:
+                    slots.durations[str(doctor_id)] = int(duration_min)
+                    service_minutes[str(service_id)] = int(duration_min)
+    except Exception as e:
+        print("Availability: no se pudieron leer servicios:", e)
+
+    since = datetime.now(timezone.utc) - timedelta(days=1)
+    # Filas previas a la normalización de when_at pueden tener otro huso:
+    # cota ampliada en SQL y el filtro exacto después de parsear
+    lo = since if _when_ts_reads() else since - _MAX_UTC_OFFSET
+    cols = appointments.c
+    rows = []
+    stmt = (
+        appointments.select()
+        .with_only_columns(cols.doctor_id, cols.id, cols.when_at, _duration_col())
+        .where(cols[_when_col()] >= _when_at_bound(lo))
+        .where(cols.status.notin_(_FREE_STATUSES))
+    )
+    with engine.connect() as conn:
+        result = conn.execute(stmt)
+        for doctor_id, appt_id, when_at, duration in result:
+            try:
+                start = parse_iso(when_at)
+            except (TypeError, ValueError):
+                continue
+            if start >= since:
+                rows.append((doctor_id or DEFAULT_DOCTOR_ID, appt_id, start, duration))
+    print(f"Availability: {slots.load(rows)} turnos cargados.")
+
+
+def _ensure_indexes() -> None:
+    """Crea los índices que falten (CONCURRENTLY en Postgres: no bloquea escrituras)."""
+    engine = get_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in appointments.indexes:
+            try:
+                index.create(conn, checkfirst=True)
+            except Exception as e:
+                print(f"ERROR al crear índice {index.name}:", e)
+
+
+def _open_pool_connections(n: int) -> int:
+    """Abre n conexiones a la vez (y las devuelve al pool) para no pagarlas en el primer request."""
+    engine = get_engine()
+    if engine is None:
+        return 0
+    n = max(0, min(n, engine.pool.size() if hasattr(engine.pool, "size") else n))
+    if n == 0:
+        return 0
+    barrier = threading.Barrier(n, timeout=30)
+    errors = []
+
+    def hold():
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                barrier.wait()  # que ninguna se devuelva antes de abrir todas
+        except threading.BrokenBarrierError:
+            pass  # falló otra: el error que importa es el suyo
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()  # liberar a las que esperan
+
+    threads = [threading.Thread(target=hold) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]  # el paso "db" queda en error y /ready no da 200
+    if barrier.broken:
+        raise TimeoutError("No se pudieron abrir las conexiones de la DB a tiempo.")
+    return n
+
+
+async def _open_async_pool_connections(n: int) -> int:
+    """Igual que _open_pool_connections, para el pool del engine async."""
+    engine = get_async_engine()
+    if engine is None:
+        return 0
+    pool = engine.pool
+    n = max(0, min(n, pool.size() if hasattr(pool, "size") else n))
+    if n == 0:
+        return 0
+    all_open = asyncio.Event()
+    opened = 0
+
+    async def hold():
+        nonlocal opened
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            opened += 1
+            if opened == n:
+                all_open.set()
+            await asyncio.wait_for(all_open.wait(), 30)
+
+    tasks = [asyncio.create_task(hold()) for _ in range(n)]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    # Si una falló, las demás no siguen reteniendo conexiones hasta el timeout
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    errors = [t.exception() for t in done if t.exception() is not None]
+    if errors:
+        raise errors[0]
+    return n
+
+
+# ─────────────────────────────────────────────────────────
+# Arranque en frío: pasos de warm-up en segundo plano
+# ─────────────────────────────────────────────────────────
+warm = WarmUp()
+
+
+@warm.step("db")
+async def _warm_db():
+    if appointments is None:
+        return "sin DB"
+    opened = await run_in_threadpool(_open_pool_connections, WARMUP_DB_CONNECTIONS)
+    if get_engine() is not None:
+        if not await run_in_threadpool(_ensure_columns):
+            _start_columns_retry()
+    if DB_ASYNC:
+        opened_async = await _open_async_pool_connections(WARMUP_DB_CONNECTIONS)
+        return f"{opened} conexiones abiertas (+{opened_async} async)"
+    return f"{opened} conexiones abiertas"
+
+
+@warm.step("indexes", after=["db"], required=False)
+async def _warm_indexes():
+    if DB_ENSURE_INDEXES and get_engine() is not None:
+        await run_in_threadpool(_ensure_indexes)
+
+
+@warm.step("availability", after=["db"])
+async def _warm_availability():
+    await run_in_threadpool(_load_availability)
+
+
+@warm.step("scheduler", after=["availability"], required=False)
+async def _warm_scheduler():
+    if get_engine() is None:
+        return "sin DB"
+    await appt_scheduler.start()
+    return f"{len(appt_scheduler)} turnos agendados"
+
+
+@warm.step("auth_pool", required=False)
+async def _warm_auth_pool():
+    if PANEL_DEMO_LOGIN:
+        return "login de demostración"
+    await password_pool.start()
+    return f"{password_pool.workers} procesos"
+
+
+@warm.step("mp_client", required=False)
+async def _warm_mp_client():
+    if not mp_client.MP_ACCESS_TOKEN:
+        return "sin MP_ACCESS_TOKEN"
+    await get_mp_client().warm()
+
+
+@warm.step("validators", required=False)
+async def _warm_validators():
+    # Primera validación/serialización: carga email-validator y los serializers
+    sample = ApptIn(
+        patient_name="warmup", patient_email="warmup@example.com", reason="warmup",
+        price=100, duration=30, start_at="2030-01-01T00:00:00Z",
+    )
+    ApptOut(id="warmup", status="created").model_dump_json()
+    LoginIn(email=sample.patient_email, password="x")
+
+
+@app.on_event("startup")
+async def _start_warmup():
+    warm.start()
+
+
+@app.on_event("shutdown")
+async def _stop_warmup():
+    await warm.stop()
+
+
+@app.on_event("startup")
+async def _start_appt_writer():
+    if appt_writer is not None:
+        # Hasta que arranque la cola, los INSERTs se hacen en línea
+        appt_writer.engine = await run_in_threadpool(get_engine)
+        appt_writer.async_engine = get_async_engine()
+        if appt_writer.engine is not None:
+            await appt_writer.start()
+
+
+@app.on_event("shutdown")
+async def _stop_appt_writer():
+    # Vacía la cola antes de apagar para no perder turnos
+    if appt_writer is not None:
+        await appt_writer.stop()
+
+
+@app.on_event("shutdown")
+async def _dispose_async_engine():
+    # Después de vaciar la cola write-behind, que puede usarlo
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+@app.on_event("shutdown")
+async def _stop_scheduler():
+    await appt_scheduler.stop()
+
+
+@app.on_event("startup")
+async def _start_reconciler():
+    # Primera pasada cuando el pool de la DB ya está abierto
+    if appointments is not None:
+        reconciler.start(wait_for=lambda: warm.wait("indexes"))
+
+
+@app.on_event("shutdown")
+async def _stop_reconciler():
+    await reconciler.stop()
+
+
+@app.on_event("shutdown")
+async def _stop_auth_pool():
+    password_pool.shutdown()
+
+
+@app.on_event("startup")
+async def _start_deferred_checkout():
+    await deferred_checkout.start()
+
+
+@app.on_event("shutdown")
+async def _stop_deferred_checkout():
+    await deferred_checkout.stop()
+
+
+@app.on_event("startup")
+async def _start_webhook_ingestor():
+    await webhook_ingestor.start()
+
+
+@app.on_event("shutdown")
+async def _stop_webhook_ingestor():
+    await webhook_ingestor.stop()
+
+
+@app.on_event("shutdown")
+async def _close_mp_client():
+    await mp_client.close_mp_client()
+
+
+@app.on_event("startup")
+async def _start_event_log():
+    await eventlog.start()
+
+
+@app.on_event("shutdown")
+async def _stop_event_log():
+    # Último: las colas de arriba registran eventos mientras se vacían
+    await eventlog.stop()
+
+
 # ─────────────────────────────────────────────────────────
 # CORS
 # ─────────────────────────────────────────────────────────
@@ -142,6 +540,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Desglose de requests lentos y muestreados (ver /debug/slow)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Por fuera de todo: mide también lo que agregan los otros middlewares
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 # ─────────────────────────────────────────────────────────
 # Modelos
@@ -163,6 +567,13 @@ class ApptIn(BaseModel):
     price: int = Field(..., ge=100)  # ARS
     duration: int = Field(..., ge=10, le=180)  # minutos
     start_at: str  # ISO string, ej: "2025-11-11T11:11:00.000Z"
+    doctor_id: Optional[str] = None  # si falta, DEFAULT_DOCTOR_ID
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _traced(cls, data, handler):
+        with tracing.span("validate.ApptIn"):
+            return handler(data)
 
 
 class ApptOut(BaseModel):
@@ -186,36 +597,209 @@ def ping():
     return {"ok": True}
 
 
+@app.get("/ready", tags=["default"])
+def ready():
+    """Readiness: 200 cuando terminó el warm-up, 503 mientras tanto."""
+    report = warm.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
 # ─────────────────────────────────────────────────────────
 # Auth muy simple
 # ─────────────────────────────────────────────────────────
 @app.post("/auth/login", response_model=LoginOut, tags=["auth"])
-def login(payload: LoginIn):
+async def login(payload: LoginIn):
     """
-    Login de demostración. No valida contra base de datos.
-    Devuelve siempre un token fijo para que puedas entrar al panel médico.
+    Valida email y contraseña contra la tabla users (bcrypt en un pool de
+    procesos aparte) y devuelve un JWT. Con PANEL_DEMO_LOGIN=1 es el login de
+    demostración: no valida nada y devuelve el PANEL_TOKEN configurado.
     """
-    fake_token = "demo-token"
-    return LoginOut(access_token=fake_token)
+    if PANEL_DEMO_LOGIN:
+        if not PANEL_TOKEN:
+            raise HTTPException(status_code=503, detail="Login del panel no configurado (PANEL_TOKEN).")
+        return LoginOut(access_token=PANEL_TOKEN)
+    user = await password_login(payload.email, payload.password)
+    return LoginOut(access_token=user["access_token"])
+
+
+def _is_panel_token(auth: str) -> bool:
+    # Sin PANEL_TOKEN configurado no hay token fijo que valga
+    return bool(PANEL_TOKEN) and hmac.compare_digest(auth.encode(), f"Bearer {PANEL_TOKEN}".encode())
+
+
+def require_panel(request: Request) -> None:
+    """Exige el token del panel médico (o un JWT válido) en Authorization: Bearer ..."""
+    auth = request.headers.get("authorization", "")
+    if PANEL_DEMO_LOGIN and _is_panel_token(auth):
+        return
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            decode_token(token)  # cacheado: no se re-verifica en cada request
+            return
+        except InvalidToken:
+            pass
+    raise HTTPException(status_code=401, detail="Token inválido o ausente.")
 
 
 # ─────────────────────────────────────────────────────────
 # Crear turno + preferencia de pago en Mercado Pago
 # ─────────────────────────────────────────────────────────
+idem_cache = IdempotencyCache(max_size=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL)
+
+
+# Columnas agregadas después de la tabla original (las agrega el warm-up si faltan)
+_has_when_ts = False
+_has_duration = False
+_columns_task: Optional[asyncio.Task] = None
+COLUMNS_RETRY_S = 60.0
+
+
+def _ensure_columns() -> bool:
+    """ALTER de las columnas que falten (bloqueante). Devuelve si ya están todas."""
+    global _has_when_ts, _has_duration
+    engine = get_engine()
+    _has_when_ts = _has_when_ts or migrate_when.ensure_column(engine, appointments, "when_ts")
+    _has_duration = _has_duration or migrate_when.ensure_column(engine, appointments, "duration_min")
+    return _has_when_ts and _has_duration
+
+
+def _start_columns_retry() -> None:
+    """Si el ALTER no se pudo hacer (lock_timeout, permisos), se reintenta en segundo plano."""
+    global _columns_task
+    if _columns_task is None or _columns_task.done():
+        _columns_task = asyncio.create_task(_retry_columns())
+
+
+async def _retry_columns() -> None:
+    done = False
+    while not done:
+        await asyncio.sleep(COLUMNS_RETRY_S)
+        try:
+            done = await run_in_threadpool(_ensure_columns)
+        except Exception as e:
+            print("ERROR al agregar columnas a appointments:", e)
+
+
+@app.on_event("shutdown")
+async def _stop_columns_retry():
+    if _columns_task is not None:
+        _columns_task.cancel()
+
+
+def _appt_columns() -> list:
+    """Columnas que existen en la DB: when_ts y duration_min solo una vez agregadas."""
+    missing = {"when_ts": not _has_when_ts, "duration_min": not _has_duration}
+    return [c for c in appointments.columns if not missing.get(c.name)]
+
+
+def _duration_col():
+    """duration_min en un SELECT; NULL (duración del servicio) si la columna no está."""
+    return appointments.c.duration_min if _has_duration else null().label("duration_min")
+
+
+def _appointment_row(appt_id: str, payload: ApptIn, mp_pref_id: Optional[str]) -> dict:
+    row = {
+        "id": appt_id,
+        "doctor_id": payload.doctor_id or DEFAULT_DOCTOR_ID,
+        "patient_id": payload.patient_email,
+        "service_id": None,
+        # Siempre en UTC: el listado y los filtros comparan when_at como texto
+        "when_at": iso_utc(parse_iso(payload.start_at)),
+        "status": "created",
+        "price": payload.price,
+        "currency": "ARS",
+        "mp_preference_id": mp_pref_id,
+        "video_url": None,
+    }
+    if _has_when_ts:
+        row["when_ts"] = parse_iso(payload.start_at)
+    if _has_duration:
+        row["duration_min"] = payload.duration
+    return row
+
+
+def _insert_appointment(row: dict) -> bool:
+    """INSERT bloqueante del turno; se ejecuta fuera del event loop. Devuelve si se guardó."""
+    engine = get_engine()
+    if engine is None:
+        return True
+    try:
+        with metrics.DB_INSERT_LATENCY.time("sync"), tracing.span("db.execute"):
+            with engine.begin() as conn:
+                conn.execute(appointments.insert().values(**row))
+        metrics.DB_INSERT_ROWS.inc("sync")
+        print(f"Turno {row['id']} guardado en DB.")
+        return True
+    except Exception as e:
+        print("ERROR al guardar turno en DB:", e)
+        return False
+
+
+async def _insert_appointment_async(row: dict) -> bool:
+    """Mismo INSERT, en el event loop (DB_ASYNC=1)."""
+    try:
+        with metrics.DB_INSERT_LATENCY.time("async"), tracing.span("db.execute"):
+            async with get_async_engine().begin() as conn:
+                await conn.execute(appointments.insert().values(**row))
+        metrics.DB_INSERT_ROWS.inc("async")
+        print(f"Turno {row['id']} guardado en DB.")
+        return True
+    except Exception as e:
+        print("ERROR al guardar turno en DB:", e)
+        return False
+
+
 @app.post("/appointments", response_model=ApptOut, tags=["appointments"])
-def create_appointment(payload: ApptIn):
+@tracing.endpoint
+async def create_appointment(
+    payload: ApptIn,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+):
     """
     Crea una preferencia de pago en Mercado Pago y devuelve el checkout_url.
     También guarda el turno en la tabla appointments (si hay DB).
+    Con `Idempotency-Key`, un reintento devuelve el mismo turno sin volver
+    a llamar a MP ni a la DB.
     """
+    if not idempotency_key:
+        result = await _create_appointment(payload)
+    else:
+        try:
+            result = await idem_cache.run(
+                idempotency_key, payload.model_dump(), lambda: _create_appointment(payload)
+            )
+        except IdempotencyConflict:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key ya usada con otros datos.",
+            )
+    # Sus próximas lecturas van al primario hasta que la réplica se ponga al día
+    read_router.note_write(_caller_key(request))
+    return result
+
+
+async def _create_appointment(payload: ApptIn) -> ApptOut:
     appt_id = str(uuid.uuid4())
 
     # Cliente MP
     try:
-        sdk = get_mp_client()
+        get_mp_client()
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    # Reservar el horario antes de ir a MP (evita dos turnos solapados).
+    # Si el warm-up todavía está cargando la agenda desde la DB, esperamos.
+    await warm.wait("availability")
+    try:
+        start = parse_iso(payload.start_at)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="start_at no es una fecha ISO válida.")
+    doctor_id = payload.doctor_id or DEFAULT_DOCTOR_ID
+    if not slots.reserve(doctor_id, appt_id, start, start + timedelta(minutes=payload.duration)):
+        raise HTTPException(status_code=409, detail="Horario no disponible.")
+
     # Datos de preferencia MP
     preference = {
         "items": [
@@ -244,63 +828,761 @@ def create_appointment(payload: ApptIn):
     if webhook_url:
         preference["notification_url"] = webhook_url
 
-    # Crear preferencia en MP
-    try:
-        result = sdk.preference().create(preference)
-        mp_resp = result.get("response", {})
-        checkout_url = mp_resp.get("init_point") or mp_resp.get("sandbox_init_point")
-        mp_pref_id = mp_resp.get("id")
-        if not checkout_url:
+    # Crear preferencia en MP. Si MP está lento o caído (bulkhead lleno o
+    # circuito abierto) no esperamos: el turno queda guardado y la preferencia
+    # se crea en segundo plano (checkout diferido).
+    checkout_url = mp_pref_id = None
+    deferred = deferred_checkout.always
+    if not deferred:
+        try:
+            checkout_url, mp_pref_id = await _mp_create_preference(appt_id, preference)
+        except mp_client.MPUnavailable as e:
+            if not deferred_checkout.can_defer():
+                slots.release(appt_id)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Mercado Pago no está disponible. Probá de nuevo en unos segundos.",
+                    headers={"Retry-After": str(int(e.retry_after))},
+                )
+            deferred = True
+        except Exception as e:
+            slots.release(appt_id)
             raise HTTPException(
                 status_code=500,
-                detail="No se pudo obtener checkout_url desde Mercado Pago.",
+                detail=f"Error al crear preferencia en Mercado Pago: {str(e)}",
             )
-    except Exception as e:
+
+    # Guardar en DB (si la conexión está OK)
+    status = "pending_checkout" if deferred else "created"
+    saved = True
+    if appointments is not None:
+        row = _appointment_row(appt_id, payload, mp_pref_id)
+        row["status"] = status
+        # db.insert incluye la espera (cola o threadpool); db.execute, solo la sentencia
+        with tracing.span("db.insert"):
+            if appt_writer is not None and appt_writer.running:
+                try:
+                    # Diferido: el UPDATE de cuando salga la preferencia necesita la fila
+                    await appt_writer.submit(row, durable=APPT_WB_DURABLE or deferred)
+                except Exception as e:
+                    print("ERROR al guardar turno en DB:", e)
+                    saved = False
+            else:
+                saved = await _db_write(_insert_appointment, _insert_appointment_async, row)
+    if not saved:
+        # Sin fila el turno no existe (ni webhook ni scheduler lo encontrarían): se libera el horario
+        slots.release(appt_id)
         raise HTTPException(
-            status_code=500,
-            detail=f"Error al crear preferencia en Mercado Pago: {str(e)}",
+            status_code=503,
+            detail="No se pudo guardar el turno. Probá de nuevo en unos segundos.",
         )
 
-    # Guardar en DB (si la conexión está OK)
-    if engine is not None and appointments is not None:
-        try:
-            with engine.begin() as conn:
-                conn.execute(
-                    appointments.insert().values(
-                        id=appt_id,
-                        doctor_id=None,
-                        patient_id=payload.patient_email,
-                        service_id=None,
-                        when_at=payload.start_at,
-                        status="created",
-                        price=payload.price,
-                        currency="ARS",
-                        mp_preference_id=mp_pref_id,
-                        video_url=None,
-                    )
-                )
-            print(f"Turno {appt_id} guardado en DB.")
-        except Exception as e:
-            print("ERROR al guardar turno en DB:", e)
+    appt_scheduler.schedule(
+        Timed(appt_id, doctor_id, payload.patient_email, start, start + timedelta(minutes=payload.duration))
+    )
+    calendars.upsert(
+        _cal_event(appt_id, doctor_id, payload.patient_email, None, start, status, payload.duration)
+    )
+    eventlog.record(
+        "appointment.created", appt_id, status=status, doctor_id=doctor_id,
+        patient=payload.patient_email, start_at=payload.start_at, price=payload.price,
+        mp_preference_id=mp_pref_id,
+    )
+
+    if deferred:
+        deferred_checkout.defer(appt_id, preference)
+        return ApptOut(
+            id=appt_id,
+            checkout_url=None,
+            join_url=None,
+            status=status,
+            detail=f"El link de pago se genera en breve: consultar /appointments/{appt_id}/checkout",
+        )
 
     return ApptOut(
         id=appt_id,
         checkout_url=checkout_url,
         join_url=None,
-        status="created",
+        status=status,
         detail=None,
     )
 
 
+def _on_insert_failed(rows: list) -> None:
+    """Lote del write-behind que no se guardó: esos turnos no existen."""
+    ids = [row["id"] for row in rows]
+    for appt_id in ids:
+        slots.release(appt_id)
+        appt_scheduler.cancel(appt_id)
+    calendars.set_status(ids, "cancelled")
+
+
+async def _mp_create_preference(appt_id: str, preference: dict) -> tuple:
+    """(checkout_url, mp_preference_id). El appt_id es la Idempotency-Key de MP."""
+    with tracing.span("mp.preference"):
+        result = await get_mp_client().create_preference(preference, idempotency_key=appt_id)
+    mp_resp = result.get("response", {})
+    checkout_url = mp_resp.get("init_point") or mp_resp.get("sandbox_init_point")
+    if not checkout_url:
+        status = result.get("status", 500)
+        if status >= 500 or status == 429:
+            raise mp_client.MPError(f"Mercado Pago respondió {status}")
+        # 4xx (o sin init_point): con la misma preferencia no va a salir nunca
+        raise mp_client.MPRejected(
+            f"No se pudo obtener checkout_url desde Mercado Pago (respondió {status})."
+        )
+    return checkout_url, mp_resp.get("id")
+
+
+def _pending_checkout_stmt(appt_id: str, values: dict):
+    return (
+        appointments.update()
+        .where(appointments.c.id == appt_id)
+        .where(appointments.c.status == "pending_checkout")
+        .values(**values)
+    )
+
+
+def _update_pending_checkout(appt_id: str, values: dict) -> None:
+    engine = get_engine()
+    if engine is None:
+        return
+    with engine.begin() as conn:
+        conn.execute(_pending_checkout_stmt(appt_id, values))
+
+
+async def _update_pending_checkout_async(appt_id: str, values: dict) -> None:
+    async with get_async_engine().begin() as conn:
+        await conn.execute(_pending_checkout_stmt(appt_id, values))
+
+
+async def _on_checkout_ready(appt_id: str, checkout_url: str, mp_pref_id: Optional[str]) -> None:
+    print(f"Preferencia diferida del turno {appt_id} creada.")
+    eventlog.record("appointment.status", appt_id, status="created", source="checkout",
+                    mp_preference_id=mp_pref_id)
+    calendars.set_status([appt_id], "created")
+    await _db_write(
+        _update_pending_checkout, _update_pending_checkout_async,
+        appt_id, {"status": "created", "mp_preference_id": mp_pref_id},
+    )
+
+
+async def _on_checkout_failed(appt_id: str) -> None:
+    slots.release(appt_id)
+    appt_scheduler.cancel(appt_id)
+    eventlog.record("appointment.status", appt_id, status="cancelled", source="checkout")
+    calendars.set_status([appt_id], "cancelled")
+    await _db_write(
+        _update_pending_checkout, _update_pending_checkout_async, appt_id, {"status": "cancelled"}
+    )
+
+
+deferred_checkout = DeferredCheckout(
+    _mp_create_preference,
+    on_ready=_on_checkout_ready,
+    on_failed=_on_checkout_failed,
+)
+
+
+def _checkout_row(appt_id: str) -> Optional[tuple]:
+    """(status, mp_preference_id) del turno en la DB, o None."""
+    engine = get_engine()
+    if engine is None:
+        return None
+    cols = appointments.c
+    with engine.connect() as conn:
+        return conn.execute(
+            appointments.select()
+            .with_only_columns(cols.status, cols.mp_preference_id)
+            .where(cols.id == appt_id)
+        ).first()
+
+
+async def _checkout_from_db(appt_id: str) -> Optional[dict]:
+    """
+    El checkout diferido vive en memoria del worker que creó el turno; en
+    los demás workers (o tras un reinicio) el estado sale de la fila y el
+    link, de la preferencia en MP.
+    """
+    row = await run_in_threadpool(_checkout_row, appt_id)
+    if row is None:
+        return None
+    status, pref_id = row
+    if status == "pending_checkout":
+        return {"state": "pending", "checkout_url": None}
+    if status == "cancelled":
+        return {"state": "failed", "checkout_url": None}
+    if not pref_id:
+        return None
+    try:
+        result = await get_mp_client().get_preference(pref_id)
+    except mp_client.MPUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Mercado Pago no está disponible. Probá de nuevo en unos segundos.",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
+    except (mp_client.MPError, RuntimeError) as e:
+        raise HTTPException(status_code=502, detail=f"Error al consultar Mercado Pago: {e}")
+    mp_resp = result.get("response", {})
+    checkout_url = mp_resp.get("init_point") or mp_resp.get("sandbox_init_point")
+    if not checkout_url:
+        return None
+    return {"state": "ready", "checkout_url": checkout_url}
+
+
+@app.get("/appointments/{appointment_id}/checkout", response_model=ApptOut, tags=["appointments"])
+async def get_checkout(appointment_id: str):
+    """
+    Estado del link de pago de un turno creado en modo diferido.
+    202 mientras se genera (respetar Retry-After), 200 con checkout_url cuando está.
+    """
+    info = deferred_checkout.status(appointment_id)
+    if info is None and appointments is not None:
+        info = await _checkout_from_db(appointment_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Checkout no encontrado.")
+    if info["state"] == "failed":
+        raise HTTPException(
+            status_code=410,
+            detail="No se pudo generar el pago a tiempo; el horario fue liberado.",
+        )
+    if info["state"] == "pending":
+        out = ApptOut(id=appointment_id, status="pending_checkout", detail="Generando link de pago.")
+        return JSONResponse(
+            out.model_dump(),
+            status_code=202,
+            headers={"Retry-After": str(int(deferred_checkout.retry_every) or 1)},
+        )
+    return ApptOut(id=appointment_id, checkout_url=info["checkout_url"], status="created")
+
+
+# ─────────────────────────────────────────────────────────
+# Listado de turnos (panel médico)
+# ─────────────────────────────────────────────────────────
+def _when_ts_reads() -> bool:
+    """APPT_WHEN_TS_READS, siempre que la columna ya exista."""
+    return APPT_WHEN_TS_READS and _has_when_ts
+
+
+def _when_col() -> str:
+    """Columna para filtrar y ordenar por fecha."""
+    return "when_ts" if _when_ts_reads() else "when_at"
+
+
+def _when_at_bound(dt: Optional[datetime]):
+    if dt is None:
+        return None
+    if _when_ts_reads():
+        return to_utc(dt)
+    # when_at se guarda en la forma de iso_utc (las filas viejas las normaliza
+    # `migrate_when.py backfill`): la comparación de strings respeta el orden
+    return iso_utc(dt)
+
+
+def _require_db(request: Request):
+    """Engine para leer (réplica si corresponde); 503 si no hay DB."""
+    if get_engine() is None:
+        raise HTTPException(status_code=503, detail="DB no configurada.")
+    return read_router.engine_for_read(_caller_key(request))
+
+
+@app.get("/appointments", tags=["appointments"], dependencies=[Depends(require_panel)])
+def list_appointments(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+):
+    """
+    Turnos ordenados por (when_at, id), paginados por cursor.
+    Para la página siguiente, pasar `next_cursor` como `cursor`.
+    La agenda del día de un médico es `doctor_id` + `from`/`to`.
+    """
+    engine = _require_db(request)
+    try:
+        items, next_cursor = listing.fetch_page(
+            engine,
+            appointments,
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            doctor_id=doctor_id,
+            date_from=_when_at_bound(from_),
+            date_to=_when_at_bound(to),
+            when_col=_when_col(),
+            columns=_appt_columns(),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/appointments/export", tags=["appointments"], dependencies=[Depends(require_panel)])
+def export_appointments(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+):
+    """Exporta todos los turnos filtrados en NDJSON o CSV, en streaming."""
+    engine = _require_db(request)
+    stmt = listing.filtered_select(
+        appointments, status, _when_at_bound(from_), _when_at_bound(to),
+        doctor_id=doctor_id, when_col=_when_col(), columns=_appt_columns(),
+    )
+    rows = listing.stream_rows(engine, stmt)
+    if format == "csv":
+        columns = [c.name for c in _appt_columns()]
+        return StreamingResponse(
+            listing.iter_csv(rows, columns),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="appointments.csv"'},
+        )
+    return StreamingResponse(listing.iter_ndjson(rows), media_type="application/x-ndjson")
+
+
+# ─────────────────────────────────────────────────────────
+# Disponibilidad
+# ─────────────────────────────────────────────────────────
+@app.get("/availability", tags=["appointments"])
+def get_availability(
+    doctor_id: Optional[str] = None,
+    from_: datetime = Query(..., alias="from"),
+    to: datetime = Query(...),
+    duration: Optional[int] = Query(None, ge=10, le=180),
+):
+    """
+    Turnos libres del médico entre `from` y `to` (horario de atención).
+    Por defecto usa la duración del servicio del médico.
+    """
+    start, end = to_utc(from_), to_utc(to)
+    if end <= start:
+        raise HTTPException(status_code=422, detail="`to` debe ser posterior a `from`.")
+    if end - start > timedelta(days=AVAIL_MAX_DAYS):
+        raise HTTPException(status_code=422, detail=f"Rango máximo: {AVAIL_MAX_DAYS} días.")
+
+    doctor_id = doctor_id or DEFAULT_DOCTOR_ID
+    minutes = duration or slots.duration_for(doctor_id)
+    free = slots.free_slots(doctor_id, start, end, minutes)
+    return {
+        "doctor_id": doctor_id,
+        "duration": minutes,
+        "slots": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in free],
+    }
+
+
 # ─────────────────────────────────────────────────────────
 # Webhook de Mercado Pago
 # ─────────────────────────────────────────────────────────
+# Estado de pago en MP -> estado del turno (el resto no cambia el turno)
+_MP_PAYMENT_STATUS = mp_client.PAYMENT_STATUS
+
+
+async def _resolve_webhook(topic: str, resource_id: str, data: dict):
+    """Consulta el pago en MP y devuelve (appointment_id, status) o None."""
+    if topic != "payment":
+        return None
+    result = await get_mp_client().get_payment(resource_id)
+    if result["status"] != 200:
+        raise RuntimeError(f"MP respondió {result['status']} para el pago {resource_id}")
+    payment = result["response"]
+    appt_id = (payment.get("metadata") or {}).get("appointment_id")
+    status = _MP_PAYMENT_STATUS.get(payment.get("status"))
+    # Qué dijo MP de este pago y a qué turno corresponde (para reclamos)
+    eventlog.record("payment", str(appt_id) if appt_id else None, payment_id=resource_id,
+                    mp_status=payment.get("status"), status_detail=payment.get("status_detail"),
+                    amount=payment.get("transaction_amount"))
+    if not appt_id or not status:
+        return None
+    return str(appt_id), status
+
+
+def _update_status(engine, stmt, source: str) -> int:
+    """
+    Ejecuta un UPDATE de estado y registra en el event log cada turno que
+    efectivamente cambió (RETURNING), después del COMMIT.
+    """
+    if not engine.dialect.update_returning:
+        with engine.begin() as conn:
+            return conn.execute(stmt).rowcount
+    with engine.begin() as conn:
+        rows = conn.execute(stmt.returning(appointments.c.id, appointments.c.status)).all()
+    return _record_changed(rows, source)
+
+
+async def _update_status_async(engine, stmt, source: str) -> int:
+    if not engine.dialect.update_returning:
+        async with engine.begin() as conn:
+            return (await conn.execute(stmt)).rowcount
+    async with engine.begin() as conn:
+        rows = (await conn.execute(stmt.returning(appointments.c.id, appointments.c.status))).all()
+    return _record_changed(rows, source)
+
+
+def _record_changed(rows, source: str) -> int:
+    by_status = {}
+    for appt_id, status in rows:
+        by_status.setdefault(status, []).append(appt_id)
+    for status, ids in by_status.items():
+        eventlog.record_transitions(status, ids, source)
+        _on_status_change(status, ids)
+    return len(rows)
+
+
+# Estados con los que el turno deja de ocupar su horario
+_FREE_STATUSES = ("cancelled", "no_show", "done")
+
+
+def _on_status_change(status: str, appt_ids: list) -> None:
+    """Después del COMMIT: calendario y agenda en memoria."""
+    calendars.set_status(appt_ids, status)
+    if status in _FREE_STATUSES:
+        for appt_id in appt_ids:
+            slots.release(appt_id)
+
+
+# Desde qué estados se puede pasar a cada uno: un aviso tardío o repetido de MP
+# no pisa un pago ni revive turnos cancelados o cerrados (done / no_show)
+_WEBHOOK_FROM = {
+    "paid": ("created", "pending"),
+    "pending": ("created",),
+}
+
+
+def _webhook_status_stmt(status: str, appt_ids: list):
+    return (
+        appointments.update()
+        .where(appointments.c.id.in_(appt_ids))
+        .where(appointments.c.status.in_(_WEBHOOK_FROM.get(status, ())))
+        .values(status=status)
+    )
+
+
+def _apply_webhook_status(status: str, appt_ids: list) -> None:
+    """Un solo UPDATE ... WHERE id IN (...) por estado y por lote."""
+    engine = get_engine()
+    if engine is None:
+        return
+    updated = _update_status(engine, _webhook_status_stmt(status, appt_ids), "webhook")
+    print(f"Webhook Mercado Pago: {updated} turnos -> {status}.")
+
+
+async def _apply_webhook_status_async(status: str, appt_ids: list) -> None:
+    updated = await _update_status_async(
+        get_async_engine(), _webhook_status_stmt(status, appt_ids), "webhook"
+    )
+    print(f"Webhook Mercado Pago: {updated} turnos -> {status}.")
+
+
+async def _apply_webhook(status: str, appt_ids: list) -> None:
+    await _db_write(_apply_webhook_status, _apply_webhook_status_async, status, appt_ids)
+
+
+# Webhooks perdidos: se consulta el estado en MP periódicamente (ver reconcile.py)
+reconciler = Reconciler(
+    get_engine, appointments,
+    on_change=_on_status_change,
+)
+
+
+webhook_ingestor = WebhookIngestor(
+    _resolve_webhook,
+    _apply_webhook if DB_ASYNC else _apply_webhook_status,
+    max_batch=WEBHOOK_BATCH,
+    seen_ttl=WEBHOOK_SEEN_TTL,
+)
+
+
 @app.post("/payments/webhook", tags=["payments"])
 async def payments_webhook(request: Request):
     """
     Webhook de Mercado Pago.
-    Por ahora solo registra el evento y responde 200 OK.
+    Descarta duplicados, encola el evento, lo registra en el event log y
+    responde 200 OK (tras el fsync agrupado, unos ms).
+    Un worker consulta el pago y actualiza los turnos en lote.
     """
-    body = await request.json()
-    print("Webhook Mercado Pago:", body)
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+
+    topic, resource_id, action = extract_event(body, dict(request.query_params))
+    if not resource_id:
+        metrics.WEBHOOK_EVENTS.inc("ignored")
+        return {"ok": True}
+
+    try:
+        queued = webhook_ingestor.accept(topic, resource_id, action, body)
+    except RuntimeError as e:
+        # Cola llena: respondemos error para que MP reintente más tarde
+        metrics.WEBHOOK_EVENTS.inc("rejected")
+        raise HTTPException(status_code=503, detail=str(e))
+
+    metrics.WEBHOOK_EVENTS.inc("queued" if queued else "duplicate")
+    if queued:
+        # En disco antes del 200: si no, MP no reintenta y el aviso se pierde
+        seq = eventlog.record("webhook", None, topic=topic, resource_id=resource_id,
+                              action=action, body=body)
+        await eventlog.durable(seq)
     return {"ok": True}
+
+
+# ─────────────────────────────────────────────────────────
+# Agenda del médico como calendario (.ics)
+# ─────────────────────────────────────────────────────────
+def _cal_event(appt_id: str, doctor_id: str, patient: Optional[str], service_id: Optional[str],
+               start: datetime, status: str, minutes: Optional[int] = None) -> icalfeed.CalEvent:
+    # La duración reservada; en filas viejas (sin duration_min), la del servicio,
+    # o la del médico si no tiene
+    if minutes is None and service_id:
+        minutes = service_minutes.get(str(service_id))
+    end = start + timedelta(minutes=minutes or slots.duration_for(doctor_id))
+    return icalfeed.CalEvent(appt_id, doctor_id, patient, start, end, status)
+
+
+def _load_calendar(doctor_id: str) -> list:
+    """Turnos del médico desde hace CAL_HISTORY_DAYS (y todos los futuros)."""
+    engine = get_engine()
+    if engine is None:
+        return []
+    cols = appointments.c
+    since = datetime.now(timezone.utc) - timedelta(days=icalfeed.CAL_HISTORY_DAYS)
+    stmt = appointments.select().with_only_columns(
+        cols.id, cols.patient_id, cols.service_id, cols.when_at, cols.status, _duration_col()
+    )
+    if doctor_id == DEFAULT_DOCTOR_ID:
+        stmt = stmt.where(or_(cols.doctor_id == doctor_id, cols.doctor_id.is_(None)))
+    else:
+        stmt = stmt.where(cols.doctor_id == doctor_id)
+    # ix_appointments_doctor_when_ts; sobre when_at, cota ampliada por las filas con otro huso
+    lo = since if _when_ts_reads() else since - _MAX_UTC_OFFSET
+    stmt = stmt.where(cols[_when_col()] >= _when_at_bound(lo))
+    out = []
+    with engine.connect() as conn:
+        for appt_id, patient, service_id, when_at, status, duration in conn.execute(stmt):
+            try:
+                start = parse_iso(when_at)
+            except (TypeError, ValueError):
+                continue
+            if start >= since:
+                out.append(_cal_event(appt_id, doctor_id, patient, service_id, start, status, duration))
+    return out
+
+
+# Cada worker arma los feeds que le piden y los parchea con lo que procesa él;
+# lo que cambian los demás workers entra en el rearmado periódico (CAL_REBUILD_S)
+calendars = icalfeed.CalendarFeeds(_load_calendar)
+
+
+def _not_modified(request: Request, feed: icalfeed.Feed) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Con If-None-Match se ignora If-Modified-Since (RFC 9110)
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or feed.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return feed.last_modified <= since
+
+
+@app.get("/doctors/{doctor_id}/calendar", tags=["doctors"], dependencies=[Depends(require_panel)])
+def doctor_calendar_link(doctor_id: str, request: Request):
+    """URL de suscripción (Google Calendar: "Desde URL"; Apple: "Nueva suscripción")."""
+    base = BASE_URL or str(request.base_url).rstrip("/")
+    token = icalfeed.calendar_token(doctor_id)
+    return {"url": f"{base}/doctors/{doctor_id}/calendar.ics?token={token}"}
+
+
+@app.get("/doctors/{doctor_id}/calendar.ics", tags=["doctors"])
+async def doctor_calendar(doctor_id: str, request: Request, token: str = ""):
+    """
+    Agenda del médico en formato iCalendar. Los clientes la consultan cada pocos
+    minutos: si no cambió, 304 por ETag / Last-Modified sin tocar la DB.
+    """
+    if not icalfeed.check_token(doctor_id, token):
+        raise HTTPException(status_code=403, detail="Token de calendario inválido.")
+    if get_engine() is None:
+        raise HTTPException(status_code=503, detail="DB no configurada.")
+    await warm.wait("availability")  # duraciones de los servicios
+    feed = await calendars.get(doctor_id)
+    headers = {
+        "ETag": feed.etag,
+        "Last-Modified": formatdate(feed.last_modified.timestamp(), usegmt=True),
+        "Cache-Control": "private, max-age=60",
+    }
+    if _not_modified(request, feed):
+        metrics.CALENDAR_REQUESTS.inc("not_modified")
+        return Response(status_code=304, headers=headers)
+    metrics.CALENDAR_REQUESTS.inc("full")
+    media_type = "text/calendar; charset=utf-8"
+    if len(feed.events) <= icalfeed.CAL_STREAM_EVENTS:
+        return Response(content=b"".join(calendars.stream(feed)), media_type=media_type, headers=headers)
+    # Historias largas: en trozos, sin armar el archivo entero en memoria
+    return StreamingResponse(calendars.stream(feed), media_type=media_type, headers=headers)
+
+
+# ─────────────────────────────────────────────────────────
+# Recordatorios y cierre de turnos (done / no_show)
+# ─────────────────────────────────────────────────────────
+# Estados que todavía pueden recibir recordatorios o cerrarse
+_ACTIVE_STATUSES = ("created", "pending", "pending_checkout", "paid")
+_MAX_UTC_OFFSET = timedelta(hours=14)
+
+
+def _load_schedule(since: datetime, until: datetime) -> list:
+    """Turnos activos con inicio en [since, until): solo el tramo que se agenda."""
+    engine = get_engine()
+    if engine is None:
+        return []
+    cols = appointments.c
+    lo, hi = since, until
+    if not _when_ts_reads():
+        # Filas previas a la normalización de when_at pueden tener otro huso:
+        # ventana ampliada en SQL y el filtro exacto después de parsear
+        lo, hi = since - _MAX_UTC_OFFSET, until + _MAX_UTC_OFFSET
+    with engine.connect() as conn:
+        result = conn.execute(
+            appointments.select()
+            .with_only_columns(cols.id, cols.doctor_id, cols.patient_id, cols.when_at, _duration_col())
+            .where(cols[_when_col()] >= _when_at_bound(lo))
+            .where(cols[_when_col()] < _when_at_bound(hi))
+            .where(cols.status.in_(_ACTIVE_STATUSES))
+        )
+        out = []
+        for appt_id, doctor_id, patient, when_at, duration in result:
+            try:
+                start = parse_iso(when_at)
+            except (TypeError, ValueError):
+                continue
+            if not since <= start < until:
+                continue
+            doctor_id = doctor_id or DEFAULT_DOCTOR_ID
+            end = start + timedelta(minutes=duration or slots.duration_for(doctor_id))
+            out.append(Timed(appt_id, doctor_id, patient, start, end))
+    return out
+
+
+def _close_overdue(appt_ids: list) -> int:
+    """Un solo UPDATE por tick: pagos -> done, sin pagar -> no_show."""
+    engine = get_engine()
+    if engine is None:
+        return 0
+    cols = appointments.c
+    stmt = (
+        appointments.update()
+        .where(cols.id.in_(appt_ids))
+        .where(cols.status.in_(_ACTIVE_STATUSES))
+        .values(status=case((cols.status == "paid", "done"), else_="no_show"))
+    )
+    return _update_status(engine, stmt, "scheduler")
+
+
+async def _on_overdue(appts: list) -> None:
+    # Si el UPDATE falla, el scheduler vuelve a agendar estos turnos
+    updated = await run_in_threadpool(_close_overdue, [a.appt_id for a in appts])
+    for a in appts:
+        slots.release(a.appt_id)  # cerrados (o ya cerrados por otro camino)
+    print(f"Scheduler: {updated} turnos cerrados (done / no_show).")
+
+
+appt_scheduler = AppointmentScheduler(
+    _load_schedule,
+    on_reminder=log_reminders,
+    on_overdue=_on_overdue,
+)
+
+
+# ─────────────────────────────────────────────────────────
+# Métricas (Prometheus)
+# ─────────────────────────────────────────────────────────
+@metrics.gauge("db_pool_connections", "Conexiones del pool de la DB por estado")
+def _db_pool_gauge():
+    pool = getattr(engine, "pool", None)
+    if pool is None or not hasattr(pool, "checkedout"):
+        return []
+    return [
+        ({"state": "size"}, pool.size()),
+        ({"state": "checked_out"}, pool.checkedout()),
+        ({"state": "checked_in"}, pool.checkedin()),
+        ({"state": "overflow"}, pool.overflow()),
+    ]
+
+
+@metrics.gauge("threadpool_tokens", "Hilos del threadpool de Starlette (total y en uso)")
+def _threadpool_gauge():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return [
+        ({"state": "total"}, limiter.total_tokens),
+        ({"state": "borrowed"}, limiter.borrowed_tokens),
+        ({"state": "waiting"}, limiter.statistics().tasks_waiting),
+    ]
+
+
+@metrics.gauge("queue_depth", "Elementos pendientes en colas internas")
+def _queue_gauge():
+    samples = [
+        ({"queue": "webhooks"}, webhook_ingestor.qsize()),
+        ({"queue": "deferred_checkout"}, deferred_checkout.pending()),
+        ({"queue": "scheduler"}, appt_scheduler.pending()),
+        ({"queue": "auth_hash"}, password_pool.pending),
+    ]
+    if appt_writer is not None:
+        samples.append(({"queue": "appointment_writes"}, appt_writer.qsize()))
+    return samples
+
+
+@metrics.gauge("mp_circuit_state", "Circuito de Mercado Pago (1 = estado actual)")
+def _mp_circuit_gauge():
+    state = mp_client.breaker.state
+    return [({"state": s}, int(s == state)) for s in ("closed", "open", "half_open")]
+
+
+# ─────────────────────────────────────────────────────────
+# Requests lentos y perfiles (ver tracing.py)
+# ─────────────────────────────────────────────────────────
+@app.get("/debug/slow", tags=["default"], include_in_schema=False, dependencies=[Depends(require_panel)])
+def debug_slow(limit: int = Query(50, ge=1, le=1000)):
+    """Últimas trazas guardadas (lentas o muestreadas), con el desglose por tramo."""
+    return {
+        "sample_rate": tracing.TRACE_SAMPLE_RATE,
+        "slow_ms": tracing.TRACE_SLOW_MS,
+        "traces": [t.to_dict() for t in tracing.buffer.snapshot(limit)],
+    }
+
+
+@app.get("/debug/slow/profile", tags=["default"], include_in_schema=False,
+         dependencies=[Depends(require_panel)])
+def debug_slow_profile(trace_id: Optional[int] = Query(None, alias="trace")):
+    """
+    Pilas plegadas de los requests muestreados (todas sumadas, o las de `trace`):
+    `curl ... > out.folded && flamegraph.pl out.folded > out.svg`, o abrir en speedscope.
+    """
+    if trace_id is None:
+        traces = tracing.buffer.snapshot()
+    else:
+        trace = tracing.buffer.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Traza no encontrada (ya salió del buffer?).")
+        traces = [trace]
+    return Response(content=tracing.folded(traces), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/metrics", tags=["default"], include_in_schema=False)
+async def get_metrics():
+    # async: los gauges del threadpool se leen desde el event loop
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,6 +1,15 @@
 # Crea usuario admin/médico y servicio de Emilio
+# Con --bulk genera además un dataset sintético grande (ver bulk()).
+import argparse
+import itertools
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
 from db import SessionLocal, Base, engine
-from models import User, Service, Role
+from models import User, Patient, Service, Role
 from auth import hash_password
 
 def main():
@@ -23,5 +32,196 @@ def main():
 
     print("Listo. Admin/Médico:", email, "| Servicio creado con $40000 por 30 minutos.")
 
+# ─────────────────────────────────────────────────────────
+# Dataset sintético (modo --bulk)
+# ─────────────────────────────────────────────────────────
+_NOMBRES = ["Sofía", "Mateo", "Valentina", "Benjamín", "Isabella", "Thiago", "Martina", "Lautaro",
+            "Catalina", "Joaquín", "Emma", "Santino", "Mía", "Bautista", "Olivia", "Felipe"]
+_APELLIDOS = ["González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez",
+              "García", "Sánchez", "Romero", "Sosa", "Torres", "Álvarez", "Ruiz", "Ramírez"]
+_SERVICIOS = [("Teleconsulta pediátrica", 30, 40000), ("Consulta de control", 20, 30000),
+              ("Asesoramiento por síntomas", 20, 35000), ("Primera consulta", 45, 50000),
+              ("Seguimiento infectológico", 30, 45000), ("Consulta extendida", 60, 70000)]
+# Demanda por hora local: picos a media mañana y a la tarde
+_HOUR_WEIGHT = {9: 3, 10: 5, 11: 5, 12: 3, 13: 1, 14: 2, 15: 3, 16: 4, 17: 4, 18: 2}
+
+def _name(rng):
+    return f"{rng.choice(_NOMBRES)} {rng.choice(_APELLIDOS)}"
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _next_id(conn, table):
+    from sqlalchemy import func, select
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+def bulk_insert(eng, table, rows, batch=5000):
+    """
+    Inserta un iterable de dicts en lotes de `batch`, un COMMIT por lote.
+    Postgres (psycopg 3): COPY ... FROM STDIN. Resto: executemany.
+    Devuelve cuántas filas insertó.
+    """
+    n = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, batch))
+        if not chunk:
+            return n
+        cols = list(chunk[0].keys())
+        with eng.begin() as conn:
+            if eng.dialect.name == "postgresql" and eng.dialect.driver == "psycopg":
+                cur = conn.connection.driver_connection.cursor()
+                sql = f"COPY {table.name} ({', '.join(cols)}) FROM STDIN"
+                with cur.copy(sql) as copy:
+                    for r in chunk:
+                        copy.write_row([r[c] for c in cols])
+            else:
+                conn.execute(table.insert(), chunk)
+        n += len(chunk)
+
+def _sync_sequence(eng, table):
+    """Con ids explícitos (COPY) la secuencia de Postgres no avanza: la llevamos al max(id)
+    para que el próximo INSERT sin id no choque con la clave primaria."""
+    if eng.dialect.name != "postgresql":
+        return  # SQLite toma max(rowid) + 1
+    from sqlalchemy import text
+    with eng.begin() as conn:
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"(SELECT max(id) FROM {table.name}))"
+        ))
+
+def _gen_appointments(rng, doctors, patients, services, n, past_days, future_days, now):
+    """
+    Turnos sin solapamientos por médico, en días hábiles y horario de atención
+    (los de availability.py), con más demanda en algunos médicos y horarios.
+    Estado según sea pasado (done/no_show/cancelled) o futuro (created/pending/paid).
+    """
+    from availability import AvailabilityEngine
+    cal = AvailabilityEngine()
+    by_doctor = {}
+    for s in services:
+        by_doctor.setdefault(s["doctor_id"], []).append(s)
+    # Pocos médicos concentran la mayoría de los turnos (pareto)
+    # (cum_weights precalculados: choices() con weights= es O(n) por llamada)
+    doc_cum = list(itertools.accumulate(rng.paretovariate(1.5) for _ in doctors))
+    # Pacientes frecuentes y ocasionales
+    pat_cum = list(itertools.accumulate(rng.paretovariate(2.0) for _ in patients))
+    hours = [h for h in _HOUR_WEIGHT if cal.opens.hour <= h < cal.closes.hour] or [cal.opens.hour]
+    hour_w = [_HOUR_WEIGHT[h] for h in hours]
+    first_day = (now - timedelta(days=past_days)).astimezone(cal.tz).date()
+    days = [first_day + timedelta(days=i) for i in range(past_days + future_days)]
+    days = [d for d in days if d.weekday() in cal.weekdays]
+    taken = set()
+
+    made = misses = 0
+    while made < n and misses < n:
+        doc = rng.choices(doctors, cum_weights=doc_cum)[0]
+        svc = rng.choice(by_doctor[doc["id"]])
+        dur = svc["duration_min"]
+        day = rng.choice(days)
+        hour = rng.choices(hours, weights=hour_w)[0]
+        minute = rng.randrange(0, 60, dur) if dur < 60 else 0
+        start = datetime.combine(day, cal.opens, cal.tz).replace(hour=hour, minute=minute)
+        # Ocupamos cada bloque de 5 minutos del turno para detectar solapamientos
+        blocks = [(doc["id"], start + timedelta(minutes=m)) for m in range(0, dur, 5)]
+        if start.time() < cal.opens or (start + timedelta(minutes=dur)).time() > cal.closes \
+                or any(b in taken for b in blocks):
+            misses += 1
+            continue
+        taken.update(blocks)
+        start = start.astimezone(timezone.utc)
+        pat = rng.choices(patients, cum_weights=pat_cum)[0]
+        if start < now:
+            status = rng.choices(["done", "no_show", "cancelled"], weights=[85, 10, 5])[0]
+        else:
+            status = rng.choices(["paid", "created", "pending"], weights=[60, 30, 10])[0]
+        appt_id = _uuid(rng)
+        made += 1
+        yield {
+            "id": appt_id,
+            "doctor_id": str(doc["id"]),
+            "patient_id": pat["email"],
+            "service_id": str(svc["id"]),
+            "when_at": start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "when_ts": start,
+            "duration_min": dur,
+            "status": status,
+            "price": int(svc["price"]),
+            "currency": "ARS",
+            "mp_preference_id": None if status == "cancelled" else f"pref-{appt_id[:8]}",
+            "video_url": None,
+            "created_at": (start - timedelta(days=rng.expovariate(1 / 7))).replace(tzinfo=None),
+        }
+    if made < n:
+        print(f"ATENCIÓN: solo entraron {made} turnos sin solaparse (pedidos: {n}).")
+
+def bulk(doctors=20, patients=5000, appointments=50000, seed=42, batch=5000,
+         past_days=180, future_days=60):
+    """Genera médicos, pacientes, servicios y turnos sintéticos (reproducible con `seed`)."""
+    import main  # tabla appointments de la app (id texto, when_at ISO + when_ts)
+    if main.appointments is None or main.get_engine() is None:
+        raise SystemExit("DATABASE_URL no está configurada: no hay dónde guardar los turnos.")
+
+    rng = random.Random(seed)
+    # Mismo seed, mismo día -> mismo dataset (las fechas son relativas a hoy)
+    now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    t0 = time.perf_counter()
+
+    # La tabla appointments es la de main.py, no la del modelo ORM
+    Base.metadata.create_all(bind=engine, tables=[User.__table__, Patient.__table__, Service.__table__])
+    main.metadata.create_all(main.get_engine())
+    if not main._ensure_columns():  # tabla previa a when_ts / duration_min
+        raise SystemExit("No se pudieron agregar when_ts y duration_min a appointments.")
+
+    users, pats, svcs = User.__table__, Patient.__table__, Service.__table__
+    with engine.connect() as conn:
+        uid, pid, sid = _next_id(conn, users), _next_id(conn, pats), _next_id(conn, svcs)
+
+    pw = hash_password("demo1234")  # un solo bcrypt para todos los médicos sintéticos
+    doc_rows = [{"id": uid + i, "name": f"Dr/a. {_name(rng)}", "email": f"medico{uid + i}@example.com",
+                 "phone": None, "role": Role.doctor.name, "password_hash": pw,
+                 "created_at": now.replace(tzinfo=None)} for i in range(doctors)]
+    pat_rows = [{"id": pid + i, "name": _name(rng), "email": f"paciente{pid + i}@example.com",
+                 "phone": f"+54 9 11 {rng.randrange(10**7, 10**8)}", "consent_at": None}
+                for i in range(patients)]
+    svc_rows = []
+    for d in doc_rows:
+        for title, dur, price in rng.sample(_SERVICIOS, rng.randint(1, 3)):
+            svc_rows.append({"id": sid + len(svc_rows), "doctor_id": d["id"], "title": title,
+                             "duration_min": dur, "price": float(price), "currency": "ARS"})
+
+    counts = {
+        "users": bulk_insert(engine, users, doc_rows, batch),
+        "patients": bulk_insert(engine, pats, pat_rows, batch),
+        "services": bulk_insert(engine, svcs, svc_rows, batch),
+    }
+    for table in (users, pats, svcs):
+        _sync_sequence(engine, table)
+    counts["appointments"] = bulk_insert(
+        main.get_engine(), main.appointments,
+        _gen_appointments(rng, doc_rows, pat_rows, svc_rows, appointments, past_days, future_days, now),
+        batch,
+    )
+    took = time.perf_counter() - t0
+    total = sum(counts.values())
+    print(f"Listo en {took:.1f}s ({math.floor(total / max(took, 1e-9))} filas/s):", counts)
+    return counts
+
+def _cli():
+    p = argparse.ArgumentParser(description="Seed de la base (admin de Emilio o dataset sintético).")
+    p.add_argument("--bulk", action="store_true", help="generar dataset sintético")
+    p.add_argument("--doctors", type=int, default=20)
+    p.add_argument("--patients", type=int, default=5000)
+    p.add_argument("--appointments", type=int, default=50000)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--batch", type=int, default=5000, help="filas por transacción")
+    p.add_argument("--past-days", type=int, default=180)
+    p.add_argument("--future-days", type=int, default=60)
+    a = p.parse_args()
+    if not a.bulk:
+        return main()
+    bulk(a.doctors, a.patients, a.appointments, a.seed, a.batch, a.past_days, a.future_days)
+
 if __name__ == "__main__":
-    main()
+    _cli()
@@ -0,0 +1,249 @@
+# metrics.py — métricas en formato texto de Prometheus, sin locks en el camino caliente
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Buckets en segundos: de 5 ms a 10 s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+GaugeFn = Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+
+
+class _Sharded:
+    """
+    Cada hilo escribe en su propio shard (threading.local), así observe()
+    no toma locks ni compite con otros hilos. Al exportar se suman todos.
+    El lock solo se usa la primera vez que un hilo registra su shard.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._reg_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._reg_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self) -> List[dict]:
+        with self._reg_lock:
+            shards = list(self._shards)
+        # Copia por shard: otro hilo puede agregar claves mientras leemos
+        return [dict(s) for s in shards]
+
+
+class Counter(_Sharded):
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshot():
+            for labels, v in shard.items():
+                totals[labels] = totals.get(labels, 0.0) + v
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, v in sorted(totals.items()):
+            lines.append(f"{self.name}{_fmt(self.labelnames, labels)} {_num(v)}")
+        return lines
+
+
+class Histogram(_Sharded):
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # [cuentas por bucket..., +Inf, suma]
+            cell = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[labels] = cell
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                cell[i] += 1
+                break
+        else:
+            cell[len(self.buckets)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def collect(self) -> List[str]:
+        n = len(self.buckets) + 1
+        totals: Dict[LabelValues, list] = {}
+        for shard in self._snapshot():
+            for labels, cell in shard.items():
+                acc = totals.setdefault(labels, [0] * n + [0.0])
+                for i in range(n + 1):
+                    acc[i] += cell[i]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, acc in sorted(totals.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                cumulative += acc[i]
+                le = "+Inf" if bound == float("inf") else _num(bound)
+                lines.append(
+                    f"{self.name}_bucket{_fmt(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_fmt(self.labelnames, labels)} {_num(acc[-1])}")
+            lines.append(f"{self.name}_count{_fmt(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge calculado al exportar (p. ej. estado del pool de la DB)."""
+
+    def __init__(self, name: str, help: str, fn: GaugeFn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = list(self.fn())
+        except Exception:
+            samples = []
+        for labels, v in samples:
+            names = tuple(labels)
+            lines.append(f"{self.name}{_fmt(names, tuple(labels[k] for k in names))} {_num(v)}")
+        return lines
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values)) + "}"
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+# ─────────────────────────────────────────────────────────
+# Registro global
+# ─────────────────────────────────────────────────────────
+_registry: List[object] = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help: str):
+    """Decorador: registra una función como gauge calculado al exportar."""
+    def wrap(fn: GaugeFn) -> GaugeFn:
+        register(Gauge(name, help, fn))
+        return fn
+    return wrap
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Métricas compartidas por todos los módulos
+HTTP_LATENCY = register(Histogram(
+    "http_request_duration_seconds", "Latencia de requests HTTP por ruta",
+    ("method", "route", "status"),
+))
+MP_LATENCY = register(Histogram(
+    "mp_request_duration_seconds", "Latencia de llamadas a Mercado Pago",
+    ("op", "outcome"),
+))
+MP_REJECTED = register(Counter(
+    "mp_rejected_total", "Llamadas a Mercado Pago rechazadas sin salir", ("op", "reason"),
+))
+AUTH_HASH_LATENCY = register(Histogram(
+    "auth_hash_duration_seconds", "bcrypt en el pool de procesos (incluye la cola)", ("op", "outcome"),
+))
+DB_INSERT_LATENCY = register(Histogram(
+    "db_insert_duration_seconds", "Latencia del INSERT de turnos (incluye COMMIT)",
+    ("mode",),
+))
+DB_INSERT_ROWS = register(Counter(
+    "db_insert_rows_total", "Turnos insertados", ("mode",),
+))
+WEBHOOK_LATENCY = register(Histogram(
+    "webhook_batch_duration_seconds", "Procesamiento de un lote de webhooks", ("stage",),
+))
+WEBHOOK_EVENTS = register(Counter(
+    "webhook_events_total", "Notificaciones de Mercado Pago recibidas", ("result",),
+))
+EVENTLOG_APPENDS = register(Counter(
+    "eventlog_appends_total", "Eventos escritos en el event log",
+))
+EVENTLOG_FSYNC_LATENCY = register(Histogram(
+    "eventlog_fsync_duration_seconds", "fsync agrupado del event log",
+))
+CALENDAR_REQUESTS = register(Counter(
+    "calendar_requests_total", "Pedidos de feeds iCalendar", ("result",),
+))
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: mide cada request por plantilla de ruta (no por URL)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - t0,
+                scope["method"],
+                getattr(route, "path", "<unmatched>"),
+                status,
+            )
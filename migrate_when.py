@@ -0,0 +1,179 @@
+# migrate_when.py — migración de appointments.when_at (texto ISO) a when_ts (timestamptz)
+#
+# Pasos:
+#   1. La app agrega la columna al arrancar (ensure_column) y desde ahí escribe ambas.
+#   2. python migrate_when.py backfill       # completa las filas viejas, por lotes,
+#                                            # y pasa when_at a UTC (iso_utc)
+#   3. python migrate_when.py status         # 0 pendientes -> APPT_WHEN_TS_READS=1
+#
+# El backfill no bloquea la tabla: cada lote es una transacción corta que toca
+# solo sus filas (keyset por id), con pausa entre lotes para no saturar la DB
+# ni atrasar la réplica.
+
+import argparse
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import Table, bindparam, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from availability import iso_utc, parse_iso
+
+BACKFILL_BATCH = 1000
+BACKFILL_PAUSE_MS = 50
+_LOCK_TIMEOUT = "2s"  # Postgres: si una fila está tomada, reintentar el lote en vez de esperar
+
+
+def has_column(engine: Engine, table: Table, name: str = "when_ts") -> bool:
+    return any(c["name"] == name for c in inspect(engine).get_columns(table.name))
+
+
+def ensure_column(engine: Engine, table: Table, name: str = "when_ts") -> bool:
+    """
+    ALTER TABLE ... ADD COLUMN si falta (nullable y sin default: en Postgres es
+    solo un cambio de catálogo, no reescribe la tabla). Devuelve si la columna existe.
+    """
+    if has_column(engine, table, name):
+        return True
+    col_type = table.c[name].type.compile(dialect=engine.dialect)
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                conn.execute(text(f"SET LOCAL lock_timeout = '{_LOCK_TIMEOUT}'"))
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {col_type}"))
+    except Exception as e:
+        print(f"ERROR al agregar {table.name}.{name}:", e)
+        return has_column(engine, table, name)
+    print(f"Columna {table.name}.{name} agregada.")
+    return True
+
+
+def pending_count(engine: Engine, table: Table) -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(table).where(table.c.when_ts.is_(None))
+        ).scalar()
+
+
+def _to_ts(when_at: Optional[str]):
+    try:
+        return parse_iso(when_at)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def backfill(
+    engine: Engine,
+    table: Table,
+    *,
+    batch: int = BACKFILL_BATCH,
+    pause_ms: float = BACKFILL_PAUSE_MS,
+    retries: int = 5,
+) -> Dict[str, int]:
+    """
+    Completa when_ts a partir de when_at y reescribe when_at en UTC (iso_utc:
+    "10:00-03:00" y "13:00Z" tienen que ordenar igual como texto), en lotes de
+    `batch` filas recorridas por id. Las filas con when_at ilegible quedan en
+    NULL y se informan. Se puede cortar y volver a correr: las filas ya
+    migradas se leen pero no se vuelven a escribir.
+    """
+    c = table.c
+    stats = {"updated": 0, "invalid": 0, "batches": 0}
+    invalid: List[str] = []
+    page = (
+        select(c.id, c.when_at, c.when_ts)
+        .where(c.id > bindparam("after"))
+        .order_by(c.id)
+        .limit(batch)
+    )
+    update = (
+        table.update()
+        .where(c.id == bindparam("b_id"))
+        .where(c.when_at == bindparam("b_old"))  # no pisar un cambio hecho mientras tanto
+        .values(when_ts=bindparam("b_ts"), when_at=bindparam("b_at"))
+    )
+    after = ""
+    t0 = time.perf_counter()
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(page, {"after": after}).all()
+        if not rows:
+            break
+        after = rows[-1][0]
+        params = []
+        for appt_id, when_at, when_ts in rows:
+            ts = _to_ts(when_at)
+            if ts is None:
+                stats["invalid"] += 1
+                invalid.append(appt_id)
+                continue
+            canonical = iso_utc(ts)
+            if when_ts is None or when_at != canonical:
+                params.append({"b_id": appt_id, "b_old": when_at, "b_ts": ts, "b_at": canonical})
+        for attempt in range(retries + 1):
+            try:
+                with engine.begin() as conn:
+                    if engine.dialect.name == "postgresql":
+                        conn.execute(text(f"SET LOCAL lock_timeout = '{_LOCK_TIMEOUT}'"))
+                    if params:
+                        conn.execute(update, params)
+                break
+            except OperationalError as e:
+                if attempt == retries:
+                    raise
+                print(f"Lote ocupado ({e.__class__.__name__}), reintentando...")
+                time.sleep(0.5 * 2 ** attempt)
+        stats["updated"] += len(params)
+        stats["batches"] += 1
+        if stats["batches"] % 20 == 0:
+            rate = stats["updated"] / max(time.perf_counter() - t0, 1e-9)
+            print(f"Backfill: {stats['updated']} filas ({rate:.0f}/s)...")
+        if len(rows) < batch:
+            break
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+    if invalid:
+        print(f"ATENCIÓN: {len(invalid)} turnos con when_at ilegible (quedan en NULL):", invalid[:20])
+    stats["seconds"] = round(time.perf_counter() - t0, 1)
+    print("Backfill de when_ts:", stats)
+    return stats
+
+
+def _cli() -> None:
+    parser = argparse.ArgumentParser(description="Migración de appointments.when_at a when_ts.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="filas sin when_ts e índices")
+    p = sub.add_parser("backfill", help="completar when_ts por lotes")
+    p.add_argument("--batch", type=int, default=BACKFILL_BATCH)
+    p.add_argument("--pause-ms", type=float, default=BACKFILL_PAUSE_MS,
+                   help="pausa entre lotes (default %(default)s)")
+    args = parser.parse_args()
+
+    import main  # tabla y engine de la app
+
+    engine = main.get_engine()
+    if engine is None:
+        raise SystemExit("DATABASE_URL no está configurada.")
+    if not ensure_column(engine, main.appointments):
+        raise SystemExit("No se pudo agregar la columna when_ts.")
+
+    if args.cmd == "backfill":
+        backfill(engine, main.appointments, batch=args.batch, pause_ms=args.pause_ms)
+        main._ensure_indexes()
+        return
+
+    pending = pending_count(engine, main.appointments)
+    existing = {i["name"] for i in inspect(engine).get_indexes(main.appointments.name)}
+    print(f"Turnos sin when_ts: {pending}")
+    for index in main.appointments.indexes:
+        if "when_ts" in index.name:
+            print(f"Índice {index.name}: {'ok' if index.name in existing else 'falta'}")
+    if pending == 0:
+        print("Listo: se puede activar APPT_WHEN_TS_READS=1.")
+    else:
+        print("Correr `backfill`; si quedan, son when_at ilegibles (ver su salida) a corregir a mano.")
+
+
+if __name__ == "__main__":
+    _cli()
@@ -13,9 +13,11 @@ class Channel(str, enum.Enum):
 
 class Status(str, enum.Enum):
     pending = "pending"
+    pending_checkout = "pending_checkout"  # checkout diferido: esperando la preferencia de MP
     paid = "paid"
     done = "done"
     no_show = "no_show"
+    cancelled = "cancelled"
 
 class User(Base):
     __tablename__ = "users"
@@ -76,9 +78,11 @@ class ApptIn(BaseModel):
     price: int = Field(ge=0)
     duration: int = Field(ge=5)          # minutos
     start_at: datetime                   # ISO-8601
+    doctor_id: str | None = None         # si falta, el médico por defecto
 
 class ApptOut(BaseModel):
     id: str
     checkout_url: str | None = None
     join_url: str | None = None
     paid: bool = False
+    join_token: str | None = None        # para /join sin consultar el store
@@ -0,0 +1,317 @@
+# mp_client.py — cliente asíncrono y compartido para la API de Mercado Pago
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from metrics import MP_LATENCY, MP_REJECTED
+
+# ─────────────────────────────────────────────────────────
+# Configuración (variables de entorno)
+# ─────────────────────────────────────────────────────────
+MP_ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN", "")
+MP_API_URL = os.getenv("MP_API_URL", "https://api.mercadopago.com").rstrip("/")
+MP_CONNECT_TIMEOUT = float(os.getenv("MP_CONNECT_TIMEOUT", "3"))
+MP_TIMEOUT = float(os.getenv("MP_TIMEOUT", "10"))
+MP_MAX_CONNECTIONS = int(os.getenv("MP_MAX_CONNECTIONS", "20"))
+MP_MAX_KEEPALIVE = int(os.getenv("MP_MAX_KEEPALIVE", "10"))
+MP_MAX_CONCURRENCY = int(os.getenv("MP_MAX_CONCURRENCY", "20"))
+# Bulkhead: cuánto esperar un lugar libre antes de rechazar (segundos)
+MP_ACQUIRE_TIMEOUT = float(os.getenv("MP_ACQUIRE_TIMEOUT", "0.05"))
+# Lugares que pueden ocupar los procesos en segundo plano (webhooks, conciliación).
+# Esperan su turno en vez de fallar; el resto queda siempre libre para las reservas.
+MP_BG_CONCURRENCY = int(os.getenv("MP_BG_CONCURRENCY", str(max(1, MP_MAX_CONCURRENCY // 2))))
+# Circuit breaker
+MP_BREAKER_FAILURES = int(os.getenv("MP_BREAKER_FAILURES", "5"))       # fallas seguidas para abrir
+MP_BREAKER_RESET_S = float(os.getenv("MP_BREAKER_RESET_S", "30"))      # abierto antes de probar
+MP_BREAKER_PROBES = int(os.getenv("MP_BREAKER_PROBES", "1"))           # pruebas en semiabierto
+
+
+# Estado de un pago en MP -> estado del turno (los demás no cambian nada)
+PAYMENT_STATUS = {
+    "approved": "paid",
+    "authorized": "pending",
+    "in_process": "pending",
+    "pending": "pending",
+}
+
+
+class MPError(RuntimeError):
+    """Error de red o de protocolo al hablar con Mercado Pago."""
+
+
+class MPRejected(MPError):
+    """MP respondió 4xx: el mismo pedido va a volver a fallar, no tiene sentido reintentarlo."""
+
+
+class MPUnavailable(MPError):
+    """No se llamó a MP: el circuito está abierto o no hay lugar en el bulkhead."""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(f"Mercado Pago no disponible ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    closed -> open tras `failures` fallas seguidas (red, 5xx o 429).
+    open   -> rechaza todo durante `reset_timeout` segundos.
+    half_open -> deja pasar hasta `probes` llamadas de prueba: si salen bien
+    cierra, si alguna falla vuelve a abrir.
+    Compartido por todos los clientes del proceso (un solo event loop a la vez).
+    """
+
+    def __init__(
+        self,
+        failures: int = MP_BREAKER_FAILURES,
+        reset_timeout: float = MP_BREAKER_RESET_S,
+        probes: int = MP_BREAKER_PROBES,
+    ):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.state = "closed"
+        self._failed = 0
+        self._opened_at = 0.0
+        self._probing = 0
+
+    def retry_after(self) -> float:
+        if self.state != "open":
+            return 1.0
+        return max(1.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self) -> None:
+        """Lanza MPUnavailable si el circuito no deja pasar esta llamada."""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise MPUnavailable("circuito abierto", self.retry_after())
+            self.state = "half_open"
+            self._probing = 0
+        if self.state == "half_open":
+            if self._probing >= self.probes:
+                raise MPUnavailable("circuito semiabierto")
+            self._probing += 1
+
+    def on_success(self) -> None:
+        if self.state == "half_open":
+            self._probing -= 1
+            if self._probing > 0:
+                return
+            print("Circuito de Mercado Pago cerrado.")
+        self.state = "closed"
+        self._failed = 0
+
+    def on_failure(self) -> None:
+        self._failed += 1
+        if self.state == "half_open" or self._failed >= self.failures:
+            if self.state != "open":
+                print(f"Circuito de Mercado Pago abierto por {self.reset_timeout:.0f}s.")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = 0
+
+    def on_cancel(self) -> None:
+        """La llamada no llegó a un resultado (p. ej. se canceló el request)."""
+        if self.state == "half_open" and self._probing > 0:
+            self._probing -= 1
+
+
+breaker = CircuitBreaker()
+
+
+class MPClient:
+    """
+    Cliente HTTP de larga vida para Mercado Pago.
+    Reutiliza conexiones TLS (keep-alive), aplica timeouts y limita
+    cuántas llamadas simultáneas salen hacia MP.
+    Las respuestas tienen la misma forma que el SDK: {"status", "response"}.
+
+    Si MP se pone lento, las llamadas no se acumulan: con el bulkhead lleno
+    se espera a lo sumo `acquire_timeout` y se lanza MPUnavailable; con el
+    circuito abierto se lanza sin esperar.
+    Las llamadas en segundo plano (`background=True`) no fallan por bulkhead
+    lleno: esperan un lugar, y nunca ocupan más de `bg_concurrency` de los
+    `max_concurrency`.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        *,
+        base_url: str = MP_API_URL,
+        timeout: float = MP_TIMEOUT,
+        connect_timeout: float = MP_CONNECT_TIMEOUT,
+        max_connections: int = MP_MAX_CONNECTIONS,
+        max_keepalive: int = MP_MAX_KEEPALIVE,
+        max_concurrency: int = MP_MAX_CONCURRENCY,
+        acquire_timeout: float = MP_ACQUIRE_TIMEOUT,
+        bg_concurrency: int = MP_BG_CONCURRENCY,
+        circuit: Optional[CircuitBreaker] = None,
+    ):
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {access_token}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._bg_sem = asyncio.Semaphore(max(1, min(bg_concurrency, max_concurrency - 1)))
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.breaker = circuit if circuit is not None else breaker
+
+    @property
+    def in_flight(self) -> int:
+        return self.max_concurrency - self._sem._value
+
+    async def _acquire(self, op: str) -> None:
+        try:
+            self.breaker.before_call()
+        except MPUnavailable:
+            MP_REJECTED.inc(op, "circuit_open")
+            raise
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.on_cancel()
+            MP_REJECTED.inc(op, "saturated")
+            raise MPUnavailable("demasiadas llamadas en curso")
+
+    async def _acquire_background(self, op: str) -> None:
+        # Primero el lugar (esperando lo que haga falta), después el circuito:
+        # así una prueba en semiabierto no queda tomada mientras se espera
+        await self._bg_sem.acquire()
+        try:
+            await self._sem.acquire()
+        except BaseException:
+            self._bg_sem.release()
+            raise
+        try:
+            self.breaker.before_call()
+        except MPUnavailable:
+            self._sem.release()
+            self._bg_sem.release()
+            MP_REJECTED.inc(op, "circuit_open")
+            raise
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        op: Optional[str] = None,
+        background: bool = False,
+    ) -> Dict[str, Any]:
+        headers = {"X-Idempotency-Key": idempotency_key} if idempotency_key else None
+        op = op or f"{method} {path}"
+        if background:
+            await self._acquire_background(op)
+        else:
+            await self._acquire(op)
+        t0 = time.perf_counter()
+        try:
+            resp = await self._http.request(
+                method, path, json=json, params=params, headers=headers
+            )
+        except httpx.HTTPError as e:
+            MP_LATENCY.observe(time.perf_counter() - t0, op, "error")
+            self.breaker.on_failure()
+            raise MPError(f"{type(e).__name__}: {e}") from e
+        except BaseException:
+            self.breaker.on_cancel()
+            raise
+        finally:
+            self._sem.release()
+            if background:
+                self._bg_sem.release()
+        MP_LATENCY.observe(
+            time.perf_counter() - t0, op, "ok" if resp.status_code < 400 else "http_error"
+        )
+        # 4xx es culpa nuestra (datos inválidos): no dice nada de la salud de MP
+        if resp.status_code >= 500 or resp.status_code == 429:
+            self.breaker.on_failure()
+        else:
+            self.breaker.on_success()
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        return {"status": resp.status_code, "response": body}
+
+    async def create_preference(
+        self, preference: Dict[str, Any], idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self.request(
+            "POST", "/checkout/preferences", json=preference,
+            idempotency_key=idempotency_key, op="create_preference",
+        )
+
+    async def get_preference(self, preference_id: str) -> Dict[str, Any]:
+        return await self.request(
+            "GET", f"/checkout/preferences/{preference_id}", op="get_preference",
+        )
+
+    async def get_payment(self, payment_id: str, *, background: bool = True) -> Dict[str, Any]:
+        # La usa el worker de webhooks: espera lugar en vez de perder el aviso
+        return await self.request(
+            "GET", f"/v1/payments/{payment_id}", op="get_payment", background=background,
+        )
+
+    async def search_merchant_orders(self, preference_id: str, *, background: bool = True) -> Dict[str, Any]:
+        """Órdenes (con sus pagos) de una preferencia (la usa la conciliación)."""
+        return await self.request(
+            "GET", "/merchant_orders/search", params={"preference_id": preference_id},
+            op="search_merchant_orders", background=background,
+        )
+
+    async def warm(self) -> None:
+        """Abre la conexión TLS de antemano; el código de respuesta no importa."""
+        try:
+            await self._http.head("/")
+        except httpx.HTTPError as e:
+            raise MPError(f"{type(e).__name__}: {e}") from e
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+# ─────────────────────────────────────────────────────────
+# Instancia compartida (una por event loop)
+# ─────────────────────────────────────────────────────────
+_client: Optional[MPClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_mp_client() -> MPClient:
+    """
+    Devuelve el cliente compartido, creándolo en el primer uso.
+    Debe llamarse desde una corrutina: el pool queda atado a ese event loop.
+    """
+    global _client, _client_loop
+    if not MP_ACCESS_TOKEN:
+        raise RuntimeError("MP_ACCESS_TOKEN no está configurado en las variables de entorno.")
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = MPClient(MP_ACCESS_TOKEN)
+        _client_loop = loop
+    return _client
+
+
+async def close_mp_client() -> None:
+    """Cierra el pool de conexiones (llamar al apagar la app)."""
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
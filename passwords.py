@@ -0,0 +1,114 @@
+# passwords.py — bcrypt en un pool de procesos acotado, fuera del event loop y del GIL
+
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from metrics import AUTH_HASH_LATENCY
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Dejamos al menos un núcleo para atender requests
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(2, max(1, (os.cpu_count() or 2) - 1)))))
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "32"))  # más que esto -> 429
+
+_pwd = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Para usuarios inexistentes verificamos contra este hash: mismo costo, sin pista por tiempo
+DUMMY_HASH = "$2b$12$BFqZbNP3xHHHVoJSwzePkudqmv9OpYh6Iw5rVFLWK5nGl5jmINyoa"
+
+
+def hash_password(password: str) -> str:
+    return _pwd.hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        return _pwd.verify(password, password_hash)
+    except (ValueError, TypeError):
+        return False  # hash corrupto o de otro esquema
+
+
+def _noop() -> None:
+    pass
+
+
+class PoolBusy(RuntimeError):
+    """Hay demasiadas verificaciones en cola; reintentar en `retry_after` segundos."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Demasiados intentos de login en curso.")
+        self.retry_after = retry_after
+
+
+class PasswordPool:
+    """
+    Pool de procesos para bcrypt (~100-300 ms de CPU por hash).
+    Los procesos se crean con "spawn" y solo importan este módulo.
+    Como máximo `max_pending` operaciones entre en curso y en cola; la
+    siguiente recibe PoolBusy con un Retry-After estimado a partir del
+    tiempo medio por operación.
+    """
+
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.avg_seconds = 0.25  # se ajusta con cada operación
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """Levanta los procesos de antemano (spawn tarda más que un hash)."""
+        loop = asyncio.get_running_loop()
+        ex = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(ex, _noop) for _ in range(self.workers)))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.pending * self.avg_seconds / self.workers))
+
+    async def _run(self, op: str, fn, *args):
+        if self.pending >= self.max_pending:
+            AUTH_HASH_LATENCY.observe(0.0, op, "rejected")
+            raise PoolBusy(self.retry_after())
+        self.pending += 1
+        t0 = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        except BrokenProcessPool:
+            # Se murió un proceso: el próximo pedido arma un pool nuevo
+            self.shutdown()
+            raise
+        finally:
+            self.pending -= 1
+        took = time.perf_counter() - t0
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * took
+        AUTH_HASH_LATENCY.observe(took, op, "ok")
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", hash_password, password)
+
+    async def verify(self, password: str, password_hash: Optional[str]) -> bool:
+        return await self._run("verify", verify_password, password, password_hash or DUMMY_HASH)
+
+
+pool = PasswordPool()
@@ -7,17 +7,40 @@ def webhook():
     return {"status": "ok", "message": "webhook test"}
 # payments.py — webhook de Mercado Pago
 
-from fastapi import APIRouter, Request
-from db import mark_paid
+import os
+from fastapi import APIRouter, HTTPException, Request
+import eventlog
+from db import mark_paid_many
+from metrics import WEBHOOK_EVENTS
+from webhooks import WebhookIngestor, extract_event
 
 router = APIRouter()
 
+async def _resolve(topic: str, appt_id: str, data: dict):
+    return (appt_id, "paid")
+
+def _apply(status: str, appt_ids: list) -> None:
+    mark_paid_many(appt_ids)
+    eventlog.record_transitions("paid", appt_ids, "webhook")
+
+# Dedup + cola: los reintentos de MP no vuelven a tocar el store
+ingestor = WebhookIngestor(
+    _resolve,
+    _apply,
+    seen_ttl=float(os.getenv("WEBHOOK_SEEN_TTL", "600")),
+)
+router.add_event_handler("startup", eventlog.start)
+router.add_event_handler("startup", ingestor.start)
+router.add_event_handler("shutdown", ingestor.stop)
+router.add_event_handler("shutdown", eventlog.stop)  # después de vaciar la cola
+
 @router.post("/webhook")
 async def webhook(req: Request):
     """
     Mercado Pago te enviará notificaciones acá.
     Modo simple: si llega cualquier notificación con appointment_id
     en el body (o en query), marcamos pagado.
+    La marca se aplica en lote desde una cola; los duplicados se descartan.
     """
     try:
         data = await req.json()
@@ -33,7 +56,21 @@ async def webhook(req: Request):
     )
 
     if appt_id:
-        mark_paid(appt_id)
+        topic, _, action = extract_event(data, dict(req.query_params))
+        try:
+            queued = ingestor.accept(topic, str(appt_id), action, data)
+        except RuntimeError as e:
+            # Cola llena: que MP reintente más tarde
+            WEBHOOK_EVENTS.inc("rejected")
+            raise HTTPException(status_code=503, detail=str(e))
+        WEBHOOK_EVENTS.inc("queued" if queued else "duplicate")
+        if queued:
+            # En disco antes de responder (fsync agrupado)
+            await eventlog.durable(eventlog.record(
+                "webhook", str(appt_id), topic=topic, action=action, body=data,
+            ))
+    else:
+        WEBHOOK_EVENTS.inc("ignored")
 
     # Siempre respondemos 200 para que MP no reintente infinito
     return {"ok": True, "appointment_id": appt_id}
@@ -0,0 +1,275 @@
+# reconcile.py — conciliación de pagos: consulta en MP los turnos que siguen sin pagar
+#
+# Uso:
+#   python reconcile.py                      # una pasada y sale
+#   python reconcile.py --concurrency 50 --min-age 30 --dry-run
+#
+# En main.py corre además como tarea de fondo cada RECONCILE_EVERY_S segundos.
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Table, and_, or_, text
+from sqlalchemy.engine import Engine
+
+import eventlog
+import mp_client
+
+RECONCILE_EVERY_S = float(os.getenv("RECONCILE_EVERY_S", "900"))       # 0 = sin tarea de fondo
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "20"))  # consultas a MP en vuelo
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "1000"))            # filas por página
+RECONCILE_MIN_AGE_MIN = float(os.getenv("RECONCILE_MIN_AGE_MIN", "15"))  # darle tiempo al webhook
+RECONCILE_RETRIES = int(os.getenv("RECONCILE_RETRIES", "4"))
+
+# Solo se corre una conciliación a la vez entre todos los workers (Postgres)
+_ADVISORY_LOCK_ID = 0x7265636F  # "reco"
+
+# Desde qué estados se puede pasar a cada estado
+_FROM = {
+    "paid": ("created", "pending"),
+    "pending": ("created",),
+}
+UNPAID = ("created", "pending")
+# Mismo texto que el predicado del índice parcial: así el planner puede usarlo
+UNPAID_WITH_PREF_SQL = "status IN ('created', 'pending') AND mp_preference_id IS NOT NULL"
+
+
+async def fetch_preference_status(preference_id: str) -> Optional[str]:
+    """Estado del turno según los pagos de la preferencia en MP (None = sin cambios)."""
+    result = await mp_client.get_mp_client().search_merchant_orders(preference_id)
+    if result["status"] >= 500 or result["status"] == 429:
+        raise mp_client.MPError(f"Mercado Pago respondió {result['status']}")
+    if result["status"] != 200:
+        return None
+    statuses = set()
+    for order in result["response"].get("elements") or []:
+        for payment in order.get("payments") or []:
+            status = mp_client.PAYMENT_STATUS.get(payment.get("status"))
+            if status:
+                statuses.add(status)
+    if "paid" in statuses:
+        return "paid"
+    return "pending" if statuses else None
+
+
+class Reconciler:
+    """
+    Recorre los turnos sin pagar que tienen preferencia (índice parcial sobre
+    (when_at, id)), pregunta su estado a MP con hasta `concurrency` consultas
+    en vuelo y reintentos con backoff, y aplica los cambios de cada página con
+    un UPDATE por estado.
+    """
+
+    def __init__(
+        self,
+        get_engine: Callable[[], Optional[Engine]],
+        table: Table,
+        *,
+        fetch=fetch_preference_status,
+        concurrency: int = RECONCILE_CONCURRENCY,
+        batch: int = RECONCILE_BATCH,
+        min_age_min: float = RECONCILE_MIN_AGE_MIN,
+        retries: int = RECONCILE_RETRIES,
+        dry_run: bool = False,
+        on_change: Optional[Callable[[str, List[str]], None]] = None,
+    ):
+        self.get_engine = get_engine
+        self.table = table
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.batch = batch
+        self.min_age = timedelta(minutes=min_age_min)
+        self.retries = retries
+        self.dry_run = dry_run
+        self.on_change = on_change  # (estado, ids) de lo que cambió, después del COMMIT
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, float]] = None
+
+    # ── una pasada ───────────────────────────────────────
+    def _page(self, after: Optional[Tuple[str, str]], created_before: datetime) -> List[Tuple[str, str, str]]:
+        c = self.table.c
+        stmt = (
+            self.table.select()
+            .with_only_columns(c.id, c.when_at, c.mp_preference_id)
+            .where(text(UNPAID_WITH_PREF_SQL))
+            .where(c.created_at < created_before)
+            .order_by(c.when_at, c.id)
+            .limit(self.batch)
+        )
+        if after is not None:
+            when_at, appt_id = after
+            stmt = stmt.where(
+                or_(c.when_at > when_at, and_(c.when_at == when_at, c.id > appt_id))
+            )
+        with self.get_engine().connect() as conn:
+            return [tuple(r) for r in conn.execute(stmt)]
+
+    def _apply(self, changes: Dict[str, List[str]]) -> int:
+        c = self.table.c
+        engine = self.get_engine()
+        returning = engine.dialect.update_returning
+        changed: Dict[str, List[str]] = {}
+        updated = 0
+        with engine.begin() as conn:
+            for status, ids in changes.items():
+                stmt = (
+                    self.table.update()
+                    .where(c.id.in_(ids))
+                    .where(c.status.in_(_FROM[status]))
+                    .values(status=status)
+                )
+                if returning:
+                    changed[status] = [r[0] for r in conn.execute(stmt.returning(c.id))]
+                    updated += len(changed[status])
+                else:
+                    updated += conn.execute(stmt).rowcount
+        for status, ids in changed.items():
+            eventlog.record_transitions(status, ids, "reconcile")
+            if self.on_change is not None:
+                self.on_change(status, ids)
+        return updated
+
+    async def _fetch_one(self, sem: asyncio.Semaphore, pref_id: str) -> Tuple[Optional[str], bool]:
+        """(estado, ok). Reintenta errores de red/5xx con backoff exponencial y jitter."""
+        for attempt in range(self.retries + 1):
+            async with sem:
+                try:
+                    return await self.fetch(pref_id), True
+                except mp_client.MPUnavailable as e:
+                    delay = e.retry_after
+                except mp_client.MPError:
+                    delay = min(30.0, 0.5 * 2 ** attempt)
+            if attempt < self.retries:
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        return None, False
+
+    async def run_once(self) -> Dict[str, float]:
+        """Una pasada completa. Devuelve contadores."""
+        t0 = time.perf_counter()
+        stats = {"checked": 0, "paid": 0, "pending": 0, "unchanged": 0, "errors": 0, "updated": 0}
+        if self.get_engine() is None:
+            return stats
+        lock = await run_in_threadpool(self._try_lock)
+        if lock is False:
+            print("Conciliación: otro worker ya está corriendo.")
+            return stats
+        try:
+            sem = asyncio.Semaphore(self.concurrency)
+            created_before = datetime.now(timezone.utc).replace(tzinfo=None) - self.min_age
+            after = None
+            while True:
+                rows = await run_in_threadpool(self._page, after, created_before)
+                if not rows:
+                    break
+                after = (rows[-1][1], rows[-1][0])
+                results = await asyncio.gather(*(self._fetch_one(sem, pref) for _, _, pref in rows))
+                changes: Dict[str, List[str]] = {}
+                for (appt_id, _, _), (status, ok) in zip(rows, results):
+                    stats["checked"] += 1
+                    if not ok:
+                        stats["errors"] += 1
+                    elif status is None:
+                        stats["unchanged"] += 1
+                    else:
+                        stats[status] += 1
+                        changes.setdefault(status, []).append(appt_id)
+                if changes and not self.dry_run:
+                    stats["updated"] += await run_in_threadpool(self._apply, changes)
+                if len(rows) < self.batch:
+                    break
+        finally:
+            if lock is not None:
+                await run_in_threadpool(self._unlock, lock)
+        stats["seconds"] = round(time.perf_counter() - t0, 2)
+        self.last_run = stats
+        print("Conciliación de pagos:", stats)
+        return stats
+
+    def _try_lock(self):
+        """Postgres: conexión con el advisory lock tomado, o False si lo tiene otro.
+        Otros motores: None (sin coordinación entre procesos)."""
+        engine = self.get_engine()
+        if engine.dialect.name != "postgresql":
+            return None
+        conn = engine.connect()
+        if conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _ADVISORY_LOCK_ID}).scalar():
+            return conn
+        conn.close()
+        return False
+
+    def _unlock(self, conn) -> None:
+        # El lock es de la sesión: cerrar la conexión solo la devuelve al pool
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _ADVISORY_LOCK_ID})
+        finally:
+            conn.close()
+
+    # ── tarea de fondo ───────────────────────────────────
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, every: float = RECONCILE_EVERY_S, wait_for: Optional[Callable] = None) -> None:
+        if self.running or every <= 0:
+            return
+        self._task = asyncio.create_task(self._loop(every, wait_for))
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _loop(self, every: float, wait_for: Optional[Callable]) -> None:
+        if wait_for is not None:
+            await wait_for()
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print("ERROR en la conciliación de pagos:", e)
+            await asyncio.sleep(every)
+
+
+def _cli() -> None:
+    parser = argparse.ArgumentParser(description="Concilia con Mercado Pago los turnos sin pagar.")
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    parser.add_argument("--batch", type=int, default=RECONCILE_BATCH)
+    parser.add_argument("--min-age", type=float, default=RECONCILE_MIN_AGE_MIN,
+                        help="minutos desde la creación del turno (default %(default)s)")
+    parser.add_argument("--dry-run", action="store_true", help="consulta MP pero no actualiza la DB")
+    args = parser.parse_args()
+
+    import main  # tabla y engine de la app
+
+    if main.appointments is None:
+        raise SystemExit("DATABASE_URL no está configurada.")
+    reconciler = Reconciler(
+        main.get_engine, main.appointments,
+        concurrency=args.concurrency, batch=args.batch,
+        min_age_min=args.min_age, dry_run=args.dry_run,
+    )
+
+    async def run():
+        if not args.dry_run:
+            await eventlog.start()
+        try:
+            await reconciler.run_once()
+        finally:
+            await mp_client.close_mp_client()
+            await eventlog.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    _cli()
@@ -0,0 +1,224 @@
+# scheduler.py — recordatorios y pasaje a no_show con un heap de vencimientos en memoria
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+# Minutos antes del inicio en que sale cada recordatorio
+SCHED_REMINDER_OFFSETS_MIN = tuple(
+    int(m) for m in os.getenv("SCHED_REMINDER_OFFSETS_MIN", "1440,60").split(",") if m.strip()
+)
+SCHED_NO_SHOW_GRACE_MIN = int(os.getenv("SCHED_NO_SHOW_GRACE_MIN", "15"))  # después del fin
+SCHED_HORIZON_H = float(os.getenv("SCHED_HORIZON_H", "24"))    # ventana cargada en memoria
+SCHED_LOOKBACK_H = float(os.getenv("SCHED_LOOKBACK_H", "24"))  # vencidos a recuperar al arrancar
+SCHED_TICK_S = float(os.getenv("SCHED_TICK_S", "1"))           # agrupa vencimientos cercanos
+
+
+class Timed(NamedTuple):
+    appt_id: str
+    doctor_id: Optional[str]
+    patient: Optional[str]
+    start: datetime
+    end: datetime
+
+
+# (desde, hasta) -> turnos activos con inicio en [desde, hasta)
+LoadFn = Callable[[datetime, datetime], Sequence[Timed]]
+ReminderFn = Callable[[int, List[Timed]], Awaitable[None]]
+OverdueFn = Callable[[List[Timed]], Awaitable[None]]
+
+
+class AppointmentScheduler:
+    """
+    Heap de (vence, seq, tipo, turno) con solo los turnos de la ventana
+    [ahora - lookback, ahora + horizon + recordatorio más largo): así un turno
+    entra al heap antes de que venza su primer recordatorio. A medida que
+    avanza el tiempo se carga el tramo siguiente desde la DB; no hay escaneo
+    periódico de la tabla.
+
+    Cada tick junta todo lo vencido: los recordatorios se entregan agrupados
+    por offset y los turnos terminados van juntos a `on_overdue`, que hace
+    un único UPDATE.
+
+    Cancelar o reprogramar es perezoso: se cambia la generación del turno y
+    las entradas viejas se descartan al salir del heap.
+    """
+
+    def __init__(
+        self,
+        load: LoadFn,
+        *,
+        on_reminder: Optional[ReminderFn] = None,
+        on_overdue: Optional[OverdueFn] = None,
+        reminder_offsets: Sequence[int] = SCHED_REMINDER_OFFSETS_MIN,
+        grace_min: int = SCHED_NO_SHOW_GRACE_MIN,
+        horizon_h: float = SCHED_HORIZON_H,
+        lookback_h: float = SCHED_LOOKBACK_H,
+        tick: float = SCHED_TICK_S,
+    ):
+        self._load = load
+        self.reminder_hooks: List[ReminderFn] = [on_reminder] if on_reminder else []
+        self._on_overdue = on_overdue
+        self.reminder_offsets = tuple(sorted(set(reminder_offsets), reverse=True))
+        self.grace = timedelta(minutes=grace_min)
+        self.horizon = timedelta(hours=horizon_h)
+        # Anticipación del primer recordatorio: se carga esto más allá del horizonte
+        self.lead = timedelta(minutes=max(self.reminder_offsets, default=0))
+        self.lookback = timedelta(hours=lookback_h)
+        self.tick = tick
+        self._heap: List[Tuple[float, int, int, int, int, str]] = []
+        self._seq = itertools.count()
+        self._items: Dict[str, Tuple[int, Timed]] = {}  # turno -> (generación, datos)
+        self._gen = itertools.count(1)
+        self._loaded_until: Optional[datetime] = None
+        self._loading_until: Optional[datetime] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ── API ──────────────────────────────────────────────
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        now = datetime.now(timezone.utc)
+        # Rehidratar: solo lo que puede vencer pronto (y lo que venció estando apagados)
+        await self._load_window(now - self.lookback, now + self.horizon + self.lead)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def schedule(self, appt: Timed) -> bool:
+        """Agenda (o reprograma) un turno. Fuera de la ventana cargada se ignora:
+        lo va a traer la carga del tramo correspondiente."""
+        limit = max(filter(None, (self._loaded_until, self._loading_until)), default=None)
+        if limit is None or appt.start >= limit:
+            return False
+        gen = next(self._gen)
+        self._items[appt.appt_id] = (gen, appt)
+        head = self._heap[0][0] if self._heap else float("inf")
+        now = time.time()
+        for offset in self.reminder_offsets:
+            due = (appt.start - timedelta(minutes=offset)).timestamp()
+            if due > now:  # recordatorios atrasados no se mandan
+                self._push(due, 0, offset, gen, appt.appt_id)
+        self._push((appt.end + self.grace).timestamp(), 1, 0, gen, appt.appt_id)
+        if self._wake is not None and self._heap[0][0] < head:
+            self._wake.set()  # vence antes de lo que el loop está esperando
+        return True
+
+    def add_reminder_hook(self, fn: ReminderFn) -> ReminderFn:
+        """Registra otro destino para los recordatorios (se puede usar como decorador)."""
+        self.reminder_hooks.append(fn)
+        return fn
+
+    def cancel(self, appt_id: str) -> None:
+        self._items.pop(appt_id, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    # ── interno ──────────────────────────────────────────
+    def _push(self, due: float, kind: int, offset: int, gen: int, appt_id: str) -> None:
+        # kind 0 = recordatorio, 1 = fin de turno; seq desempata sin comparar strings
+        heapq.heappush(self._heap, (due, next(self._seq), kind, offset, gen, appt_id))
+
+    async def _load_window(self, since: datetime, until: datetime) -> None:
+        self._loading_until = until
+        try:
+            rows = await run_in_threadpool(self._load, since, until)
+        except Exception as e:
+            print("ERROR al cargar turnos para el scheduler:", e)
+            self._loading_until = self._loaded_until
+            return
+        self._loaded_until = until
+        added = 0
+        for appt in rows:
+            if appt.appt_id not in self._items:  # ya agendado desde el request
+                added += self.schedule(appt)
+        print(f"Scheduler: {added} turnos agendados hasta {until.isoformat(timespec='minutes')}.")
+
+    async def _run(self) -> None:
+        while True:
+            # Dormir hasta el próximo vencimiento, pero no menos que un tick
+            # (así se agrupan) ni más de un minuto (para cargar el tramo siguiente)
+            timeout = 60.0
+            if self._heap:
+                timeout = min(self._heap[0][0] - time.time(), timeout)
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(timeout, self.tick))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._fire()
+                now = datetime.now(timezone.utc)
+                # Recargar con margen: lo que entra al heap todavía tiene por delante su primer recordatorio
+                if self._loaded_until is None or self._loaded_until - now < self.lead + self.horizon / 2:
+                    await self._load_window(self._loaded_until or now - self.lookback,
+                                            now + self.horizon + self.lead)
+            except Exception as e:
+                print("ERROR en el scheduler de turnos:", e)
+
+    async def _fire(self) -> None:
+        now = time.time()
+        reminders: Dict[int, List[Timed]] = {}
+        overdue: List[Timed] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, kind, offset, gen, appt_id = heapq.heappop(self._heap)
+            current = self._items.get(appt_id)
+            if current is None or current[0] != gen:
+                continue  # cancelado o reprogramado
+            if kind == 0:
+                reminders.setdefault(offset, []).append(current[1])
+            else:
+                overdue.append(self._items.pop(appt_id)[1])
+        for offset, appts in reminders.items():
+            for hook in self.reminder_hooks:
+                try:
+                    await hook(offset, appts)
+                except Exception as e:
+                    print(f"ERROR en recordatorio de {offset} min:", e)
+        if overdue and self._on_overdue is not None:
+            try:
+                await self._on_overdue(overdue)
+            except Exception as e:
+                print(f"ERROR al cerrar {len(overdue)} turnos vencidos (se reintenta):", e)
+                self._retry_overdue(overdue, now + self.OVERDUE_RETRY_S)
+
+    OVERDUE_RETRY_S = 60.0
+
+    def _retry_overdue(self, appts: List[Timed], due: float) -> None:
+        """Vuelve a poner en el heap los turnos que no se pudieron cerrar."""
+        for appt in appts:
+            if appt.appt_id in self._items:
+                continue  # reprogramado mientras tanto
+            gen = next(self._gen)
+            self._items[appt.appt_id] = (gen, appt)
+            self._push(due, 1, 0, gen, appt.appt_id)
+
+
+async def log_reminders(offset_min: int, appts: List[Timed]) -> None:
+    """Hook por defecto: deja constancia en el log (no hay envío de mails todavía)."""
+    for a in appts:
+        print(f"Recordatorio ({offset_min} min): turno {a.appt_id} de {a.patient} "
+              f"a las {a.start.isoformat(timespec='minutes')}.")
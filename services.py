@@ -1,14 +1,105 @@
-from fastapi import APIRouter
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+from fastapi import APIRouter, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+
+from db import read_router, read_session
+from models import Service
 
 router = APIRouter(
     prefix="/services",
     tags=["services"]
 )
 
+# Red de seguridad para cambios hechos desde otro proceso (p. ej. manage_seed)
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+# Si la tabla está vacía o no hay DB, mostramos el catálogo de siempre
+_DEFAULT_SERVICES = [
+    {"name": "Teleconsulta pediátrica", "price": 40000, "duration": 30, "currency": "ARS"},
+    {"name": "Consulta de control", "price": 30000, "duration": 30, "currency": "ARS"},
+    {"name": "Asesoramiento por síntomas", "price": 35000, "duration": 20, "currency": "ARS"},
+]
+
+# Catálogo ya serializado: (cuerpo JSON, ETag, vence)
+_catalog: tuple[bytes, str, float] | None = None
+_generation = 0
+_lock = Lock()
+
+
+def invalidate_catalog() -> None:
+    """Descarta el catálogo en caché; el próximo GET lo relee de la DB."""
+    global _catalog, _generation
+    with _lock:
+        _generation += 1
+        _catalog = None
+    # La próxima lectura va al primario: la réplica puede no tener el cambio
+    read_router.note_write("services")
+
+
+@event.listens_for(Service, "after_insert")
+@event.listens_for(Service, "after_update")
+@event.listens_for(Service, "after_delete")
+def _on_service_change(mapper, connection, target):
+    invalidate_catalog()
+
+
+def _load_catalog() -> tuple[bytes, str, float]:
+    global _catalog
+    with _lock:
+        if _catalog is not None and _catalog[2] > time.monotonic():
+            return _catalog
+        generation = _generation
+
+    ttl = CATALOG_TTL
+    try:
+        with read_session("services") as session:
+            rows = session.query(Service).order_by(Service.id).all()
+            items = [
+                {
+                    "id": s.id,
+                    "doctor_id": s.doctor_id,
+                    "name": s.title,
+                    "price": s.price,
+                    "duration": s.duration_min,
+                    "currency": s.currency,
+                }
+                for s in rows
+            ]
+    except Exception as e:
+        print("ERROR al leer servicios:", e)
+        items = []
+        ttl = min(ttl, 10)  # reintentar pronto
+
+    body = json.dumps(items or _DEFAULT_SERVICES, ensure_ascii=False, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    entry = (body, etag, time.monotonic() + ttl)
+    with _lock:
+        # Si alguien invalidó mientras leíamos, no guardamos datos viejos
+        if generation == _generation:
+            _catalog = entry
+    return entry
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags
+
+
 @router.get("/")
-def list_services():
-    return [
-        {"name": "Teleconsulta pediátrica", "price": 40000, "duration": 30, "currency": "ARS"},
-        {"name": "Consulta de control", "price": 30000, "duration": 30, "currency": "ARS"},
-        {"name": "Asesoramiento por síntomas", "price": 35000, "duration": 20, "currency": "ARS"},
-    ]
+async def list_services(request: Request):
+    entry = _catalog
+    if entry is None or entry[2] <= time.monotonic():
+        entry = await run_in_threadpool(_load_catalog)
+    body, etag, _ = entry
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
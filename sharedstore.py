@@ -0,0 +1,210 @@
+# sharedstore.py — store de turnos compartido entre procesos (SQLite en modo WAL)
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from appttime import parse_start
+from availability import to_utc
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS appts (
+    id       TEXT PRIMARY KEY,
+    data     TEXT NOT NULL,
+    email    TEXT,
+    start_ts REAL,
+    paid     INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_appts_email ON appts (email);
+CREATE INDEX IF NOT EXISTS ix_appts_start ON appts (start_ts);
+CREATE TABLE IF NOT EXISTS slots (
+    appt_id   TEXT PRIMARY KEY,
+    doctor_id TEXT NOT NULL,
+    start_ts  REAL NOT NULL,
+    end_ts    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_slots_doctor ON slots (doctor_id, start_ts);
+"""
+
+
+class SqliteApptStore:
+    """
+    Misma interfaz que db.ApptStore, pero los turnos viven en un archivo
+    SQLite en modo WAL: todos los workers de uvicorn ven el mismo estado.
+    Las lecturas no se bloquean entre sí ni con la escritura en curso;
+    las escrituras son transacciones cortas de una sentencia.
+    `paid` va en su propia columna para que marcar pagado no reescriba el JSON.
+    Una conexión por hilo y por proceso (sqlite3 no se comparte entre hilos).
+    """
+
+    def __init__(self, path: str, *, ttl: int, max_items: int, evict_every: int,
+                 busy_timeout_ms: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self.evict_every = evict_every
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._saves = 0
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                   isolation_level=None)  # autocommit; BEGIN explícito si hace falta
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL: durable salvo corte de luz
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _start_ts(appt: Dict[str, Any]) -> Optional[float]:
+        start = parse_start(appt)
+        return start.timestamp() if start is not None else None
+
+    @staticmethod
+    def _row_to_appt(data: str, paid: int) -> Dict[str, Any]:
+        appt = json.loads(data)
+        appt["paid"] = bool(paid)
+        return appt
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT count(*) FROM appts").fetchone()[0]
+
+    # ── primario ──────────────────────────────────────────
+    def save(self, appt: Dict[str, Any]) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO appts (id, data, email, start_ts, paid) VALUES (?, ?, ?, ?, ?)",
+            (appt["id"], json.dumps(appt, default=str), appt.get("patient_email"),
+             self._start_ts(appt), int(bool(appt.get("paid")))),
+        )
+        self._saves += 1
+        if self.evict_every and self._saves % self.evict_every == 0:
+            self.evict()
+
+    def get(self, appt_id: str) -> Dict[str, Any] | None:
+        row = self._conn().execute(
+            "SELECT data, paid FROM appts WHERE id = ?", (appt_id,)
+        ).fetchone()
+        return self._row_to_appt(*row) if row else None
+
+    def update(self, appt_id: str, **fields: Any) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # nadie escribe entre el SELECT y el UPDATE
+        try:
+            row = conn.execute("SELECT data, paid FROM appts WHERE id = ?", (appt_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return False
+            appt = self._row_to_appt(*row)
+            appt.update(fields)
+            conn.execute(
+                "UPDATE appts SET data = ?, email = ?, start_ts = ?, paid = ? WHERE id = ?",
+                (json.dumps(appt, default=str), appt.get("patient_email"),
+                 self._start_ts(appt), int(bool(appt.get("paid"))), appt_id),
+            )
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def mark_paid(self, appt_id: str) -> None:
+        self._conn().execute("UPDATE appts SET paid = 1 WHERE id = ?", (appt_id,))
+
+    def mark_paid_many(self, appt_ids: Iterable[str]) -> None:
+        ids = list(appt_ids)
+        conn = self._conn()
+        # Un solo COMMIT para todo el lote
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                conn.execute(
+                    f"UPDATE appts SET paid = 1 WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, appt_id: str) -> None:
+        self._conn().execute("DELETE FROM appts WHERE id = ?", (appt_id,))
+
+    # ── consultas ─────────────────────────────────────────
+    def by_patient(self, email: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT data, paid FROM appts WHERE email = ?", (email,))
+        return [self._row_to_appt(*r) for r in rows]
+
+    def between(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """Turnos con start_at en [start, end), ordenados por inicio."""
+        rows = self._conn().execute(
+            "SELECT data, paid FROM appts WHERE start_ts >= ? AND start_ts < ? ORDER BY start_ts, id",
+            (start.timestamp(), end.timestamp()),
+        )
+        return [self._row_to_appt(*r) for r in rows]
+
+    # ── descarte ──────────────────────────────────────────
+    def evict(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now(timezone.utc)
+        horizon = now - timedelta(seconds=self.ttl) - timedelta(minutes=180)
+        conn = self._conn()
+        n = conn.execute("DELETE FROM appts WHERE start_ts < ?", (horizon.timestamp(),)).rowcount
+        conn.execute("DELETE FROM slots WHERE end_ts < ?", (horizon.timestamp(),))
+        excess = len(self) - self.max_items
+        if excess > 0:
+            n += conn.execute(
+                "DELETE FROM appts WHERE id IN (SELECT id FROM appts ORDER BY start_ts LIMIT ?)",
+                (excess,),
+            ).rowcount
+        return n
+
+
+class SqliteSlots:
+    """
+    Horarios tomados por médico, en el mismo archivo que SqliteApptStore.
+    Misma interfaz que availability.AvailabilityEngine para reservar y
+    liberar, pero el control de solapamiento y el INSERT van en una sola
+    transacción (BEGIN IMMEDIATE): dos workers no pueden tomar el mismo
+    horario, y lo reservado sigue ahí después de un reinicio.
+    """
+
+    def __init__(self, store: SqliteApptStore):
+        self._store = store
+
+    def reserve(self, doctor_id: str, appt_id: str, start: datetime, end: datetime) -> bool:
+        start_ts, end_ts = to_utc(start).timestamp(), to_utc(end).timestamp()
+        conn = self._store._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken = conn.execute(
+                "SELECT 1 FROM slots WHERE doctor_id = ? AND start_ts < ? AND end_ts > ? LIMIT 1",
+                (doctor_id, end_ts, start_ts),
+            ).fetchone()
+            added = taken is None and conn.execute(
+                "INSERT OR IGNORE INTO slots (appt_id, doctor_id, start_ts, end_ts) VALUES (?, ?, ?, ?)",
+                (appt_id, doctor_id, start_ts, end_ts),
+            ).rowcount == 1
+            conn.execute("COMMIT" if added else "ROLLBACK")
+            return added
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, appt_id: str) -> bool:
+        return self._store._conn().execute(
+            "DELETE FROM slots WHERE appt_id = ?", (appt_id,)
+        ).rowcount == 1
+
+    def is_free(self, doctor_id: str, start: datetime, end: datetime) -> bool:
+        return self._store._conn().execute(
+            "SELECT 1 FROM slots WHERE doctor_id = ? AND start_ts < ? AND end_ts > ? LIMIT 1",
+            (doctor_id, to_utc(end).timestamp(), to_utc(start).timestamp()),
+        ).fetchone() is None
@@ -0,0 +1,23 @@
+# conftest.py — los módulos de la app están en la raíz del repo (sin paquete)
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py arma la tabla appointments solo si hay DATABASE_URL: una SQLite descartable
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "app.db"))
+
+import pytest
+
+
+@pytest.fixture
+def app_db():
+    """main.py con la tabla appointments vacía en la SQLite de los tests."""
+    import main
+
+    engine = main.get_engine()
+    main.metadata.drop_all(engine)
+    main.metadata.create_all(engine)
+    return main, engine
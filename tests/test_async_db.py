@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import dbrouting
+
+
+@pytest.fixture
+def async_main(app_db, monkeypatch):
+    """main.py con DB_ASYNC=1 sobre la SQLite de los tests (aiosqlite)."""
+    main, engine = app_db
+    monkeypatch.setattr(main, "DB_ASYNC", True)
+    monkeypatch.setattr(main, "async_engine", None)
+    monkeypatch.setattr(main, "_async_engine_failed", False)
+    return main, engine
+
+
+def _row(appt_id, status="created"):
+    return {"id": appt_id, "when_at": "2030-01-07T13:00:00.000Z", "status": status,
+            "price": 100, "currency": "ARS"}
+
+
+def _statuses(main, engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(main.appointments.select().with_only_columns(
+            main.appointments.c.id, main.appointments.c.status)).all())
+
+
+def test_url_async_por_dialecto():
+    assert dbrouting.async_url("sqlite:///./data.db") == "sqlite+aiosqlite:///./data.db"
+    assert dbrouting.async_url("postgres://h/db") == "postgresql+psycopg://h/db"
+    engine = dbrouting.make_async_engine("sqlite:///./data.db")
+    assert isinstance(engine.sync_engine.pool, AsyncAdaptedQueuePool)  # no NullPool
+    asyncio.run(engine.dispose())
+
+
+def test_db_write_elige_el_camino_segun_el_engine(app_db, monkeypatch):
+    main, _ = app_db
+    calls = []
+
+    def sync_fn(x):
+        calls.append(("sync", x))
+
+    async def async_fn(x):
+        calls.append(("async", x))
+
+    monkeypatch.setattr(main, "get_async_engine", lambda: None)
+    asyncio.run(main._db_write(sync_fn, async_fn, 1))
+    monkeypatch.setattr(main, "get_async_engine", lambda: object())
+    asyncio.run(main._db_write(sync_fn, async_fn, 2))
+    assert calls == [("sync", 1), ("async", 2)]
+
+
+def test_sin_db_async_no_hay_engine_async(app_db, monkeypatch):
+    main, _ = app_db
+    monkeypatch.setattr(main, "DB_ASYNC", False)
+    monkeypatch.setattr(main, "async_engine", None)
+    assert main.get_async_engine() is None
+
+
+def test_si_falla_el_engine_async_se_sigue_con_el_sync(async_main, monkeypatch):
+    main, _ = async_main
+
+    def no_driver(url):
+        raise ImportError("falta aiosqlite")
+
+    monkeypatch.setattr(main, "make_async_engine", no_driver)
+    assert main.get_async_engine() is None
+    monkeypatch.setattr(main, "make_async_engine", lambda url: pytest.fail("reintentó"))
+    assert main.get_async_engine() is None  # no reintenta en cada request
+
+
+def test_alta_y_webhook_por_el_camino_async(async_main):
+    main, engine = async_main
+
+    async def go():
+        try:
+            assert await main._insert_appointment_async(_row("a"))
+            assert not await main._insert_appointment_async(_row("a"))  # clave duplicada
+            with engine.begin() as conn:
+                conn.execute(main.appointments.insert(), [_row("x", "cancelled"), _row("p", "pending")])
+            await main._apply_webhook("paid", ["a", "x", "p"])
+        finally:
+            await main.get_async_engine().dispose()
+
+    asyncio.run(go())
+    assert _statuses(main, engine) == {"a": "paid", "x": "cancelled", "p": "paid"}
+
+
+def test_checkout_diferido_por_el_camino_async(async_main):
+    main, engine = async_main
+    with engine.begin() as conn:
+        conn.execute(main.appointments.insert(), [_row("ok", "pending_checkout"),
+                                                  _row("mal", "pending_checkout")])
+
+    async def go():
+        try:
+            await main._db_write(main._update_pending_checkout, main._update_pending_checkout_async,
+                                 "ok", {"status": "created", "mp_preference_id": "pref-1"})
+            await main._db_write(main._update_pending_checkout, main._update_pending_checkout_async,
+                                 "mal", {"status": "cancelled"})
+        finally:
+            await main.get_async_engine().dispose()
+
+    asyncio.run(go())
+    assert _statuses(main, engine) == {"ok": "created", "mal": "cancelled"}
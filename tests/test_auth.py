@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import auth
+import db
+from models import Base, Role, User
+from passwords import PoolBusy, hash_password
+
+
+@pytest.fixture(scope="module")
+def user():
+    Base.metadata.create_all(db.engine, tables=[User.__table__])
+    session = db.SessionLocal()
+    try:
+        session.query(User).filter(User.email == "medica@example.com").delete()
+        session.add(User(name="Médica", email="medica@example.com", role=Role.doctor,
+                         password_hash=hash_password("correcta")))
+        session.commit()
+    finally:
+        session.close()
+    yield "medica@example.com"
+    auth.password_pool.shutdown()
+
+
+def _login(email, password):
+    return asyncio.run(auth.password_login(email, password))
+
+
+def test_login_con_la_contrasena_correcta(user):
+    out = _login(user, "correcta")
+    assert "password_hash" not in out
+    claims = auth.decode_token(out["access_token"])
+    assert claims["email"] == user and claims["role"] == "doctor" and claims["sub"] == str(out["id"])
+
+
+@pytest.mark.parametrize("email, password", [
+    ("medica@example.com", "incorrecta"),
+    ("medica@example.com", ""),
+    ("nadie@example.com", "correcta"),
+])
+def test_credenciales_invalidas_dan_401(user, email, password):
+    with pytest.raises(HTTPException) as e:
+        _login(email, password)
+    assert e.value.status_code == 401
+
+
+def test_pool_lleno_da_429_con_retry_after(monkeypatch):
+    async def busy(email, password):
+        raise PoolBusy(retry_after=7)
+
+    monkeypatch.setattr(auth, "authenticate", busy)
+    with pytest.raises(HTTPException) as e:
+        _login("medica@example.com", "correcta")
+    assert e.value.status_code == 429 and e.value.headers["Retry-After"] == "7"
+
+
+def test_jwt_adulterado_o_vencido(monkeypatch):
+    token = auth.issue_token("1", email="a@x.com")
+    header, payload, sig = token.split(".")
+    with pytest.raises(auth.InvalidToken):
+        auth.decode_token(f"{header}.{payload}.{sig[:-3]}abc")
+    forged = jwt.encode({"sub": "1", "exp": int(time.time()) + 60}, "otro-secreto", algorithm="HS256")
+    with pytest.raises(auth.InvalidToken):
+        auth.decode_token(forged)
+
+    monkeypatch.setattr(auth, "JWT_TTL_MIN", -1)
+    with pytest.raises(auth.InvalidToken):
+        auth.decode_token(auth.issue_token("1"))
+
+
+def test_cache_de_tokens_respeta_el_vencimiento(monkeypatch):
+    token = auth.issue_token("2")
+    claims = auth.decode_token(token)
+    calls = []
+
+    def decode(*args, **kwargs):
+        calls.append(1)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    monkeypatch.setattr(auth.jwt, "decode", decode)
+    assert auth.decode_token(token) is claims and calls == []  # del cache, sin re-verificar
+    monkeypatch.setattr(auth.time, "time", lambda: claims["exp"] + 1)
+    with pytest.raises(auth.InvalidToken):
+        auth.decode_token(token)  # vencido: sale del cache y se vuelve a verificar
+    assert calls == [1] and token not in auth._decoded
+
+
+def _request(authorization=None):
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    return Request({"type": "http", "headers": headers})
+
+
+def test_panel_exige_jwt_o_token_configurado(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "PANEL_TOKEN", "")
+    monkeypatch.setattr(main, "PANEL_DEMO_LOGIN", True)
+    for header in (None, "Bearer ", "Bearer demo-token", "Bearer basura"):
+        with pytest.raises(HTTPException) as e:
+            main.require_panel(_request(header))
+        assert e.value.status_code == 401
+    main.require_panel(_request(f"Bearer {auth.issue_token('1')}"))
+
+    # Login de demostración sin PANEL_TOKEN: no entrega nada
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main.login(main.LoginIn(email="z@z.com", password="nope")))
+    assert e.value.status_code == 503
+
+    monkeypatch.setattr(main, "PANEL_TOKEN", "secreto-del-panel")
+    main.require_panel(_request("Bearer secreto-del-panel"))
+    monkeypatch.setattr(main, "PANEL_DEMO_LOGIN", False)
+    with pytest.raises(HTTPException):
+        main.require_panel(_request("Bearer secreto-del-panel"))
+
+
+def test_login_del_panel_valida_credenciales_por_defecto(user):
+    import main
+
+    assert not main.PANEL_DEMO_LOGIN
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main.login(main.LoginIn(email="z@z.com", password="nope")))
+    assert e.value.status_code == 401
+    out = asyncio.run(main.login(main.LoginIn(email=user, password="correcta")))
+    main.require_panel(_request(f"Bearer {out.access_token}"))
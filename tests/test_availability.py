@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+from availability import AvailabilityEngine, DoctorSchedule, iso_utc, parse_iso
+
+ART = timezone(timedelta(hours=-3))
+MONDAY = datetime(2030, 1, 7, 9, tzinfo=ART)  # 12:00 UTC
+
+
+def _engine():
+    return AvailabilityEngine(hours="09:00-12:00", weekdays="0,1,2,3,4", utc_offset=-3)
+
+
+def test_horarios_solapados_se_rechazan():
+    sched = DoctorSchedule()
+    assert sched.add("a", MONDAY, MONDAY + timedelta(minutes=30))
+    assert not sched.add("b", MONDAY + timedelta(minutes=15), MONDAY + timedelta(minutes=45))
+    assert not sched.add("a", MONDAY + timedelta(hours=2), MONDAY + timedelta(hours=3))
+    assert sched.add("c", MONDAY + timedelta(minutes=30), MONDAY + timedelta(minutes=60))
+    assert sched.remove("a") and not sched.remove("a")
+    assert sched.add("b", MONDAY + timedelta(minutes=15), MONDAY + timedelta(minutes=30))
+
+
+def test_turnos_libres_saltan_los_ocupados():
+    engine = _engine()
+    engine.durations["1"] = 30
+    assert engine.reserve("1", "a", MONDAY + timedelta(minutes=30), MONDAY + timedelta(minutes=75))
+    slots = engine.free_slots("1", MONDAY, MONDAY + timedelta(days=1))
+    starts = [s.astimezone(ART).strftime("%H:%M") for s, _ in slots]
+    assert starts == ["09:00", "10:30", "11:00", "11:30"]
+    # El fin de semana no hay horario de atención
+    assert engine.free_slots("1", MONDAY + timedelta(days=5), MONDAY + timedelta(days=7)) == []
+
+
+def test_liberar_devuelve_el_horario():
+    engine = _engine()
+    end = MONDAY + timedelta(minutes=30)
+    assert engine.reserve("1", "a", MONDAY, end)
+    assert not engine.is_free("1", MONDAY, end)
+    assert not engine.reserve("1", "b", MONDAY, end)
+    assert engine.release("a") and not engine.release("a")
+    assert engine.is_free("1", MONDAY, end)
+
+
+def test_carga_con_duracion_propia_o_del_servicio():
+    engine = _engine()
+    engine.durations["1"] = 20
+    n = engine.load([("1", "a", MONDAY, 60), ("1", "b", MONDAY + timedelta(minutes=60), None),
+                     ("1", "c", MONDAY + timedelta(minutes=30), 30)])
+    assert n == 2
+    assert not engine.is_free("1", MONDAY + timedelta(minutes=70), MONDAY + timedelta(minutes=75))
+    assert engine.is_free("1", MONDAY + timedelta(minutes=80), MONDAY + timedelta(minutes=100))
+
+
+def test_when_at_canonico_ordena_como_texto():
+    a = parse_iso("2030-01-07T10:00:00-03:00")
+    b = parse_iso("2030-01-07T12:30:00Z")
+    assert iso_utc(a) == "2030-01-07T13:00:00.000Z"
+    assert (iso_utc(b) < iso_utc(a)) == (b < a)
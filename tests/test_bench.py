@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+
+import httpx
+import pytest
+
+from bench import mp_stub, run
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(mp_stub, "LATENCY_MS", 0.0)
+    monkeypatch.setattr(mp_stub, "JITTER_MS", 0.0)
+    monkeypatch.setattr(mp_stub, "ERROR_RATE", 0.0)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=mp_stub.app), base_url="http://stub")
+
+
+def test_percentil_por_rango_mas_cercano():
+    ms = [float(i) for i in range(1, 101)]
+    assert run._percentile(ms, 50) == 50.0
+    assert run._percentile(ms, 95) == 95.0
+    assert run._percentile(ms, 99) == 99.0
+    assert run._percentile([7.0], 99) == 7.0
+    assert run._percentile([], 50) == 0.0
+
+
+def test_escenarios_sin_choques_de_horario_ni_ids_repetidos():
+    create = run._scenario("create", "r1", [])
+    starts = {create(i)[2]["json"]["start_at"] for i in range(100)}
+    assert len(starts) == 100
+    webhook = run._scenario("webhook", "r1", [])
+    assert webhook(3) == ("POST", "/payments/webhook", {
+        "json": {"type": "payment", "action": "payment.updated", "data": {"id": "r1-3"}},
+    })
+    join = run._scenario("join", "r1", ["a", "b"])
+    assert [join(i)[1] for i in range(3)] == [
+        "/appointments/a/join", "/appointments/b/join", "/appointments/a/join",
+    ]
+    with pytest.raises(ValueError):
+        run._scenario("otro", "r1", [])
+
+
+def test_stub_devuelve_metadata_del_turno(stub):
+    async def go():
+        async with stub as client:
+            r = await client.post("/checkout/preferences",
+                                  json={"metadata": {"appointment_id": "turno-1"}})
+            assert r.status_code == 201
+            pref_id = r.json()["id"]
+            assert r.json()["init_point"].endswith(pref_id)
+            pay = (await client.get(f"/v1/payments/{pref_id}")).json()
+            assert pay["status"] == "approved" and pay["metadata"]["appointment_id"] == "turno-1"
+            # Los benchmarks usan el appointment_id como payment_id
+            pay = (await client.get("/v1/payments/turno-2")).json()
+            assert pay["metadata"]["appointment_id"] == "turno-2"
+
+    asyncio.run(go())
+
+
+def test_stub_con_tasa_de_error(stub, monkeypatch):
+    monkeypatch.setattr(mp_stub, "ERROR_RATE", 1.0)
+
+    async def go():
+        async with stub as client:
+            return (await client.post("/checkout/preferences", json={})).status_code
+
+    assert asyncio.run(go()) == 500
+
+
+def test_drive_cuenta_requests_errores_y_percentiles(stub, monkeypatch):
+    monkeypatch.setattr(mp_stub, "ERROR_RATE", 0.5)
+
+    def make(i):
+        return ("POST", "/checkout/preferences", {"json": {}})
+
+    async def go():
+        async with stub as client:
+            return await run._drive(client, make, itertools.count(), 4, 0.2)
+
+    res = asyncio.run(go())
+    assert res["requests"] > 0 and 0 < res["errors"] < res["requests"]
+    assert res["rps"] > 0 and res["p50_ms"] <= res["p95_ms"] <= res["p99_ms"]
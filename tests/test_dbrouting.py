@@ -0,0 +1,117 @@
+import pytest
+from sqlalchemy.pool import SingletonThreadPool
+
+import dbrouting
+from dbrouting import ReadRouter, make_engine, normalize_url, pool_options
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dbrouting.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _router(primary, replica_url, **kw):
+    return ReadRouter(lambda: primary, replica_url, **kw)
+
+
+def test_normaliza_urls_de_postgres_a_psycopg():
+    assert normalize_url("postgres://u:p@h/db") == "postgresql+psycopg://u:p@h/db"
+    assert normalize_url("postgresql://h/db") == "postgresql+psycopg://h/db"
+    assert normalize_url("postgresql+psycopg://h/db") == "postgresql+psycopg://h/db"
+    assert normalize_url("sqlite:///./data.db") == "sqlite:///./data.db"
+
+
+def test_database_url_prioridad_de_variables(monkeypatch):
+    for var in ("DATABASE_URL", "POSTGRES_URL", "DATABASE_PUBLIC_URL"):
+        monkeypatch.delenv(var, raising=False)
+    assert dbrouting.database_url() is None
+    assert dbrouting.database_url("sqlite:///x.db") == "sqlite:///x.db"
+    monkeypatch.setenv("DATABASE_PUBLIC_URL", "postgres://publica/db")
+    assert dbrouting.database_url() == "postgresql+psycopg://publica/db"
+    monkeypatch.setenv("POSTGRES_URL", "postgres://interna/db")
+    assert dbrouting.database_url() == "postgresql+psycopg://interna/db"
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///app.db")
+    assert dbrouting.database_url("sqlite:///x.db") == "sqlite:///app.db"
+
+
+def test_opciones_de_pool(monkeypatch):
+    monkeypatch.setattr(dbrouting, "DB_POOL_SIZE", 7)
+    opts = pool_options("postgresql+psycopg://h/db")
+    assert opts["pool_size"] == 7 and "connect_args" not in opts
+    opts = pool_options("sqlite:///./data.db")
+    assert opts["pool_size"] == 7 and opts["connect_args"] == {"check_same_thread": False}
+    # En memoria, SQLAlchemy usa SingletonThreadPool: sin tamaño de pool
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        assert "pool_size" not in pool_options(url)
+        assert isinstance(make_engine(url).pool, SingletonThreadPool)
+
+
+def test_sin_replica_lee_del_primario(primary):
+    router = _router(primary, "")
+    assert router.engine_for_read() is primary
+    assert router.engine_for_read("cliente") is primary
+
+
+def test_lee_de_la_replica_salvo_que_el_cliente_acabe_de_escribir(primary, tmp_path, clock):
+    router = _router(primary, f"sqlite:///{tmp_path / 'replica.db'}", read_after_write=5)
+    replica = router.engine_for_read("cliente")
+    assert replica is router.replica and replica is not primary
+
+    router.note_write("cliente")
+    assert router.engine_for_read("cliente") is primary
+    assert router.engine_for_read("otro") is replica
+    assert router.engine_for_read() is replica
+    clock[0] += 5
+    assert router.engine_for_read("cliente") is replica
+    replica.dispose()
+
+
+def test_atraso_alto_o_replica_caida_van_al_primario(primary, tmp_path, clock, monkeypatch):
+    router = _router(primary, f"sqlite:///{tmp_path / 'replica.db'}", max_lag=10, lag_check_every=5)
+    router._lag_checked = clock[0]
+    router._lag = 30.0  # medido en el último chequeo
+    assert router.engine_for_read() is primary
+
+    router._lag = None  # no respondió
+    assert router.engine_for_read() is primary
+
+    clock[0] += 5  # toca medir de nuevo: SQLite responde, atraso 0
+    assert router.replica_lag() == 0.0
+    assert router.engine_for_read() is router.replica
+
+    def down():
+        raise OSError("sin conexión")
+
+    clock[0] += 5
+    monkeypatch.setattr(router.replica, "connect", down)
+    assert router.replica_lag() is None
+    assert router.engine_for_read() is primary
+
+
+def test_el_atraso_extiende_la_ventana_de_lectura_propia(primary, tmp_path, clock):
+    router = _router(primary, f"sqlite:///{tmp_path / 'replica.db'}", read_after_write=5, max_lag=10,
+                     lag_check_every=60)
+    router._lag_checked = clock[0]
+    router._lag = 3.0
+    router.note_write("cliente")
+    clock[0] += 7  # pasó read_after_write, pero no read_after_write + atraso
+    assert router.engine_for_read("cliente") is primary
+    clock[0] += 1
+    assert router.engine_for_read("cliente") is router.replica
+
+
+def test_escritores_recientes_acotados(primary):
+    router = _router(primary, "", max_writers=3)
+    for key in "abcd":
+        router.note_write(key)
+    router.note_write("b")
+    assert list(router._writes) == ["c", "d", "b"]
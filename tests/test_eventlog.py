@@ -0,0 +1,166 @@
+import json
+import os
+import time
+import zlib
+
+import eventlog
+from eventlog import EventLog, _HDR
+
+
+def _open(tmp_path, **kw) -> EventLog:
+    log = EventLog(str(tmp_path), **kw)
+    log.open()
+    return log
+
+
+def test_registro_es_largo_crc_y_json(tmp_path):
+    log = _open(tmp_path)
+    seq = log.append("appointment.created", "a1", status="created", price=100)
+    log.close()
+
+    path = os.path.join(tmp_path, "s0", f"{1:020d}.log")
+    raw = open(path, "rb").read()
+    length, crc = _HDR.unpack_from(raw, 0)
+    payload = raw[_HDR.size:_HDR.size + length]
+    assert len(raw) == _HDR.size + length
+    assert zlib.crc32(payload) == crc
+    event = json.loads(payload)
+    assert seq == 1
+    assert event["seq"] == 1 and event["type"] == "appointment.created"
+    assert event["appt"] == "a1" and event["status"] == "created" and event["price"] == 100
+
+
+def test_append_many_y_lectura_en_orden(tmp_path):
+    log = _open(tmp_path)
+    last = log.append_many([("a", "x", {}), ("b", "y", {"n": 1}), ("c", None, {})])
+    log.close()
+    events = list(eventlog.iter_events(str(tmp_path)))
+    assert last == 3
+    assert [e["seq"] for e in events] == [1, 2, 3]
+    assert [e["type"] for e in events] == ["a", "b", "c"]
+    assert [e["type"] for e in eventlog.history("y", str(tmp_path))] == ["b"]
+
+
+def test_cola_cortada_se_descarta_al_reabrir(tmp_path):
+    log = _open(tmp_path)
+    log.append("e", "a1")
+    log.append("e", "a2")
+    log.close()
+    path = eventlog._segments(os.path.join(tmp_path, "s0"))[-1]
+    good = os.path.getsize(path)
+    torn = eventlog._encode({"seq": 3, "ts": time.time(), "type": "e", "appt": "a3"})
+    with open(path, "ab") as f:
+        f.write(torn[:len(torn) // 2])  # el proceso murió a mitad del write
+
+    assert [e["appt"] for e in eventlog.iter_events(str(tmp_path))] == ["a1", "a2"]
+    log = _open(tmp_path)
+    assert os.path.getsize(path) == good
+    assert log.append("e", "a3") == 3
+    log.close()
+    assert [e["seq"] for e in eventlog.iter_events(str(tmp_path))] == [1, 2, 3]
+
+
+def test_crc_invalido_corta_la_lectura(tmp_path):
+    log = _open(tmp_path)
+    for appt in ("a1", "a2", "a3"):
+        log.append("e", appt)
+    log.close()
+    path = eventlog._segments(os.path.join(tmp_path, "s0"))[-1]
+    raw = bytearray(open(path, "rb").read())
+    length, _ = _HDR.unpack_from(raw, 0)
+    second = _HDR.size + length
+    raw[second + _HDR.size] ^= 0xFF  # un byte del JSON del segundo registro
+    open(path, "wb").write(bytes(raw))
+    assert [e["appt"] for e in eventlog.read_segment(path)] == ["a1"]
+
+
+def test_rotacion_de_segmentos(tmp_path):
+    log = _open(tmp_path, segment_bytes=200)
+    for i in range(20):
+        log.append("e", f"a{i}", pad="x" * 50)
+    log.sync()
+    log.close()
+    segments = eventlog._segments(os.path.join(tmp_path, "s0"))
+    assert len(segments) > 1
+    # El nombre de cada segmento es el seq de su primer registro
+    for path in segments:
+        first = next(eventlog.read_segment(path))
+        assert int(os.path.basename(path)[:-4]) == first["seq"]
+    assert [e["seq"] for e in eventlog.iter_events(str(tmp_path))] == list(range(1, 21))
+
+
+def test_un_stream_por_escritor(tmp_path):
+    a, b = _open(tmp_path), _open(tmp_path)
+    try:
+        assert a.stream_dir != b.stream_dir
+        a.append("e", "x")
+        b.append("e", "y")
+    finally:
+        a.close()
+        b.close()
+    assert sorted(e["appt"] for e in eventlog.iter_events(str(tmp_path))) == ["x", "y"]
+
+
+def test_compactacion_descarta_turnos_cerrados_viejos(tmp_path, monkeypatch):
+    old = time.time() - 400 * 86400
+    monkeypatch.setattr(eventlog.time, "time", lambda: old)
+    log = _open(tmp_path, segment_bytes=150)
+    log.append("appointment.created", "viejo", status="created")
+    log.append("appointment.status", "viejo", status="done")
+    log.append("appointment.created", "abierto", status="created")
+    log.append("webhook", None, body="x")
+    monkeypatch.undo()
+    log.append("appointment.created", "nuevo", status="created")
+    log.append("appointment.status", "nuevo", status="cancelled")
+    log.close()
+
+    stats = eventlog.compact(str(tmp_path), retention_days=365, segment_bytes=10_000)
+    assert stats["dropped"] == 3  # los dos de "viejo" y el webhook sin turno
+    assert eventlog.history("viejo", str(tmp_path)) == []
+    assert len(eventlog.history("abierto", str(tmp_path))) == 1
+    assert len(eventlog.history("nuevo", str(tmp_path))) == 2
+    seqs = [e["seq"] for e in eventlog.iter_events(str(tmp_path))]
+    assert seqs == sorted(seqs)
+
+    # Se sigue escribiendo donde había quedado
+    log = _open(tmp_path)
+    assert log.append("e", "otro") == 7
+    log.close()
+
+
+def test_compactacion_interrumpida_no_duplica(tmp_path):
+    log = _open(tmp_path, segment_bytes=100)
+    for i in range(6):
+        log.append("e", f"a{i}", pad="x" * 40)
+    log.close()
+    stream = os.path.join(tmp_path, "s0")
+    # Copia de un segmento viejo con otro nombre: lo que queda si se corta antes de borrar
+    first = eventlog._segments(stream)[0]
+    dup = eventlog._segment_name(stream, 0)
+    open(dup, "wb").write(open(first, "rb").read())
+    assert [e["seq"] for e in eventlog.read_stream(stream)] == list(range(1, 7))
+
+
+def test_durable_espera_el_fsync_salvo_en_modo_async(tmp_path, monkeypatch):
+    import asyncio
+
+    log = EventLog(str(tmp_path), fsync_every=0.2)
+    monkeypatch.setattr(eventlog, "log", log)
+
+    async def ack(mode):
+        monkeypatch.setattr(eventlog, "EVENTLOG_SYNC", mode)
+        seq = log.append("webhook", None, topic="payment")
+        t0 = time.perf_counter()
+        await eventlog.durable(seq)
+        return time.perf_counter() - t0, log._synced >= seq
+
+    async def go():
+        await log.start()
+        try:
+            return await ack("batch"), await ack("async")
+        finally:
+            await log.stop()
+
+    (waited, synced), (waited_async, synced_async) = asyncio.run(go())
+    assert synced and waited > 0.05
+    assert not synced_async and waited_async < 0.05
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import icalfeed
+from icalfeed import CalendarFeeds, CalEvent, Feed
+
+START = datetime(2030, 1, 7, 13, tzinfo=timezone.utc)
+
+
+def _ev(appt_id, status="created", doctor="1", minutes=30):
+    return CalEvent(appt_id, doctor, "p@x.com", START, START + timedelta(minutes=minutes), status)
+
+
+def test_render_determinista_y_lineas_plegadas():
+    ev = _ev("a1")._replace(patient="x" * 200)
+    body = icalfeed.render_event(ev)
+    assert body == icalfeed.render_event(ev)
+    assert b"DTSTART:20300107T130000Z" in body
+    for line in body.split(b"\r\n"):
+        assert len(line) <= 75
+
+
+def test_etag_no_depende_del_orden():
+    a, b = Feed("1"), Feed("1")
+    for ev in (_ev("x"), _ev("y")):
+        a.put(ev)
+    for ev in (_ev("y"), _ev("x")):
+        b.put(ev)
+    assert a.etag == b.etag
+    etag = a.etag
+    assert not a.put(_ev("x"))           # mismos bytes: no cambia nada
+    assert a.put(_ev("x", "paid"))
+    assert a.etag != etag
+    assert a.put(_ev("x"))
+    assert a.etag == etag                # XOR: volver al mismo contenido da el mismo ETag
+
+
+def test_parches_sobre_feed_cargado():
+    async def scenario():
+        feeds = CalendarFeeds(lambda doctor_id: [_ev("a1")])
+        feed = await feeds.get("1")
+        etag = feed.etag
+        feeds.upsert(_ev("a2"))
+        feeds.upsert(_ev("b1", doctor="2"))  # médico sin feed cargado: se ignora
+        feeds.set_status(["a1"], "cancelled")
+        return feeds, feed, etag
+
+    feeds, feed, etag = asyncio.run(scenario())
+    assert sorted(feed.events) == ["a1", "a2"]
+    assert feed.events["a1"][0].status == "cancelled"
+    assert feed.etag != etag
+    body = b"".join(feeds.stream(feed))
+    assert body.startswith(b"BEGIN:VCALENDAR") and body.endswith(b"END:VCALENDAR\r\n")
+    assert body.count(b"BEGIN:VEVENT") == 2
+
+
+def test_parches_durante_el_armado_no_se_pierden():
+    loading, release = threading.Event(), threading.Event()
+
+    def load(doctor_id):
+        loading.set()
+        release.wait(5)  # el SELECT ya leyó: no ve lo que llega ahora
+        return [_ev("a1")]
+
+    async def scenario():
+        feeds = CalendarFeeds(load)
+        task = asyncio.create_task(feeds.get("1"))
+        while not loading.is_set():
+            await asyncio.sleep(0.005)
+        feeds.upsert(_ev("a2"))
+        feeds.set_status(["a1"], "paid")
+        release.set()
+        return await task
+
+    feed = asyncio.run(scenario())
+    assert sorted(feed.events) == ["a1", "a2"]
+    assert feed.events["a1"][0].status == "paid"
+
+
+def test_token_de_calendario():
+    token = icalfeed.calendar_token("1")
+    assert icalfeed.check_token("1", token)
+    assert not icalfeed.check_token("2", token)
+    assert not icalfeed.check_token("1", "")
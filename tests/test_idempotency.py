@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyCache, IdempotencyConflict
+
+
+def test_misma_clave_mismo_resultado():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    async def scenario():
+        cache = IdempotencyCache()
+        first = await cache.run("k", {"a": 1}, compute)
+        again = await cache.run("k", {"a": 1}, compute)
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first == again == {"id": 1}
+    assert calls == [1]
+
+
+def test_otro_cuerpo_es_conflicto():
+    async def scenario():
+        cache = IdempotencyCache()
+        await cache.run("k", {"a": 1}, lambda: asyncio.sleep(0, "ok"))
+        with pytest.raises(IdempotencyConflict):
+            await cache.run("k", {"a": 2}, lambda: asyncio.sleep(0, "ok"))
+
+    asyncio.run(scenario())
+
+
+def test_single_flight():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def scenario():
+        cache = IdempotencyCache()
+        return await asyncio.gather(*(cache.run("k", {}, compute) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["ok"] * 5
+    assert calls == [1]
+
+
+def test_errores_no_se_guardan():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("MP caído")
+        return "ok"
+
+    async def scenario():
+        cache = IdempotencyCache()
+        with pytest.raises(RuntimeError):
+            await cache.run("k", {}, compute)
+        return await cache.run("k", {}, compute)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert len(calls) == 2
+
+
+def test_lru_acotado():
+    async def scenario():
+        cache = IdempotencyCache(max_size=2)
+        for k in "abc":
+            await cache.run(k, {}, lambda: asyncio.sleep(0, k))
+        return list(cache._done)
+
+    assert asyncio.run(scenario()) == ["b", "c"]
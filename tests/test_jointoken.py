@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import jointoken
+import video
+from db import get_appt, save_appt
+from jointoken import InvalidJoinToken
+
+START = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+T0 = START.timestamp()
+
+
+def _reason(token, appt_id="a", now=T0):
+    with pytest.raises(InvalidJoinToken) as e:
+        jointoken.verify(token, appt_id, now=now)
+    return str(e.value)
+
+
+def test_token_valido_en_la_ventana_del_turno():
+    token = jointoken.issue("a", START, 30)
+    claims = jointoken.verify(token, "a", now=T0)
+    assert claims.appt_id == "a" and claims.paid
+    early, grace = jointoken.JOIN_EARLY_MIN * 60, jointoken.JOIN_GRACE_MIN * 60
+    assert jointoken.verify(token, now=T0 - early).expires == jointoken.expires_at(START, 30)
+    assert jointoken.verify(token, now=T0 + 30 * 60 + grace)
+    assert _reason(token, now=T0 - early - 1) == "todavía no empezó la ventana del turno"
+    assert _reason(token, now=T0 + 30 * 60 + grace + 1) == "token vencido"
+
+
+def test_firma_y_contenido():
+    token = jointoken.issue("a", START, 30)
+    body, sig = token.split(".")
+    assert _reason(token, appt_id="b") == "el token es de otro turno"
+    assert _reason(f"{body}.{sig[:-2]}xx") == "firma inválida"
+    # Cambiar el turno o la vigencia invalida la firma
+    forged = jointoken._b64(jointoken._unb64(body).replace(b"|1", b"|9"))
+    assert _reason(f"{forged}.{sig}") == "firma inválida"
+    assert _reason("sin-punto") == "formato inválido"
+    assert _reason(jointoken.issue("a", START, 30, paid=False)) == "pago pendiente"
+
+
+def test_revocado_hasta_que_venceria():
+    token = jointoken.issue("r", START, 30)
+    jointoken.revoke("r", until=jointoken.expires_at(START, 30))
+    assert _reason(token, appt_id="r") == "token revocado"
+    assert not jointoken.is_revoked("r", now=jointoken.expires_at(START, 30) + 1)
+
+
+def test_checkout_fallido_revoca_los_tokens():
+    start = datetime.now(timezone.utc) + timedelta(minutes=5)
+    save_appt({"id": "fallido", "patient_email": "p@x.com", "start_at": start.isoformat(),
+               "duration": 30, "doctor_id": "1", "paid": True, "checkout_pending": True})
+    token = jointoken.issue("fallido", start, 30)
+    assert jointoken.verify(token, "fallido")
+    asyncio.run(video._on_checkout_failed("fallido"))
+    assert get_appt("fallido")["cancelled"]
+    with pytest.raises(InvalidJoinToken, match="revocado"):
+        jointoken.verify(token, "fallido")
+    with pytest.raises(video.HTTPException) as e:
+        video.join("fallido")
+    assert e.value.status_code == 403
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import Column, DateTime, MetaData, String, Table, create_engine
+
+import listing
+from availability import iso_utc
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    meta = MetaData()
+    table = Table(
+        "appointments", meta,
+        Column("id", String, primary_key=True),
+        Column("doctor_id", String),
+        Column("status", String),
+        Column("when_at", String),
+        Column("when_ts", DateTime(timezone=True)),
+    )
+    meta.create_all(engine)
+    base = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+    rows = []
+    for i in range(25):
+        when = base + timedelta(hours=i // 3)  # de a tres con la misma hora: desempata el id
+        rows.append({"id": f"a{i:02d}", "doctor_id": "1" if i % 2 else "2",
+                     "status": "paid" if i % 5 == 0 else "created",
+                     "when_at": iso_utc(when), "when_ts": when})
+    with engine.begin() as conn:
+        conn.execute(table.insert(), rows)
+    return engine, table, rows
+
+
+def _all_pages(engine, table, limit, **kw):
+    items, cursor, pages = [], None, 0
+    while True:
+        page, cursor = listing.fetch_page(engine, table, limit=limit, cursor=cursor, **kw)
+        items.extend(page)
+        pages += 1
+        if cursor is None:
+            return items, pages
+
+
+def test_cursor_ida_y_vuelta():
+    cursor = listing.encode_cursor("2030-01-07T12:00:00.000Z", "a01")
+    assert "=" not in cursor
+    assert listing.decode_cursor(cursor) == ("2030-01-07T12:00:00.000Z", "a01")
+    dt = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+    assert listing.decode_cursor(listing.encode_cursor(dt, "x")) == (dt.isoformat(), "x")
+
+
+@pytest.mark.parametrize("bad", ["", "no-es-base64!", "bm9wZQ", listing.encode_cursor("x", "y")[:-2]])
+def test_cursor_invalido(bad):
+    with pytest.raises(ValueError):
+        listing.decode_cursor(bad)
+
+
+@pytest.mark.parametrize("when_col", ["when_at", "when_ts"])
+@pytest.mark.parametrize("limit", [1, 4, 7, 25, 100])
+def test_paginas_sin_huecos_ni_repetidos(db, when_col, limit):
+    engine, table, rows = db
+    items, pages = _all_pages(engine, table, limit, when_col=when_col)
+    assert [i["id"] for i in items] == [r["id"] for r in rows]
+    assert pages == max(1, -(-len(rows) // limit))
+
+
+def test_paginas_con_filtros(db):
+    engine, table, rows = db
+    date_from = datetime(2030, 1, 7, 14, tzinfo=timezone.utc)
+    date_to = datetime(2030, 1, 7, 18, tzinfo=timezone.utc)
+    items, _ = _all_pages(
+        engine, table, 2, status="created", doctor_id="1",
+        date_from=iso_utc(date_from), date_to=iso_utc(date_to),
+    )
+    expected = [r["id"] for r in rows
+                if r["status"] == "created" and r["doctor_id"] == "1"
+                and date_from <= r["when_ts"] < date_to]
+    assert expected and [i["id"] for i in items] == expected
+
+
+def test_columnas_limitadas(db):
+    engine, table, _ = db
+    cols = [c for c in table.columns if c.name != "when_ts"]
+    items, cursor = listing.fetch_page(engine, table, limit=3, columns=cols)
+    assert set(items[0]) == {"id", "doctor_id", "status", "when_at"}
+    items, _ = listing.fetch_page(engine, table, limit=3, cursor=cursor, columns=cols)
+    assert items[0]["id"] == "a03"
+
+
+def test_cursor_de_texto_con_when_ts_invalido(db):
+    engine, table, _ = db
+    with pytest.raises(ValueError):
+        listing.fetch_page(engine, table, limit=3, when_col="when_ts",
+                           cursor=listing.encode_cursor("ayer", "a01"))
@@ -0,0 +1,79 @@
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+
+
+def test_counter_suma_los_shards_de_todos_los_hilos():
+    c = metrics.Counter("x_total", "ayuda", ("op",))
+
+    def work():
+        for _ in range(1000):
+            c.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    c.inc("b", amount=2.5)
+    assert c.collect() == [
+        "# HELP x_total ayuda",
+        "# TYPE x_total counter",
+        'x_total{op="a"} 4000',
+        'x_total{op="b"} 2.5',
+    ]
+
+
+def test_histograma_acumula_buckets_suma_y_cuenta():
+    h = metrics.Histogram("lat_seconds", "ayuda", ("route",), buckets=(0.5, 0.125, 1.0))
+    for v in (0.0625, 0.125, 0.25, 2.0):
+        h.observe(v, "/x")
+    t = threading.Thread(target=h.observe, args=(0.75, "/x"))
+    t.start()
+    t.join()
+    assert h.collect()[2:] == [
+        'lat_seconds_bucket{route="/x",le="0.125"} 2',
+        'lat_seconds_bucket{route="/x",le="0.5"} 3',
+        'lat_seconds_bucket{route="/x",le="1"} 4',
+        'lat_seconds_bucket{route="/x",le="+Inf"} 5',
+        'lat_seconds_sum{route="/x"} 3.1875',
+        'lat_seconds_count{route="/x"} 5',
+    ]
+
+
+def test_escapa_valores_de_etiquetas():
+    c = metrics.Counter("e_total", "ayuda", ("v",))
+    c.inc('a"b\\c\nd')
+    assert c.collect()[-1] == 'e_total{v="a\\"b\\\\c\\nd"} 1'
+
+
+def test_gauge_que_falla_no_rompe_la_exportacion():
+    def boom():
+        raise RuntimeError("sin pool")
+
+    ok = metrics.Gauge("pool_size", "ayuda", lambda: [({"db": "primary"}, 5)])
+    assert ok.collect()[-1] == 'pool_size{db="primary"} 5'
+    assert metrics.Gauge("roto", "ayuda", boom).collect() == ["# HELP roto ayuda", "# TYPE roto gauge"]
+
+
+def test_middleware_mide_por_plantilla_de_ruta():
+    app = FastAPI()
+
+    @app.get("/turnos/{appt_id}")
+    def turno(appt_id: str):
+        return {"id": appt_id}
+
+    app.add_middleware(metrics.MetricsMiddleware)
+    client = TestClient(app)
+    for i in range(3):
+        assert client.get(f"/turnos/{i}").status_code == 200
+    client.get("/no-existe")
+
+    lines = metrics.HTTP_LATENCY.collect()
+    assert 'http_request_duration_seconds_count{method="GET",route="/turnos/{appt_id}",status="200"} 3' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="<unmatched>",status="404"} 1' in lines
+    assert not any('route="/turnos/1"' in l for l in lines)
+    assert "# TYPE http_request_duration_seconds histogram" in metrics.render()
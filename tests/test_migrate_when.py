@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import Column, DateTime, MetaData, String, Table, create_engine, select, text
+
+import migrate_when
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    meta = MetaData()
+    table = Table(
+        "appointments", meta,
+        Column("id", String, primary_key=True),
+        Column("when_at", String, nullable=False),
+        Column("when_ts", DateTime(timezone=True)),
+    )
+    with engine.begin() as conn:
+        # Tabla vieja: sin when_ts
+        conn.execute(text("CREATE TABLE appointments (id VARCHAR PRIMARY KEY, when_at VARCHAR NOT NULL)"))
+        conn.execute(text(
+            "INSERT INTO appointments (id, when_at) VALUES "
+            "('a', '2030-01-02T10:00:00-03:00'), ('b', '2030-01-02T13:00:00Z'), "
+            "('c', '2030-01-02T12:30:00'), ('d', 'mañana'), ('e', '2030-01-02T13:00:00.000Z')"
+        ))
+    return engine, table
+
+
+def test_ensure_column_es_idempotente(db):
+    engine, table = db
+    assert not migrate_when.has_column(engine, table, "when_ts")
+    assert migrate_when.ensure_column(engine, table)
+    assert migrate_when.ensure_column(engine, table)
+    assert migrate_when.has_column(engine, table, "when_ts")
+
+
+def test_backfill_normaliza_when_at(db):
+    engine, table = db
+    migrate_when.ensure_column(engine, table)
+    stats = migrate_when.backfill(engine, table, batch=2, pause_ms=0)
+    assert stats["invalid"] == 1
+    assert migrate_when.pending_count(engine, table) == 1  # solo la ilegible
+    with engine.connect() as conn:
+        rows = dict(conn.execute(select(table.c.id, table.c.when_at)).all())
+    assert rows["a"] == rows["b"] == rows["e"] == "2030-01-02T13:00:00.000Z"
+    assert rows["c"] == "2030-01-02T12:30:00.000Z"  # sin huso: UTC
+    assert rows["d"] == "mañana"
+    with engine.connect() as conn:
+        ts = conn.execute(select(table.c.when_ts).where(table.c.id == "a")).scalar()
+    assert ts.replace(tzinfo=timezone.utc) == datetime(2030, 1, 2, 13, tzinfo=timezone.utc)
+
+    # Segunda corrida: nada para escribir
+    again = migrate_when.backfill(engine, table, batch=2, pause_ms=0)
+    assert again["updated"] == 0
+
+
+def test_backfill_no_pisa_cambios_concurrentes(db, monkeypatch):
+    engine, table = db
+    migrate_when.ensure_column(engine, table)
+    real = migrate_when._to_ts
+
+    def to_ts(when_at):
+        # Mientras se calcula el lote, otro proceso reprograma el turno "a"
+        if when_at == "2030-01-02T10:00:00-03:00":
+            with engine.begin() as conn:
+                conn.execute(table.update().where(table.c.id == "a")
+                             .values(when_at="2030-02-01T10:00:00.000Z"))
+        return real(when_at)
+
+    monkeypatch.setattr(migrate_when, "_to_ts", to_ts)
+    migrate_when.backfill(engine, table, batch=10, pause_ms=0)
+    with engine.connect() as conn:
+        when_at = conn.execute(select(table.c.when_at).where(table.c.id == "a")).scalar()
+    assert when_at == "2030-02-01T10:00:00.000Z"
@@ -0,0 +1,174 @@
+import asyncio
+
+import httpx
+import pytest
+
+import mp_client
+from checkout import DeferredCheckout
+from mp_client import CircuitBreaker, MPClient, MPError, MPRejected, MPUnavailable
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mp_client.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_abre_tras_fallas_seguidas(clock):
+    b = CircuitBreaker(failures=3, reset_timeout=30, probes=1)
+    for _ in range(2):
+        b.before_call()
+        b.on_failure()
+    b.before_call()
+    b.on_success()  # un éxito reinicia la cuenta
+    for _ in range(2):
+        b.before_call()
+        b.on_failure()
+    assert b.state == "closed"
+    b.before_call()
+    b.on_failure()
+    assert b.state == "open"
+    with pytest.raises(MPUnavailable) as e:
+        b.before_call()
+    assert e.value.retry_after == pytest.approx(30)
+
+
+def test_breaker_semiabierto(clock):
+    b = CircuitBreaker(failures=1, reset_timeout=30, probes=1)
+    b.before_call()
+    b.on_failure()
+    clock[0] += 31
+    b.before_call()                 # la prueba pasa
+    assert b.state == "half_open"
+    with pytest.raises(MPUnavailable):
+        b.before_call()             # una sola prueba a la vez
+    b.on_failure()                  # la prueba falla: vuelve a abrir
+    assert b.state == "open"
+    clock[0] += 31
+    b.before_call()
+    b.on_success()
+    assert b.state == "closed"
+    b.before_call()
+
+
+def test_breaker_prueba_cancelada_libera_el_lugar(clock):
+    b = CircuitBreaker(failures=1, reset_timeout=30, probes=1)
+    b.before_call()
+    b.on_failure()
+    clock[0] += 31
+    b.before_call()
+    b.on_cancel()
+    b.before_call()  # no quedó tomada
+
+
+def _client(handler, **kw) -> MPClient:
+    c = MPClient("token", circuit=CircuitBreaker(failures=2, reset_timeout=30), **kw)
+    c._http = httpx.AsyncClient(base_url="http://mp", transport=httpx.MockTransport(handler))
+    return c
+
+
+def test_5xx_y_red_cuentan_como_falla_4xx_no():
+    codes = iter([400, 404, 500, 502])
+
+    def handler(request):
+        return httpx.Response(next(codes), json={})
+
+    async def scenario():
+        c = _client(handler)
+        assert (await c.request("GET", "/x"))["status"] == 400
+        assert (await c.request("GET", "/x"))["status"] == 404
+        assert c.breaker.state == "closed"
+        await c.request("GET", "/x")
+        await c.request("GET", "/x")
+        assert c.breaker.state == "open"
+        with pytest.raises(MPUnavailable):
+            await c.request("GET", "/x")
+        await c.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_error_de_red_es_mperror():
+    def handler(request):
+        raise httpx.ConnectError("sin red")
+
+    async def scenario():
+        c = _client(handler)
+        with pytest.raises(MPError):
+            await c.request("GET", "/x")
+        assert c.breaker._failed == 1
+        await c.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_bulkhead_lleno_rechaza_y_background_espera():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(request):
+            await gate.wait()
+            return httpx.Response(200, json={})
+
+        c = _client(handler, max_concurrency=2, bg_concurrency=1, acquire_timeout=0.01)
+        first = asyncio.create_task(c.request("GET", "/a"))
+        second = asyncio.create_task(c.request("GET", "/b"))
+        await asyncio.sleep(0.02)
+        assert c.in_flight == 2
+        with pytest.raises(MPUnavailable):
+            await c.request("GET", "/c")          # reserva: rechazo inmediato
+        bg = asyncio.create_task(c.request("GET", "/d", background=True))
+        await asyncio.sleep(0.02)
+        assert not bg.done()                      # en segundo plano espera su turno
+        gate.set()
+        await asyncio.gather(first, second, bg)
+        assert c.in_flight == 0
+        await c.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_background_no_ocupa_todo_el_cupo():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(request):
+            await gate.wait()
+            return httpx.Response(200, json={})
+
+        c = _client(handler, max_concurrency=3, bg_concurrency=5, acquire_timeout=0.01)
+        bg = [asyncio.create_task(c.request("GET", "/p", background=True)) for _ in range(4)]
+        await asyncio.sleep(0.02)
+        assert c.in_flight == 2                   # a lo sumo max_concurrency - 1
+        fg = asyncio.create_task(c.request("GET", "/reserva"))
+        await asyncio.sleep(0.02)
+        assert c.in_flight == 3
+        gate.set()
+        await asyncio.gather(fg, *bg)
+        await c.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_checkout_diferido_no_reintenta_4xx():
+    calls, failed = [], []
+
+    async def create(appt_id, pref):
+        calls.append(appt_id)
+        raise MPRejected("400")
+
+    async def on_failed(appt_id):
+        failed.append(appt_id)
+
+    async def scenario():
+        d = DeferredCheckout(create, on_failed=on_failed, mode="always", retry_every=0.01)
+        await d.start()
+        d.defer("a1", {"items": []})
+        await asyncio.sleep(0.1)
+        await d.stop()
+        return d.status("a1")
+
+    status = asyncio.run(scenario())
+    assert calls == ["a1"] and failed == ["a1"]
+    assert status["state"] == "failed"
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import Column, DateTime, MetaData, String, Table, create_engine, select
+
+import mp_client
+import reconcile
+from reconcile import Reconciler
+
+OLD = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=2)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")  # un archivo: la pasada usa el threadpool
+    table = Table(
+        "appointments", MetaData(),
+        Column("id", String, primary_key=True),
+        Column("when_at", String, nullable=False),
+        Column("status", String, nullable=False),
+        Column("mp_preference_id", String),
+        Column("created_at", DateTime),
+    )
+    table.metadata.create_all(engine)
+    rows = [
+        ("c_paid", "created", "pref-paid"),
+        ("p_paid", "pending", "pref-paid"),
+        ("c_pend", "created", "pref-pending"),
+        ("p_pend", "pending", "pref-pending"),  # ya está pending: sin cambios
+        ("c_none", "created", "pref-none"),
+        ("x_paid", "cancelled", "pref-paid"),   # no es "sin pagar": ni se consulta
+        ("sin_pref", "created", None),
+        ("error", "created", "pref-error"),
+    ]
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [
+            {"id": i, "when_at": f"2030-01-07T1{n}:00:00.000Z", "status": s, "mp_preference_id": p,
+             "created_at": OLD}
+            for n, (i, s, p) in enumerate(rows)
+        ])
+        # Recién creado: el webhook todavía puede llegar
+        conn.execute(table.insert(), {"id": "nuevo", "when_at": "2030-01-07T09:00:00.000Z",
+                                      "status": "created", "mp_preference_id": "pref-paid",
+                                      "created_at": datetime.now(timezone.utc).replace(tzinfo=None)})
+    return engine, table
+
+
+_RESULT = {"pref-paid": "paid", "pref-pending": "pending", "pref-none": None}
+
+
+async def _fetch(pref_id):
+    if pref_id == "pref-error":
+        raise mp_client.MPError("MP caído")
+    return _RESULT[pref_id]
+
+
+def _statuses(engine, table):
+    with engine.connect() as conn:
+        return dict(conn.execute(select(table.c.id, table.c.status)).all())
+
+
+def test_transiciones_de_la_conciliacion(db):
+    engine, table = db
+    changes = []
+    rec = Reconciler(lambda: engine, table, fetch=_fetch, batch=2, retries=0,
+                     on_change=lambda status, ids: changes.append((status, sorted(ids))))
+    stats = asyncio.run(rec.run_once())
+    assert _statuses(engine, table) == {
+        "c_paid": "paid", "p_paid": "paid", "c_pend": "pending", "p_pend": "pending",
+        "c_none": "created", "x_paid": "cancelled", "sin_pref": "created", "error": "created",
+        "nuevo": "created",
+    }
+    assert stats["checked"] == 6 and stats["errors"] == 1 and stats["unchanged"] == 1
+    assert stats["updated"] == 3  # p_pend ya estaba pending
+    # Un aviso por estado y por página, solo con lo que efectivamente cambió
+    assert sorted((status, i) for status, ids in changes for i in ids) == [
+        ("paid", "c_paid"), ("paid", "p_paid"), ("pending", "c_pend")]
+
+
+def test_no_pisa_cambios_hechos_mientras_tanto(db):
+    engine, table = db
+
+    async def fetch(pref_id):
+        if pref_id == "pref-paid":
+            # Lo cancelan mientras consultamos a MP
+            with engine.begin() as conn:
+                conn.execute(table.update().where(table.c.id == "c_paid").values(status="cancelled"))
+        return await _fetch(pref_id)
+
+    asyncio.run(Reconciler(lambda: engine, table, fetch=fetch, retries=0).run_once())
+    assert _statuses(engine, table)["c_paid"] == "cancelled"
+
+
+def test_dry_run_no_toca_la_db(db):
+    engine, table = db
+    before = _statuses(engine, table)
+    stats = asyncio.run(Reconciler(lambda: engine, table, fetch=_fetch, retries=0, dry_run=True).run_once())
+    assert stats["paid"] == 2 and stats["updated"] == 0
+    assert _statuses(engine, table) == before
+
+
+def test_reintenta_errores_de_mp(db, monkeypatch):
+    engine, table = db
+    calls = []
+
+    async def flaky(pref_id):
+        calls.append(pref_id)
+        if calls.count(pref_id) == 1:
+            raise mp_client.MPError("timeout")
+        return await _fetch(pref_id) if pref_id != "pref-error" else "paid"
+
+    async def no_sleep(_):
+        pass
+
+    monkeypatch.setattr(reconcile.asyncio, "sleep", no_sleep)
+    stats = asyncio.run(Reconciler(lambda: engine, table, fetch=flaky, retries=2).run_once())
+    assert stats["errors"] == 0
+    assert _statuses(engine, table)["error"] == "paid"
+
+
+def test_estado_de_la_preferencia_segun_sus_pagos(monkeypatch):
+    orders = {
+        "aprobado": [{"payments": [{"status": "rejected"}, {"status": "approved"}]}],
+        "en_proceso": [{"payments": [{"status": "in_process"}]}],
+        "sin_pagos": [{"payments": []}],
+    }
+
+    class FakeMP:
+        async def search_merchant_orders(self, pref_id):
+            if pref_id == "caido":
+                return {"status": 503, "response": {}}
+            return {"status": 200, "response": {"elements": orders[pref_id]}}
+
+    monkeypatch.setattr(mp_client, "get_mp_client", lambda: FakeMP())
+    run = lambda pref: asyncio.run(reconcile.fetch_preference_status(pref))  # noqa: E731
+    assert run("aprobado") == "paid"
+    assert run("en_proceso") == "pending"
+    assert run("sin_pagos") is None
+    with pytest.raises(mp_client.MPError):
+        run("caido")
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import scheduler
+from scheduler import AppointmentScheduler, Timed
+
+NOW = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+
+
+def _sched(monkeypatch, **kw):
+    monkeypatch.setattr(scheduler.time, "time", lambda: NOW.timestamp())
+    s = AppointmentScheduler(lambda since, until: [], reminder_offsets=(60, 1440), grace_min=15, **kw)
+    s._loaded_until = NOW + timedelta(hours=24)
+    return s
+
+
+def _appt(appt_id, start, minutes=30):
+    return Timed(appt_id, "1", "p@x.com", start, start + timedelta(minutes=minutes))
+
+
+def test_fuera_de_la_ventana_no_se_agenda(monkeypatch):
+    s = _sched(monkeypatch)
+    assert not s.schedule(_appt("lejos", NOW + timedelta(days=3)))
+    assert s.schedule(_appt("cerca", NOW + timedelta(hours=2)))
+    assert len(s) == 1
+
+
+def test_recordatorios_atrasados_no_se_mandan(monkeypatch):
+    s = _sched(monkeypatch)
+    s.schedule(_appt("a", NOW + timedelta(hours=2)))
+    # El de 1440 min ya pasó: queda el de 60 y el cierre
+    kinds = sorted((kind, offset) for _, _, kind, offset, _, _ in s._heap)
+    assert kinds == [(0, 60), (1, 0)]
+
+
+def test_vencidos_agrupados_y_cancelados_descartados(monkeypatch):
+    s = _sched(monkeypatch)
+    closed, reminded = [], []
+
+    async def on_overdue(appts):
+        closed.append(sorted(a.appt_id for a in appts))
+
+    async def on_reminder(offset, appts):
+        reminded.append((offset, sorted(a.appt_id for a in appts)))
+
+    s._on_overdue = on_overdue
+    s.add_reminder_hook(on_reminder)
+    for i in range(3):
+        s.schedule(_appt(f"a{i}", NOW + timedelta(minutes=30 + i)))
+    s.cancel("a1")
+    s.schedule(_appt("a2", NOW + timedelta(hours=5)))  # reprogramado
+
+    later = NOW + timedelta(hours=1, minutes=30)
+    monkeypatch.setattr(scheduler.time, "time", lambda: later.timestamp())
+    asyncio.run(s._fire())
+    assert closed == [["a0"]]
+    assert reminded == []  # los de 60 min de a0/a1 ya estaban atrasados al agendar
+    assert len(s) == 1     # queda a2
+
+
+def test_cierre_fallido_se_reintenta(monkeypatch):
+    s = _sched(monkeypatch)
+    calls = []
+
+    async def on_overdue(appts):
+        calls.append([a.appt_id for a in appts])
+        if len(calls) == 1:
+            raise RuntimeError("DB caída")
+
+    s._on_overdue = on_overdue
+    s.OVERDUE_RETRY_S = 0
+    s.schedule(_appt("a", NOW - timedelta(hours=2)))
+    asyncio.run(s._fire())
+    assert len(s) == 1 and s.pending() == 1
+    asyncio.run(s._fire())
+    assert calls == [["a"], ["a"]]
+    assert len(s) == 0
+
+
+def test_recordatorio_de_24_horas_con_la_configuracion_por_defecto(monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return NOW
+
+    monkeypatch.setattr(scheduler, "datetime", FrozenDatetime)
+    monkeypatch.setattr(scheduler.time, "time", lambda: NOW.timestamp())
+    appt = _appt("a", NOW + timedelta(hours=30))
+    s = AppointmentScheduler(lambda since, until: [a for a in [appt] if since <= a.start < until],
+                             reminder_offsets=(1440, 60), horizon_h=24)
+    reminded = []
+
+    async def on_reminder(offset, appts):
+        reminded.append((offset, [a.appt_id for a in appts]))
+
+    s.add_reminder_hook(on_reminder)
+
+    async def boot():
+        await s.start()
+        await s.stop()
+
+    asyncio.run(boot())
+    assert len(s) == 1
+    due = NOW + timedelta(hours=6)
+    monkeypatch.setattr(scheduler.time, "time", lambda: due.timestamp())
+    asyncio.run(s._fire())
+    assert reminded == [(1440, ["a"])]
@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, func, select
+
+import manage_seed
+from availability import AvailabilityEngine, iso_utc
+from models import Base, Service
+
+NOW = datetime(2030, 1, 7, tzinfo=timezone.utc)
+
+
+def _dataset(seed=7, n=200):
+    rng = random.Random(seed)
+    doctors = [{"id": i} for i in range(1, 4)]
+    patients = [{"email": f"p{i}@example.com"} for i in range(50)]
+    services = [{"id": 10 * d["id"] + k, "doctor_id": d["id"], "duration_min": dur, "price": 1000.0}
+                for d in doctors for k, dur in enumerate((20, 45, 60))]
+    rows = list(manage_seed._gen_appointments(rng, doctors, patients, services, n, 20, 20, NOW))
+    return services, rows
+
+
+def test_turnos_con_la_duracion_del_servicio_y_sin_solapamientos():
+    services, rows = _dataset()
+    assert len(rows) == 200
+    durations = {str(s["id"]): s["duration_min"] for s in services}
+    cal = AvailabilityEngine()
+    for r in rows:
+        assert r["duration_min"] == durations[r["service_id"]]
+        end = r["when_ts"] + timedelta(minutes=r["duration_min"])
+        assert cal.reserve(r["doctor_id"], r["id"], r["when_ts"], end), r  # sin solapamientos
+        local = r["when_ts"].astimezone(cal.tz)
+        assert local.weekday() in cal.weekdays
+        assert cal.opens <= local.time() and end.astimezone(cal.tz).time() <= cal.closes
+        assert r["when_at"] == iso_utc(r["when_ts"])
+
+
+def test_estado_segun_pasado_o_futuro_y_reproducible():
+    _, rows = _dataset()
+    for r in rows:
+        if r["when_ts"] < NOW:
+            assert r["status"] in ("done", "no_show", "cancelled")
+        else:
+            assert r["status"] in ("paid", "created", "pending")
+        assert (r["mp_preference_id"] is None) == (r["status"] == "cancelled")
+    assert rows == _dataset()[1]
+
+
+def test_bulk_insert_por_lotes():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Service.__table__])
+    rows = [{"id": i, "doctor_id": 1, "title": "x", "duration_min": 30, "price": 1.0, "currency": "ARS"}
+            for i in range(1, 12)]
+    assert manage_seed.bulk_insert(engine, Service.__table__, rows, batch=5) == 11
+    manage_seed._sync_sequence(engine, Service.__table__)
+    with engine.begin() as conn:
+        conn.execute(Service.__table__.insert(), {"doctor_id": 1, "title": "y"})  # id asignado por la DB
+        assert conn.execute(select(func.max(Service.__table__.c.id))).scalar() == 12
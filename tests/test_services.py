@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import db
+import services
+from models import Base, Service
+
+
+@pytest.fixture
+def client():
+    Base.metadata.drop_all(db.engine, tables=[Service.__table__])
+    Base.metadata.create_all(db.engine, tables=[Service.__table__])
+    services.invalidate_catalog()
+    app = FastAPI()
+    app.include_router(services.router)
+    return TestClient(app)
+
+
+def _add(title, price):
+    session = db.SessionLocal()
+    try:
+        session.add(Service(doctor_id=1, title=title, duration_min=30, price=price, currency="ARS"))
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_tabla_vacia_devuelve_el_catalogo_por_defecto(client):
+    r = client.get("/services/")
+    assert r.status_code == 200
+    assert r.json() == services._DEFAULT_SERVICES
+    assert r.headers["Cache-Control"] == "no-cache"
+
+
+def test_etag_estable_y_304_con_if_none_match(client):
+    _add("Teleconsulta", 40000.0)
+    first = client.get("/services/")
+    etag = first.headers["ETag"]
+    assert client.get("/services/").headers["ETag"] == etag
+
+    r = client.get("/services/", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b"" and r.headers["ETag"] == etag
+    r = client.get("/services/", headers={"If-None-Match": f'"otro", {etag}'})
+    assert r.status_code == 304
+    assert client.get("/services/", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/services/", headers={"If-None-Match": '"otro"'}).status_code == 200
+
+
+def test_cambio_en_services_invalida_la_cache(client):
+    _add("Teleconsulta", 40000.0)
+    before = client.get("/services/")
+    assert [s["name"] for s in before.json()] == ["Teleconsulta"]
+
+    _add("Control", 30000.0)  # after_insert invalida sin esperar el TTL
+    after = client.get("/services/")
+    assert [s["name"] for s in after.json()] == ["Teleconsulta", "Control"]
+    assert after.headers["ETag"] != before.headers["ETag"]
+    r = client.get("/services/", headers={"If-None-Match": before.headers["ETag"]})
+    assert r.status_code == 200
+
+
+def test_cache_dentro_del_ttl_no_relee_la_db(client, monkeypatch):
+    _add("Teleconsulta", 40000.0)
+    body = client.get("/services/").content
+    monkeypatch.setattr(services, "read_session", None)  # si releyera, fallaría
+    assert client.get("/services/").content == body
+
+
+def test_invalidacion_durante_la_lectura_no_guarda_datos_viejos(client, monkeypatch):
+    real = services.read_session
+
+    def racing(key=None):
+        services.invalidate_catalog()  # otro hilo cambia el catálogo mientras leemos
+        return real(key)
+
+    monkeypatch.setattr(services, "read_session", racing)
+    services._load_catalog()
+    assert services._catalog is None
+    monkeypatch.setattr(services, "read_session", real)
+    body, _, _ = services._load_catalog()
+    assert services._catalog is not None and json.loads(body) == services._DEFAULT_SERVICES
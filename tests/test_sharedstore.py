@@ -0,0 +1,86 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from sharedstore import SqliteApptStore, SqliteSlots
+
+NOW = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+
+
+def _store(path, **kw):
+    opts = {"ttl": 3600, "max_items": 1000, "evict_every": 0, **kw}
+    return SqliteApptStore(str(path), **opts)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "appts.db"
+
+
+def _appt(appt_id, hours, email="p@x.com"):
+    return {"id": appt_id, "patient_email": email, "start_at": (NOW + timedelta(hours=hours)).isoformat()}
+
+
+def test_dos_workers_ven_los_mismos_turnos(path):
+    a, b = _store(path), _store(path)
+    for i in range(5):
+        a.save(_appt(f"a{i}", i, email=f"p{i % 2}@x.com"))
+    b.mark_paid("a1")
+    assert a.get("a1")["paid"] and not a.get("a0")["paid"]
+    assert sorted(x["id"] for x in b.by_patient("p0@x.com")) == ["a0", "a2", "a4"]
+    assert [x["id"] for x in b.between(NOW + timedelta(hours=1), NOW + timedelta(hours=3))] == ["a1", "a2"]
+    assert b.update("a2", start_at=(NOW + timedelta(hours=9)).isoformat())
+    assert [x["id"] for x in a.between(NOW + timedelta(hours=1), NOW + timedelta(hours=3))] == ["a1"]
+
+
+def test_descarte_por_ttl_y_por_tamano(path):
+    store = _store(path, max_items=5)
+    for i in range(8):
+        store.save(_appt(f"a{i}", i))
+    store.save(_appt("viejo", -24))
+    assert store.evict(NOW) == 4
+    assert len(store) == 5
+    assert store.get("viejo") is None and store.get("a0") is None and store.get("a7") is not None
+
+
+def test_horario_tomado_en_otro_worker_se_rechaza(path):
+    worker_a, worker_b = SqliteSlots(_store(path)), SqliteSlots(_store(path))
+    end = NOW + timedelta(minutes=30)
+    assert worker_a.reserve("1", "x", NOW, end)
+    assert not worker_b.reserve("1", "y", NOW + timedelta(minutes=15), end + timedelta(minutes=15))
+    assert not worker_b.is_free("1", NOW, end)
+    assert worker_b.reserve("2", "y", NOW, end)                      # otro médico
+    assert worker_b.reserve("1", "z", end, end + timedelta(minutes=30))  # contiguo
+    assert not worker_b.reserve("1", "x", NOW + timedelta(days=1), end + timedelta(days=1))  # mismo turno
+
+    # Después de un reinicio lo reservado sigue ahí; liberar lo deja tomar
+    restarted = SqliteSlots(_store(path))
+    assert not restarted.reserve("1", "w", NOW, end)
+    assert restarted.release("x") and not restarted.release("x")
+    assert restarted.reserve("1", "w", NOW, end)
+
+
+def test_reservas_concurrentes_del_mismo_horario(path):
+    slots = [SqliteSlots(_store(path)) for _ in range(8)]
+    won = []
+
+    def book(k):
+        if slots[k].reserve("1", f"t{k}", NOW, NOW + timedelta(minutes=30)):
+            won.append(k)
+
+    threads = [threading.Thread(target=book, args=(k,)) for k in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(won) == 1
+
+
+def test_el_descarte_libera_horarios_viejos(path):
+    store = _store(path)
+    slots = SqliteSlots(store)
+    old = NOW - timedelta(days=2)
+    assert slots.reserve("1", "viejo", old, old + timedelta(minutes=30))
+    store.evict(NOW)
+    assert slots.is_free("1", old, old + timedelta(minutes=30))
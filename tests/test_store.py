@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db import ApptStore
+
+NOW = datetime(2030, 1, 7, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def store():
+    return ApptStore(shards=4, ttl=3600, max_items=1000, evict_every=0)
+
+
+def _appt(appt_id, hours, email="p@x.com"):
+    return {"id": appt_id, "patient_email": email, "start_at": (NOW + timedelta(hours=hours)).isoformat()}
+
+
+def test_indices_por_paciente_y_por_inicio(store):
+    for i in range(10):
+        store.save(_appt(f"a{i}", i, email=f"p{i % 2}@x.com"))
+    assert sorted(a["id"] for a in store.by_patient("p0@x.com")) == ["a0", "a2", "a4", "a6", "a8"]
+    got = store.between(NOW + timedelta(hours=2), NOW + timedelta(hours=5))
+    assert [a["id"] for a in got] == ["a2", "a3", "a4"]
+
+    assert store.update("a3", start_at=(NOW + timedelta(hours=20)).isoformat(), patient_email="n@x.com")
+    assert [a["id"] for a in store.between(NOW + timedelta(hours=2), NOW + timedelta(hours=5))] == ["a2", "a4"]
+    assert [a["id"] for a in store.by_patient("n@x.com")] == ["a3"]
+    assert not store.update("nope", paid=True)
+
+
+def test_pagos_y_borrado(store):
+    store.save(_appt("a", 1))
+    store.save(_appt("b", 2))
+    store.mark_paid("a")
+    store.mark_paid_many(["b", "nope"])
+    assert store.get("a")["paid"] and store.get("b")["paid"]
+    store.delete("a")
+    assert store.get("a") is None
+    assert [a["id"] for a in store.between(NOW, NOW + timedelta(days=1))] == ["b"]
+
+
+def test_descarte_por_ttl_y_por_tamano(store):
+    store.max_items = 5
+    for i in range(8):
+        store.save(_appt(f"a{i}", i))
+    store.save(_appt("viejo", -24))
+    n = store.evict(NOW)
+    assert n == 4
+    assert len(store) == 5
+    assert store.get("viejo") is None and store.get("a0") is None and store.get("a7") is not None
+
+
+def test_guardados_concurrentes():
+    store = ApptStore(shards=8, ttl=10 ** 9, max_items=10 ** 9, evict_every=50)
+
+    def writer(k):
+        for i in range(500):
+            store.save(_appt(f"{k}-{i}", i % 48, email=f"p{k}@x.com"))
+
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(store) == 4000
+    assert all(len(store.by_patient(f"p{k}@x.com")) == 500 for k in range(8))
+    everything = store.between(NOW - timedelta(days=1), NOW + timedelta(days=3))
+    assert len(everything) == 4000
+    starts = [a["start_at"] for a in everything]
+    assert starts == sorted(starts)
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def clean_buffer():
+    tracing.buffer.clear()
+    yield
+    tracing.buffer.clear()
+
+
+def _client(**opts):
+    app = FastAPI()
+
+    @app.get("/turnos/{appt_id}")
+    @tracing.endpoint
+    async def turno(appt_id: str, ms: float = 0):
+        with tracing.span("db.execute"):
+            time.sleep(ms / 1000)
+        return {"id": appt_id}
+
+    @app.get("/pesado")
+    @tracing.endpoint
+    async def pesado():
+        def busy():
+            with tracing.span("cpu"):
+                t_end = time.perf_counter() + 0.2
+                while time.perf_counter() < t_end:
+                    sum(range(1000))
+        await run_in_threadpool(busy)
+        return {}
+
+    app.add_middleware(tracing.TracingMiddleware, **opts)
+    return TestClient(app)
+
+
+def test_span_sin_traza_no_hace_nada():
+    with tracing.span("x"):
+        pass
+    assert tracing.current() is None
+
+
+def test_solo_se_guardan_los_lentos_con_sus_tramos():
+    client = _client(sample_rate=0, slow_ms=50)
+    assert client.get("/turnos/rapido").status_code == 200
+    assert client.get("/turnos/lento?ms=80").status_code == 200
+    (trace,) = tracing.buffer.snapshot()
+    d = trace.to_dict()
+    assert d["path"] == "/turnos/{appt_id}" and d["status"] == 200  # plantilla, no la URL
+    assert d["reason"] == ["slow"] and d["ms"] >= 80 and d["profile_samples"] == 0
+    names = [s["name"] for s in d["spans"]]
+    assert names == ["handler", "db.execute", "response.serialize"]
+    db = d["spans"][1]
+    assert db["ms"] >= 80 and db["start_ms"] >= 0
+
+
+def test_desactivado_no_guarda_nada():
+    client = _client(sample_rate=0, slow_ms=0)
+    client.get("/turnos/1?ms=20")
+    assert tracing.buffer.snapshot() == []
+
+
+def test_muestreados_traen_perfil_plegado_del_threadpool(monkeypatch):
+    monkeypatch.setattr(tracing.profiler, "interval", 0.005)
+    client = _client(sample_rate=1.0, slow_ms=0)
+    assert client.get("/pesado").status_code == 200
+    (trace,) = tracing.buffer.snapshot()
+    assert trace.to_dict()["reason"] == ["sampled"]
+    assert sum(trace.stacks.values()) > 0
+    lines = [line.rsplit(" ", 1) for line in tracing.folded([trace]).splitlines()]
+    assert all(int(n) > 0 for _, n in lines)
+    assert any(stack.endswith("test_tracing.py:_client.<locals>.pesado.<locals>.busy")
+               for stack, _ in lines)
+
+
+def test_folded_suma_pilas_de_varias_trazas():
+    a, b = tracing.Trace("GET", "/a", True), tracing.Trace("GET", "/b", True)
+    a.stacks.update({"main;f": 3, "main;g": 1})
+    b.stacks.update({"main;f": 2})
+    assert tracing.folded([a, b]) == "main;f 5\nmain;g 1\n"
+    assert tracing.folded([]) == ""
+
+
+def test_buffer_circular_mas_recientes_primero():
+    buf = tracing.TraceBuffer(size=3)
+    traces = [tracing.Trace("GET", f"/{i}", False) for i in range(5)]
+    for t in traces:
+        buf.add(t)
+    assert [t.path for t in buf.snapshot()] == ["/4", "/3", "/2"]
+    assert [t.path for t in buf.snapshot(limit=2)] == ["/4", "/3"]
+    assert buf.get(traces[3].id) is traces[3]
+    assert buf.get(traces[0].id) is None  # descartada
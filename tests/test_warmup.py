@@ -0,0 +1,82 @@
+import asyncio
+
+from warmup import WarmUp
+
+
+def _run(warm):
+    async def go():
+        warm.start()
+        await warm._task
+    asyncio.run(go())
+
+
+def test_paso_requerido_se_reintenta_hasta_que_anda():
+    warm = WarmUp(retries=5, retry_delay=0, max_delay=0)
+    calls, order = [], []
+
+    @warm.step("db")
+    async def db():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("la DB todavía no acepta conexiones")
+        order.append("db")
+
+    @warm.step("availability", after=["db"])
+    async def availability():
+        order.append("availability")
+
+    _run(warm)
+    assert warm.ready
+    assert order == ["db", "availability"]  # el dependiente espera el resultado final
+    steps = {s["name"]: s for s in warm.report()["steps"]}
+    assert steps["db"]["state"] == "ok" and steps["db"]["attempts"] == 3
+
+
+def test_falla_permanente_tras_los_intentos():
+    warm = WarmUp(retries=4, retry_delay=0, max_delay=0)
+
+    @warm.step("db")
+    async def db():
+        raise ConnectionError("sin DB")
+
+    _run(warm)
+    assert not warm.ready
+    step = warm.report()["steps"][0]
+    assert step["state"] == "error" and step["attempts"] == 4
+    assert step["detail"] == "ConnectionError: sin DB"
+
+
+def test_paso_opcional_no_se_reintenta_ni_bloquea():
+    warm = WarmUp(retries=4, retry_delay=0, max_delay=0)
+    calls = []
+
+    @warm.step("mp_client", required=False)
+    async def mp():
+        calls.append(1)
+        raise TimeoutError("MP lento")
+
+    _run(warm)
+    assert warm.ready and calls == [1]
+    assert warm.report()["steps"][0]["state"] == "error"
+
+
+def test_no_esta_listo_mientras_reintenta():
+    warm = WarmUp(retries=3, retry_delay=0.05, max_delay=0.05)
+    calls = []
+    seen = []
+
+    @warm.step("db")
+    async def db():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("todavía no")
+
+    async def go():
+        warm.start()
+        await asyncio.sleep(0.01)
+        seen.append((warm.ready, warm.report()["steps"][0]["state"]))
+        await warm._task
+
+    asyncio.run(go())
+    assert seen == [(False, "retrying")]
+    assert warm.ready
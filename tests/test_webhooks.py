@@ -0,0 +1,140 @@
+import asyncio
+
+import webhooks
+from webhooks import SeenSet, WebhookIngestor, extract_event
+
+
+def test_seen_set_descarta_duplicados(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(webhooks.time, "monotonic", lambda: now[0])
+    seen = SeenSet(max_size=10, ttl=60)
+    assert seen.add("k")
+    assert not seen.add("k")
+    now[0] += 61  # vencida: vuelve a aceptarse
+    assert seen.add("k")
+    seen.discard("k")
+    assert seen.add("k")
+
+
+def test_seen_set_acotado_lru():
+    seen = SeenSet(max_size=3, ttl=600)
+    for k in "abc":
+        seen.add(k)
+    assert not seen.add("a")  # "a" pasa a ser la más reciente
+    seen.add("d")             # sale "b", la menos usada
+    assert len(seen) == 3
+    assert seen.add("b")
+    assert not seen.add("a")
+
+
+def test_extract_event_formatos():
+    assert extract_event({"type": "payment", "action": "payment.updated", "data": {"id": 12}}, {}) == (
+        "payment", "12", "payment.updated")
+    assert extract_event({}, {"topic": "merchant_order", "id": "9"}) == ("merchant_order", "9", "")
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_agrupa_y_descarta_duplicados():
+    applied = []
+
+    async def resolve(topic, rid, data):
+        return (data["appt"], "paid")
+
+    def apply(status, ids):
+        applied.append((status, sorted(ids)))
+
+    async def scenario():
+        ing = WebhookIngestor(resolve, apply, max_delay=0.01)
+        await ing.start()
+        assert ing.accept("payment", "1", "", {"appt": "a"})
+        assert not ing.accept("payment", "1", "", {"appt": "a"})  # reintento de MP
+        assert ing.accept("payment", "2", "", {"appt": "b"})
+        await ing.stop()
+
+    _run(scenario())
+    assert applied == [("paid", ["a", "b"])]
+
+
+def test_reintenta_si_falla_apply(monkeypatch):
+    monkeypatch.setattr(webhooks.random, "uniform", lambda a, b: 1.0)
+    calls = []
+
+    async def resolve(topic, rid, data):
+        return ("a", "paid")
+
+    async def apply(status, ids):
+        calls.append(ids)
+        if len(calls) < 3:
+            raise RuntimeError("DB caída")
+
+    async def scenario():
+        ing = WebhookIngestor(resolve, apply, max_delay=0.001, retry_base=0.01)
+        await ing.start()
+        ing.accept("payment", "1", "", {})
+        await asyncio.sleep(0.3)
+        # Mientras tanto el duplicado se sigue descartando
+        assert not ing.accept("payment", "1", "", {})
+        await ing.stop()
+
+    _run(scenario())
+    assert calls == [["a"], ["a"], ["a"]]
+
+
+def test_agotados_los_intentos_libera_la_clave(monkeypatch):
+    monkeypatch.setattr(webhooks.random, "uniform", lambda a, b: 1.0)
+    attempts = []
+
+    async def resolve(topic, rid, data):
+        attempts.append(rid)
+        raise RuntimeError("MP no responde")
+
+    async def scenario():
+        ing = WebhookIngestor(resolve, lambda s, ids: None, max_delay=0.001,
+                              max_retries=2, retry_base=0.01)
+        await ing.start()
+        ing.accept("payment", "1", "", {})
+        await asyncio.sleep(0.3)
+        # Se rindió: el próximo aviso de MP tiene que entrar de nuevo
+        assert ing.accept("payment", "1", "", {})
+        await ing.stop()
+
+    _run(scenario())
+    assert len(attempts) >= 3
+
+
+def test_stop_cancela_reintentos_pendientes():
+    async def resolve(topic, rid, data):
+        raise RuntimeError("falla")
+
+    async def scenario():
+        ing = WebhookIngestor(resolve, lambda s, ids: None, max_delay=0.001, retry_base=60)
+        await ing.start()
+        ing.accept("payment", "1", "", {})
+        await asyncio.sleep(0.05)
+        assert len(ing._retries) == 1
+        await ing.stop()
+        assert not ing._retries
+        assert ing.seen.add(("payment", "1", ""))
+
+    _run(scenario())
+
+
+def test_aviso_tardio_no_revive_turnos_cerrados(app_db):
+    main, engine = app_db
+    statuses = {"c": "created", "p": "pending", "x": "cancelled", "d": "done", "n": "no_show", "ok": "paid"}
+    with engine.begin() as conn:
+        conn.execute(main.appointments.insert(), [
+            {"id": appt_id, "when_at": "2030-01-07T13:00:00.000Z", "status": status,
+             "price": 100, "currency": "ARS"}
+            for appt_id, status in statuses.items()
+        ])
+    main._apply_webhook_status("pending", list(statuses))
+    main._apply_webhook_status("paid", list(statuses))
+    main._apply_webhook_status("refunded", list(statuses))  # sin transición conocida: nada
+    with engine.connect() as conn:
+        got = dict(conn.execute(main.appointments.select().with_only_columns(
+            main.appointments.c.id, main.appointments.c.status)).all())
+    assert got == {"c": "paid", "p": "paid", "x": "cancelled", "d": "done", "n": "no_show", "ok": "paid"}
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, select
+from sqlalchemy.pool import StaticPool
+
+from writebehind import WriteBehindQueue
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool,
+                           connect_args={"check_same_thread": False})
+    meta = MetaData()
+    table = Table("t", meta, Column("id", String, primary_key=True), Column("n", Integer))
+    meta.create_all(engine)
+    return engine, table
+
+
+def _count(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_lotes_y_vaciado_al_parar(db):
+    engine, table = db
+
+    async def scenario():
+        q = WriteBehindQueue(engine, table, max_batch=10, max_delay=0.5)
+        await q.start()
+        for i in range(25):
+            await q.submit({"id": f"a{i}", "n": i})
+        await q.stop()  # escribe lo pendiente antes de terminar
+
+    asyncio.run(scenario())
+    assert _count(engine, table) == 25
+
+
+def test_durable_espera_el_commit(db):
+    engine, table = db
+
+    async def scenario():
+        q = WriteBehindQueue(engine, table, max_batch=100, max_delay=0.01)
+        await q.start()
+        await q.submit({"id": "a", "n": 1}, durable=True)
+        n = _count(engine, table)
+        await q.stop()
+        return n
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_lote_fallido(db):
+    engine, table = db
+    failed = []
+
+    async def scenario():
+        q = WriteBehindQueue(engine, table, max_batch=2, max_delay=0.01,
+                             on_failed=lambda rows: failed.extend(r["id"] for r in rows))
+        await q.start()
+        await q.submit({"id": "a", "n": 1}, durable=True)
+        with pytest.raises(Exception):
+            await q.submit({"id": "a", "n": 2}, durable=True)  # clave repetida
+        await q.stop()
+
+    asyncio.run(scenario())
+    assert failed == ["a"]
+    assert _count(engine, table) == 1
+
+
+def test_submit_sin_iniciar(db):
+    engine, table = db
+    q = WriteBehindQueue(engine, table)
+    with pytest.raises(RuntimeError):
+        asyncio.run(q.submit({"id": "a", "n": 1}))
@@ -0,0 +1,280 @@
+# tracing.py — desglose de requests lentos y perfiles de pila muestreados
+#
+# El middleware abre una traza por request (si está activo). Los tramos se
+# marcan con `with tracing.span("nombre"):`; sin traza en curso es un no-op.
+# Se guardan en un buffer circular:
+#   - una fracción TRACE_SAMPLE_RATE de los requests, con perfil de pila
+#     (un hilo toma la pila cada 1/TRACE_PROFILE_HZ s mientras están en curso),
+#   - todo request que tarde más de TRACE_SLOW_MS, solo con los tramos.
+# Los perfiles se exportan como pilas plegadas ("a;b;c 12"), el formato de
+# flamegraph.pl, speedscope e inferno.
+
+import asyncio
+import contextvars
+import functools
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # 0.01 = 1% de los requests
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))      # 0 = no guardar lentos
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "200"))            # trazas en memoria
+TRACE_PROFILE_HZ = float(os.getenv("TRACE_PROFILE_HZ", "100"))  # muestras de pila por segundo
+
+_ids = itertools.count(1)
+
+
+class Trace:
+    __slots__ = ("id", "at", "method", "path", "sampled", "slow", "status", "t0", "ms",
+                 "handler_end", "spans", "stacks")
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = next(_ids)
+        self.at = datetime.now(timezone.utc)
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.slow = False
+        self.status = 500
+        self.t0 = time.perf_counter()
+        self.ms = 0.0
+        self.handler_end: Optional[float] = None
+        self.spans: List[Tuple[str, float, float]] = []  # (nombre, inicio, fin) en perf_counter
+        self.stacks: Counter = Counter()
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        self.spans.append((name, start, end))  # append es atómico: hay tramos desde el threadpool
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "at": self.at.isoformat(),
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "ms": round(self.ms, 2),
+            "reason": [r for r, on in (("sampled", self.sampled), ("slow", self.slow)) if on],
+            "spans": [
+                {"name": name, "start_ms": round((s - self.t0) * 1000, 2),
+                 "ms": round((e - s) * 1000, 2)}
+                for name, s, e in sorted(self.spans, key=lambda sp: sp[1])
+            ],
+            "profile_samples": sum(self.stacks.values()),
+        }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Tramo con nombre dentro de la traza en curso (también desde el threadpool)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    profiled = (trace.sampled and profiler.loop_thread is not None
+                and threading.get_ident() != profiler.loop_thread)
+    if profiled:
+        profiler.attach_thread(trace)  # hilo del threadpool: sus pilas van a esta traza
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter())
+        if profiled:
+            profiler.detach_thread()
+
+
+def endpoint(fn):
+    """
+    Decorador de endpoints async: tramo "handler" y marca de fin, para que el
+    middleware mida aparte la serialización de la respuesta (response_model).
+    """
+    @functools.wraps(fn)  # FastAPI lee la firma a través de __wrapped__
+    async def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return await fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            trace.handler_end = time.perf_counter()
+            trace.add_span("handler", start, trace.handler_end)
+    return wrapper
+
+
+# ─────────────────────────────────────────────────────────
+# Perfil de pila
+# ─────────────────────────────────────────────────────────
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackProfiler:
+    """
+    Hilo que toma la pila de los requests muestreados mientras hay alguno en
+    curso (si no, duerme). En el hilo del event loop, la pila se asigna a la
+    traza de la tarea que está corriendo; en el threadpool, a la del tramo
+    abierto en ese hilo.
+    """
+
+    def __init__(self, hz: float = TRACE_PROFILE_HZ):
+        self.interval = 1 / hz if hz > 0 else 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+        self._tasks: Dict[asyncio.Task, Trace] = {}
+        self._threads: Dict[int, Trace] = {}
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def attach(self, trace: Trace) -> None:
+        """Desde el event loop, al empezar un request muestreado."""
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop, self.loop_thread = loop, threading.get_ident()
+        self._tasks[asyncio.current_task()] = trace
+        self._active.set()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="stack-profiler", daemon=True)
+                    self._thread.start()
+
+    def detach(self) -> None:
+        self._tasks.pop(asyncio.current_task(), None)
+        if not self._tasks and not self._threads:
+            self._active.clear()
+
+    def attach_thread(self, trace: Trace) -> None:
+        self._threads[threading.get_ident()] = trace
+
+    def detach_thread(self) -> None:
+        self._threads.pop(threading.get_ident(), None)
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        loop, tasks = self.loop, self._tasks
+        if tasks and loop is not None:
+            trace = tasks.get(asyncio.current_task(loop))
+            frame = frames.get(self.loop_thread)
+            if trace is not None and frame is not None:
+                trace.stacks[_fold(frame)] += 1
+        for tid, trace in list(self._threads.items()):
+            frame = frames.get(tid)
+            if frame is not None:
+                trace.stacks[_fold(frame)] += 1
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            try:
+                self._sample()
+            except Exception as e:  # el perfil nunca debe tirar abajo la app
+                print("Profiler: error al tomar la pila:", e)
+            time.sleep(self.interval)
+
+
+profiler = StackProfiler()
+
+
+# ─────────────────────────────────────────────────────────
+# Buffer de trazas y middleware
+# ─────────────────────────────────────────────────────────
+class TraceBuffer:
+    def __init__(self, size: int = TRACE_BUFFER):
+        self._items: Deque[Trace] = deque(maxlen=size)
+
+    def add(self, trace: Trace) -> None:
+        self._items.append(trace)  # deque con maxlen: descarta la más vieja
+
+    def snapshot(self, limit: Optional[int] = None) -> List[Trace]:
+        items = list(self._items)[::-1]  # más recientes primero
+        return items[:limit] if limit else items
+
+    def get(self, trace_id: int) -> Optional[Trace]:
+        return next((t for t in self._items if t.id == trace_id), None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+buffer = TraceBuffer()
+
+
+def folded(traces: Iterable[Trace]) -> str:
+    """Pilas plegadas de varias trazas, sumadas (entrada de flamegraph.pl)."""
+    total: Counter = Counter()
+    for trace in traces:
+        total.update(trace.stacks)
+    return "".join(f"{stack} {n}\n" for stack, n in total.most_common())
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI de trazas. Con TRACE_SAMPLE_RATE=0 y TRACE_SLOW_MS=0 no hace
+    nada; con solo el umbral de lentos cuesta un objeto y unas pocas lecturas
+    del reloj por request.
+    """
+
+    def __init__(self, app, *, sample_rate: float = TRACE_SAMPLE_RATE, slow_ms: float = TRACE_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or (self.sample_rate <= 0 and self.slow_ms <= 0)
+                or scope["path"].startswith("/debug")):
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = Trace(scope["method"], scope["path"], sampled)
+        response_start: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal response_start
+            if message["type"] == "http.response.start":
+                response_start = time.perf_counter()
+                trace.status = message["status"]
+            await send(message)
+
+        token = _current.set(trace)
+        if sampled:
+            profiler.attach(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if sampled:
+                profiler.detach()
+            _current.reset(token)
+            end = time.perf_counter()
+            trace.ms = (end - trace.t0) * 1000
+            if trace.handler_end is not None and response_start is not None:
+                trace.add_span("response.serialize", trace.handler_end, response_start)
+            route = scope.get("route")
+            if route is not None:
+                trace.path = getattr(route, "path", trace.path)  # plantilla, no la URL
+            trace.slow = self.slow_ms > 0 and trace.ms >= self.slow_ms
+            if sampled or trace.slow:
+                buffer.add(trace)
@@ -11,29 +11,61 @@ def join_appointment(appointment_id: str):
     return {"status": "ok", "join_url": f"https://example.com/{appointment_id}"}
 # video.py — creación de turnos y enlace de videollamada
 
+import asyncio
 import os
 import uuid
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from models import ApptIn, ApptOut
-from db import save_appt, get_appt
-from datetime import datetime, timezone
+import db
+from db import save_appt, get_appt, update_appt, mark_paid
+from datetime import datetime, timedelta, timezone
+
+import eventlog
+import jointoken
+import mp_client
+from checkout import DeferredCheckout
+from idempotency import IdempotencyCache, IdempotencyConflict
 
 # Mercado Pago opcional
 _MP_TOKEN = os.getenv("MP_ACCESS_TOKEN")
 _MP_INTEGRATION: bool = bool(_MP_TOKEN)
-mp = None
-if _MP_INTEGRATION:
-    import mercadopago
-    mp = mercadopago.SDK(_MP_TOKEN)
+
+_DEFAULT_DOCTOR_ID = os.getenv("DEFAULT_DOCTOR_ID", "1")
 
 router = APIRouter()
+router.add_event_handler("shutdown", mp_client.close_mp_client)
+
+_warm_task = None
+
+async def _warm_mp():
+    try:
+        await mp_client.get_mp_client().warm()
+    except Exception as e:
+        print("ERROR en warm-up de Mercado Pago:", e)
+
+async def _start_warmup():
+    # Abre la conexión con MP en segundo plano; el startup no la espera
+    global _warm_task
+    if _MP_INTEGRATION:
+        _warm_task = asyncio.create_task(_warm_mp())
+
+router.add_event_handler("startup", _start_warmup)
+
+# Agenda: rechaza turnos solapados del mismo médico (con APPT_STORE=sqlite, en el archivo compartido)
+slots = db.make_slots()
+
+# Reintentos con la misma Idempotency-Key devuelven el turno original
+idem_cache = IdempotencyCache(
+    max_size=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000")),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600))),
+)
 
 def _build_join_url(appt_id: str) -> str:
     # Usamos Jitsi como sala gratuita
     return f"https://meet.jit.si/teleconsulta-emilio-{appt_id}"
 
-def _create_mp_preference(appt_id: str, appt: ApptIn) -> str:
-    assert mp is not None
+def _build_preference(appt_id: str, appt: ApptIn) -> dict:
     # URL a tu webhook (este endpoint lo exponemos en payments.py)
     webhook_url = os.getenv("WEBHOOK_URL")  # opcional: si no está, Railway la infiere por dominio
     pref = {
@@ -50,14 +82,102 @@ def _create_mp_preference(appt_id: str, appt: ApptIn) -> str:
     }
     if webhook_url:
         pref["notification_url"] = webhook_url
+    return pref
+
+async def _store_call(fn, *args, **kwargs):
+    # El store en memoria es un dict: directo. El de SQLite escribe en disco: fuera del event loop
+    if db.APPT_STORE == "sqlite":
+        return await run_in_threadpool(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+async def _create_mp_preference(appt_id: str, pref: dict) -> tuple:
+    # Devuelve (checkout_url, id de preferencia); lanza MPError si MP falla
+    mp = mp_client.get_mp_client()
+    pref_res = await mp.create_preference(pref, idempotency_key=appt_id)
+    status = pref_res["status"]
+    if status not in (200, 201):
+        if 400 <= status < 500 and status != 429:
+            raise mp_client.MPRejected(f"Mercado Pago respondió {status}")  # no se reintenta
+        raise mp_client.MPError(f"Mercado Pago respondió {status}")
+    return pref_res["response"]["init_point"], pref_res["response"].get("id")
+
+async def _on_checkout_ready(appt_id: str, checkout_url: str, pref_id: str | None):
+    # El link queda en el store: con APPT_STORE=sqlite lo ven los demás workers
+    fields = {"checkout_pending": False, "checkout_url": checkout_url}
+    await _store_call(update_appt, appt_id, **fields)
+    eventlog.record("appointment.updated", appt_id, fields=fields, mp_preference_id=pref_id)
+
+def _revoke_join(appt_id: str, appt: dict | None) -> None:
+    # Los tokens ya emitidos dejan de valer; con el turno a mano, solo hasta que vencerían
+    if appt is None:
+        jointoken.revoke(appt_id)
+        return
+    start = datetime.fromisoformat(appt["start_at"])
+    jointoken.revoke(appt_id, until=jointoken.expires_at(start, appt["duration"]))
 
-    pref_res = mp.preference().create(pref)
-    if pref_res["status"] not in (200, 201):
-        raise HTTPException(status_code=502, detail="Error con Mercado Pago")
-    return pref_res["response"]["init_point"]
+async def _on_checkout_failed(appt_id: str):
+    # MP no volvió a tiempo (o rechazó la preferencia): liberamos el horario
+    await _store_call(slots.release, appt_id)
+    await _store_call(update_appt, appt_id, checkout_pending=False, cancelled=True)
+    _revoke_join(appt_id, await _store_call(get_appt, appt_id))
+    eventlog.record("appointment.status", appt_id, status="cancelled", source="checkout")
+
+# Si MP está lento o caído, el turno se guarda y el link de pago sale después
+deferred_checkout = DeferredCheckout(
+    _create_mp_preference,
+    on_ready=_on_checkout_ready,
+    on_failed=_on_checkout_failed,
+)
+router.add_event_handler("startup", deferred_checkout.start)
+router.add_event_handler("shutdown", deferred_checkout.stop)
+
+def _replay_event(event: dict) -> None:
+    appt_id, kind = event.get("appt"), event["type"]
+    if kind == "appointment.created" and "record" in event:
+        rec = event["record"]
+        save_appt(rec)
+        start = datetime.fromisoformat(rec["start_at"])
+        slots.reserve(rec["doctor_id"], rec["id"], start, start + timedelta(minutes=rec["duration"]))
+    elif kind == "appointment.status" and event.get("status") == "paid":
+        mark_paid(appt_id)
+    elif kind == "appointment.status" and event.get("status") == "cancelled":
+        slots.release(appt_id)
+        update_appt(appt_id, checkout_pending=False, cancelled=True)
+        _revoke_join(appt_id, get_appt(appt_id))
+    elif kind == "appointment.updated":
+        update_appt(appt_id, **event["fields"])
+
+_replayed = False
+
+async def _rebuild_store():
+    # Con el store en memoria, después de un reinicio los turnos salen del event log.
+    # (FastAPI puede correr dos veces los startup de un router incluido)
+    global _replayed
+    if not _replayed and db.APPT_STORE == "memory" and eventlog.EVENTLOG_DIR:
+        _replayed = True
+        n = await run_in_threadpool(eventlog.replay, _replay_event)
+        if n:
+            print(f"Event log: {n} eventos reaplicados al store.")
+
+router.add_event_handler("startup", _rebuild_store)
+router.add_event_handler("startup", eventlog.start)
+router.add_event_handler("shutdown", eventlog.stop)
 
 @router.post("/appointments", response_model=ApptOut)
-def create_appointment(appt: ApptIn):
+async def create_appointment(
+    appt: ApptIn,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    if not idempotency_key:
+        return await _create_appointment(appt)
+    try:
+        return await idem_cache.run(
+            idempotency_key, appt.model_dump(), lambda: _create_appointment(appt)
+        )
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otros datos")
+
+async def _create_appointment(appt: ApptIn) -> dict:
     # Normalizamos fecha (guardada en UTC)
     if appt.start_at.tzinfo is None:
         start_utc = appt.start_at.replace(tzinfo=timezone.utc)
@@ -67,9 +187,31 @@ def create_appointment(appt: ApptIn):
     appt_id = str(uuid.uuid4())
     join_url = _build_join_url(appt_id)
 
+    doctor_id = appt.doctor_id or _DEFAULT_DOCTOR_ID
+    end_utc = start_utc + timedelta(minutes=appt.duration)
+    if not await _store_call(slots.reserve, doctor_id, appt_id, start_utc, end_utc):
+        raise HTTPException(status_code=409, detail="Horario no disponible")
+
     checkout_url = None
+    deferred = False
     if _MP_INTEGRATION:
-        checkout_url = _create_mp_preference(appt_id, appt)
+        pref = _build_preference(appt_id, appt)
+        deferred = deferred_checkout.always
+        if not deferred:
+            try:
+                checkout_url, _ = await _create_mp_preference(appt_id, pref)
+            except mp_client.MPUnavailable as e:
+                if not deferred_checkout.can_defer():
+                    await _store_call(slots.release, appt_id)
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Mercado Pago no disponible",
+                        headers={"Retry-After": str(int(e.retry_after))},
+                    )
+                deferred = True
+            except Exception:
+                await _store_call(slots.release, appt_id)
+                raise HTTPException(status_code=502, detail="Error con Mercado Pago")
 
     record = {
         "id": appt_id,
@@ -79,23 +221,74 @@ def create_appointment(appt: ApptIn):
         "price": appt.price,
         "duration": appt.duration,
         "start_at": start_utc.isoformat(),
+        "doctor_id": doctor_id,
         "join_url": join_url,
         "paid": False if _MP_INTEGRATION else True,  # si no hay MP, lo damos por pago p/ pruebas
+        "checkout_pending": deferred,
+        "checkout_url": checkout_url,
+    }
+    await _store_call(save_appt, record)
+    # El store en memoria no sobrevive un reinicio: el turno queda en disco antes de responder
+    await eventlog.durable(eventlog.record("appointment.created", appt_id, record=record))
+    if deferred:
+        deferred_checkout.defer(appt_id, pref)
+
+    return {
+        "id": appt_id,
+        "checkout_url": checkout_url,
+        "join_url": None if _MP_INTEGRATION else join_url,
+        "paid": record["paid"],
+        "join_token": None if _MP_INTEGRATION else jointoken.issue(appt_id, start_utc, appt.duration),
     }
-    save_appt(record)
 
-    return {"id": appt_id, "checkout_url": checkout_url, "join_url": None if _MP_INTEGRATION else join_url, "paid": record["paid"]}
+@router.get("/appointments/{appointment_id}/checkout", response_model=ApptOut)
+def checkout(appointment_id: str, response: Response):
+    # Para turnos creados en modo diferido: 202 mientras se genera el link
+    info = deferred_checkout.status(appointment_id)
+    if info is None:
+        # Lo creó otro worker (o antes de reiniciar): el estado sale del store
+        appt = get_appt(appointment_id)
+        if appt is None or "checkout_pending" not in appt:
+            raise HTTPException(status_code=404, detail="Checkout no encontrado")
+        state = ("failed" if appt.get("cancelled") else
+                 "pending" if appt.get("checkout_pending") else "ready")
+        info = {"state": state, "checkout_url": appt.get("checkout_url")}
+    if info["state"] == "failed":
+        raise HTTPException(status_code=410, detail="No se pudo generar el pago; el horario fue liberado")
+    if info["state"] == "pending":
+        response.status_code = 202
+        response.headers["Retry-After"] = str(int(deferred_checkout.retry_every) or 1)
+    return {"id": appointment_id, "checkout_url": info["checkout_url"], "paid": False}
 
 @router.get("/appointments/{appointment_id}/join", response_model=ApptOut)
-def join(appointment_id: str):
+def join(appointment_id: str, token: str | None = None):
+    # Camino rápido: el token firmado ya dice que está pago y hasta cuándo vale
+    if token:
+        try:
+            jointoken.verify(token, appointment_id)
+        except jointoken.InvalidJoinToken as e:
+            raise HTTPException(status_code=403, detail=f"Token inválido: {e}")
+        return {
+            "id": appointment_id,
+            "checkout_url": None,
+            "join_url": _build_join_url(appointment_id),
+            "paid": True,
+            "join_token": token,
+        }
+
     appt = get_appt(appointment_id)
     if not appt:
         raise HTTPException(status_code=404, detail="Turno no encontrado")
+    if appt.get("cancelled") or jointoken.is_revoked(appointment_id):
+        raise HTTPException(status_code=403, detail="Acceso revocado")
     if _MP_INTEGRATION and not appt.get("paid"):
         raise HTTPException(status_code=402, detail="Pago pendiente")
+    # Ya pago: emitimos el token para que las próximas entradas no toquen el store
+    start = datetime.fromisoformat(appt["start_at"])
     return {
         "id": appt["id"],
         "checkout_url": None,
         "join_url": appt["join_url"],
         "paid": appt["paid"],
+        "join_token": jointoken.issue(appt["id"], start, appt["duration"]),
     }
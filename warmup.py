@@ -0,0 +1,129 @@
+# warmup.py — calentamiento en segundo plano y estado para /ready
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+WARMUP_RETRIES = int(os.getenv("WARMUP_RETRIES", "8"))      # intentos de un paso required
+WARMUP_RETRY_S = float(os.getenv("WARMUP_RETRY_S", "1"))    # primera espera; se duplica
+WARMUP_RETRY_MAX_S = float(os.getenv("WARMUP_RETRY_MAX_S", "30"))
+
+StepFn = Callable[[], Awaitable[Any]]
+
+
+class _Step:
+    __slots__ = ("name", "fn", "after", "required", "state", "detail", "seconds", "attempts", "done")
+
+    def __init__(self, name: str, fn: StepFn, after: Sequence[str], required: bool):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.required = required
+        self.state = "pending"  # pending | running | retrying | ok | error
+        self.detail: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self.attempts = 0
+        self.done: Optional[asyncio.Event] = None
+
+
+class WarmUp:
+    """
+    Pasos de arranque que corren en segundo plano, sin demorar el startup.
+    Cada paso puede depender de otros (`after`). La app está lista cuando
+    terminaron todos y ningún paso `required` falló.
+
+    Un paso `required` que falla (ej. la DB todavía no acepta conexiones) se
+    reintenta con espera exponencial hasta `retries` intentos; recién ahí
+    queda en error. Sus dependientes esperan el resultado final.
+    """
+
+    def __init__(self, retries: int = WARMUP_RETRIES, retry_delay: float = WARMUP_RETRY_S,
+                 max_delay: float = WARMUP_RETRY_MAX_S):
+        self.retries = max(1, retries)
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self._steps: Dict[str, _Step] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def step(self, name: str, after: Sequence[str] = (), required: bool = True):
+        """Decorador: registra una corrutina sin argumentos como paso."""
+        def wrap(fn: StepFn) -> StepFn:
+            self._steps[name] = _Step(name, fn, after, required)
+            return fn
+        return wrap
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        for s in self._steps.values():
+            s.done = asyncio.Event()
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        await asyncio.gather(*(self._run_step(s) for s in self._steps.values()))
+        self.finished_at = time.monotonic()
+        took = self.finished_at - self.started_at
+        print(f"Warm-up {'completo' if self.ready else 'con errores'} en {took:.2f}s.")
+
+    async def _run_step(self, s: _Step) -> None:
+        try:
+            for dep in s.after:
+                await self._steps[dep].done.wait()
+            attempts = self.retries if s.required else 1
+            delay = self.retry_delay
+            while True:
+                s.state = "running"
+                s.attempts += 1
+                t0 = time.perf_counter()
+                try:
+                    result = await s.fn()
+                except Exception as e:
+                    s.detail = f"{type(e).__name__}: {e}"
+                    if s.attempts >= attempts:
+                        s.state = "error"
+                        print(f"ERROR en warm-up '{s.name}' ({s.attempts} intentos):", e)
+                        return
+                    s.state = "retrying"
+                    print(f"Warm-up '{s.name}' falló ({e}); reintento en {delay:.0f}s.")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+                s.seconds = round(time.perf_counter() - t0, 4)
+                s.state = "ok"
+                s.detail = None if result is None else str(result)
+                return
+        finally:
+            s.done.set()
+
+    async def wait(self, name: str) -> None:
+        """Espera a que el paso termine (bien o mal). Si no arrancó, no espera."""
+        s = self._steps.get(name)
+        if s is not None and s.done is not None and not s.done.is_set():
+            await s.done.wait()
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None and all(
+            s.state == "ok" for s in self._steps.values() if s.required
+        )
+
+    def report(self) -> Dict[str, Any]:
+        steps: List[Dict[str, Any]] = [
+            {"name": s.name, "state": s.state, "seconds": s.seconds, "detail": s.detail,
+             "required": s.required, "attempts": s.attempts}
+            for s in self._steps.values()
+        ]
+        return {"ready": self.ready, "steps": steps}
@@ -0,0 +1,223 @@
+# webhooks.py — ingesta idempotente y por lotes de notificaciones de Mercado Pago
+
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import WEBHOOK_LATENCY
+
+# (appointment_id, status) o None si el evento no cambia ningún turno
+Resolution = Optional[Tuple[str, str]]
+Resolver = Callable[[str, str, Dict[str, Any]], Awaitable[Resolution]]
+# Si es una corrutina se espera en el event loop; si no, corre en el threadpool
+Applier = Callable[[str, List[str]], Union[None, Awaitable[None]]]
+# (topic, resource_id, action, data, intento)
+Item = Tuple[str, str, str, Dict[str, Any], int]
+
+
+def extract_event(data: Dict[str, Any], query: Dict[str, str]) -> Tuple[str, str, str]:
+    """
+    Devuelve (topic, resource_id, action) de una notificación.
+    MP usa tanto el formato webhook ({"type", "action", "data": {"id"}})
+    como el IPN por query string (?topic=payment&id=123).
+    """
+    topic = data.get("type") or data.get("topic") or query.get("type") or query.get("topic") or ""
+    data_obj = data.get("data") if isinstance(data.get("data"), dict) else {}
+    resource_id = (
+        data_obj.get("id")
+        or data.get("id")
+        or query.get("data.id")
+        or query.get("id")
+        or ""
+    )
+    action = data.get("action") or ""
+    return str(topic), str(resource_id), str(action)
+
+
+class SeenSet:
+    """Conjunto acotado con expiración (LRU + TTL) para descartar duplicados."""
+
+    def __init__(self, max_size: int = 50000, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def add(self, key: Hashable) -> bool:
+        """Registra la clave. Devuelve False si ya estaba (y no expiró)."""
+        now = time.monotonic()
+        seen_at = self._items.get(key)
+        if seen_at is not None and now - seen_at < self.ttl:
+            self._items.move_to_end(key)
+            return False
+        self._items[key] = now
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return True
+
+    def discard(self, key: Hashable) -> None:
+        self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class WebhookIngestor:
+    """
+    Acepta eventos sin tocar la DB: descarta duplicados y encola.
+    Un worker en segundo plano resuelve cada evento a (turno, estado)
+    y aplica los cambios agrupados por estado con `apply(status, ids)`
+    (p. ej. un UPDATE ... WHERE id IN (...)), en el threadpool salvo que
+    sea una corrutina.
+    Si resolver o aplicar un evento falla, se reintenta con backoff hasta
+    `max_retries` veces; si igual falla, se olvida la clave para que el
+    reintento de MP no se descarte como duplicado.
+    """
+
+    def __init__(
+        self,
+        resolve: Resolver,
+        apply: Applier,
+        *,
+        max_batch: int = 500,
+        max_delay: float = 0.2,
+        max_queue: int = 10000,
+        seen_size: int = 50000,
+        seen_ttl: float = 600.0,
+        max_retries: int = 5,
+        retry_base: float = 1.0,
+    ):
+        self.resolve = resolve
+        self.apply = apply
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.seen = SeenSet(seen_size, seen_ttl)
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self._retries: Dict[asyncio.TimerHandle, Item] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Procesa lo pendiente y detiene el worker."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        # Reintentos que no llegaron a correr: que los reenvíe MP
+        for handle, item in self._retries.items():
+            handle.cancel()
+            self.seen.discard(item[:3])
+        self._retries.clear()
+
+    def accept(self, topic: str, resource_id: str, action: str, data: Dict[str, Any]) -> bool:
+        """
+        Encola el evento. Devuelve False si es un duplicado reciente.
+        Lanza RuntimeError si la cola está llena, para que MP reintente.
+        """
+        if not self.running:
+            raise RuntimeError("WebhookIngestor no está iniciado.")
+        key = (topic, resource_id, action)
+        if not self.seen.add(key):
+            return False
+        try:
+            self._queue.put_nowait((topic, resource_id, action, data, 0))
+        except asyncio.QueueFull:
+            self.seen.discard(key)
+            raise RuntimeError("Cola de webhooks llena.")
+        return True
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._process(batch)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _retry(self, item: Item) -> None:
+        """Vuelve a encolar el evento más tarde; agotados los intentos, libera la clave."""
+        topic, rid, action, data, attempt = item
+        key = (topic, rid, action)
+        if attempt >= self.max_retries or not self.running:
+            print(f"ATENCIÓN: webhook {key} descartado tras {attempt + 1} intentos; queda para el reintento de MP.")
+            self.seen.discard(key)
+            return
+        delay = min(60.0, self.retry_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+        retry = (topic, rid, action, data, attempt + 1)
+
+        def requeue():
+            self._retries.pop(handle, None)
+            try:
+                self._queue.put_nowait(retry)
+            except asyncio.QueueFull:
+                self.seen.discard(key)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retries[handle] = retry
+
+    async def _process(self, batch: List[Item]) -> None:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.resolve(topic, rid, data) for topic, rid, _, data, _ in batch),
+            return_exceptions=True,
+        )
+        WEBHOOK_LATENCY.observe(time.perf_counter() - t0, "resolve")
+        by_status: Dict[str, Dict[str, List[Item]]] = {}
+        for item, res in zip(batch, results):
+            if isinstance(res, Exception):
+                print("ERROR al resolver webhook:", res)
+                self._retry(item)
+                continue
+            if res is None:
+                continue
+            appt_id, status = res
+            by_status.setdefault(status, {}).setdefault(appt_id, []).append(item)
+
+        for status, by_id in by_status.items():
+            ids = list(by_id)
+            t0 = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(self.apply):
+                    await self.apply(status, ids)
+                else:
+                    await run_in_threadpool(self.apply, status, ids)
+            except Exception as e:
+                print(f"ERROR al actualizar {len(ids)} turnos a '{status}':", e)
+                for items in by_id.values():
+                    for item in items:
+                        self._retry(item)
+            WEBHOOK_LATENCY.observe(time.perf_counter() - t0, "apply")
@@ -0,0 +1,137 @@
+# writebehind.py — cola write-behind con group commit para INSERTs
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from metrics import DB_INSERT_LATENCY, DB_INSERT_ROWS
+
+
+class WriteBehindQueue:
+    """
+    Encola filas en memoria y un flusher en segundo plano las inserta en lote
+    (un solo INSERT multi-fila y un solo COMMIT por lote).
+
+    El lote se escribe cuando llega a `max_batch` filas o cuando la fila más
+    vieja lleva `max_delay` segundos esperando, lo que ocurra primero.
+    `submit(..., durable=True)` espera a que el lote de esa fila haga COMMIT.
+    Con `async_engine` el INSERT corre en el event loop en vez del threadpool.
+    Si un lote falla, `on_failed(filas)` recibe las filas que no se guardaron.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table: Table,
+        *,
+        max_batch: int = 100,
+        max_delay: float = 0.05,
+        max_queue: int = 10000,
+        async_engine: Optional[AsyncEngine] = None,
+        on_failed: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self.engine = engine
+        self.async_engine = async_engine
+        self.table = table
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.on_failed = on_failed
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detiene el flusher después de escribir todo lo pendiente."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, row: Dict[str, Any], durable: bool = False) -> None:
+        """
+        Encola una fila. Si la cola está llena, espera (backpressure).
+        Con durable=True vuelve recién cuando la fila quedó commiteada
+        y propaga el error si el lote falló.
+        """
+        if not self.running:
+            raise RuntimeError("WriteBehindQueue no está iniciada.")
+        fut = asyncio.get_running_loop().create_future() if durable else None
+        await self._queue.put((row, fut))
+        if fut is not None:
+            await fut
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch: List[Tuple[Dict[str, Any], Optional[asyncio.Future]]] = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], Optional[asyncio.Future]]]) -> None:
+        rows = [row for row, _ in batch]
+        try:
+            if self.async_engine is not None:
+                await self._insert_async(rows)
+            else:
+                await run_in_threadpool(self._insert, rows)
+        except Exception as e:
+            print(f"ERROR al guardar lote de {len(rows)} turnos en DB:", e)
+            for _, fut in batch:
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+            if self.on_failed is not None:
+                try:
+                    self.on_failed(rows)
+                except Exception as e2:
+                    print("ERROR en on_failed del write-behind:", e2)
+            return
+        print(f"Lote de {len(rows)} turnos guardado en DB.")
+        for _, fut in batch:
+            if fut is not None and not fut.done():
+                fut.set_result(None)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> None:
+        with DB_INSERT_LATENCY.time("batch"):
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert().values(rows))
+        DB_INSERT_ROWS.inc("batch", amount=len(rows))
+
+    async def _insert_async(self, rows: List[Dict[str, Any]]) -> None:
+        with DB_INSERT_LATENCY.time("batch"):
+            async with self.async_engine.begin() as conn:
+                await conn.execute(self.table.insert().values(rows))
+        DB_INSERT_ROWS.inc("batch", amount=len(rows))